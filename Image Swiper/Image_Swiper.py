@@ -1,13 +1,18 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
-import os
+from PIL import ImageTk
+import math
+import queue
+import threading
 from pathlib import Path
-import winshell
-import random
+import time
 from datetime import datetime
-import piexif
-import sqlite3
+from swiper_loader import quick_preview, load_scaled, RAW_EXTENSIONS
+from swiper_engine import ReviewEngine
+from swiper_dedupe import DuplicateFinder
+from swiper_grid import GridPage, thumbnail_prefetcher
+import swiper_trace
+from swiper_trace import span
 
 # Register HEIC support
 heic_support = False
@@ -19,6 +24,18 @@ try:
 except Exception as e:
     print(f"WARNING: HEIC support not available: {e}")
 
+# Disk space allowed for cached previews (least recently used are deleted first)
+PREVIEW_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# How often the review session is snapshotted (it's also saved on close and on switching folders)
+SESSION_SAVE_MS = 30 * 1000
+
+SWIPE_INSTRUCTIONS = "Keyboard shortcuts: Q = Delete | W = Keep | ← = Previous | → = Next | Backspace = Undo | T = Timing"
+DUPLICATE_INSTRUCTIONS = ("Duplicates: ← / → = Choose the one to keep | Q = Keep only that one | "
+                          "W = Keep them all | Backspace = Undo")
+GRID_INSTRUCTIONS = ("Grid: Arrows = Move | Space / Click = Select | Q = Delete selected, keep the rest | "
+                     "W = Keep page | PgUp / PgDn = Scroll | Double-click = Open | G = Grid off")
+
 class ImageOrganizer:
     def __init__(self, root):
         self.root = root
@@ -26,110 +43,60 @@ class ImageOrganizer:
         self.root.geometry("900x700")
         self.root.configure(bg='#2b2b2b')
         
-        self.images = []
-        self.current_index = 0
+        # Everything but the drawing - folder, review order, caches and decisions - lives in the engine
+        self.engine = ReviewEngine(Path(__file__).parent, preview_bytes=PREVIEW_CACHE_BYTES)
+        print(f"Database initialized at: {self.engine.db_path}")
+        
         self.photo = None
-        self.random_mode = False
-        self.include_subdirs = True
-        self.on_this_day_mode = False
-        self.last_deleted = None
-        self.last_deleted_size = 0
-        self.processed_count = 0
-        self.deleted_count = 0
-        self.space_saved_mb = 0
-        
-        # Database setup - stored next to script
-        script_dir = Path(__file__).parent
-        self.db_path = script_dir / "OnThisDay_cache.db"
-        self.init_database()
-        
-        # Supported image formats (expanded)
-        self.image_extensions = {
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif', 
-            '.ico', '.heic', '.heif', '.jfif', '.ppm', '.pgm', '.pbm', '.pnm',
-            '.svg', '.raw', '.cr2', '.nef', '.arw', '.dng', '.orf'
-        }
+        self.canvas_size = None
+        self.resize_job = None
+        self.full_future = None
+        self.full_future_path = None
+        self.swipe_started = time.perf_counter()
+        self.first_paint_ms = None
+        
+        # Nothing to review until the scan or index delivers images
+        self.waiting_for_scan = False
+        self.scan_summary = None
+        
+        # Duplicates mode: groups of near-identical images, each reviewed as one decision
+        self.duplicates_mode = False
+        self.duplicate_finder = None
+        self.clusters = []
+        self.cluster_index = 0
+        self.cluster_members = []
+        self.cluster_pick = 0
+        self.cluster_layout = None
+        self.tile_photos = []
+        # {filepath: catalog row} for the images searched for duplicates, to record which were kept
+        self.duplicate_rows = {}
+        self.duplicate_catalog = None
+        
+        # Grid mode: a page of thumbnails, decoded on their own worker pool
+        self.grid_mode = False
+        self.grid = None
+        self.thumbs = thumbnail_prefetcher()
+        self.grid_tiles = {}
+        self.grid_photos = {}
+        
+        # Span timing: exported if SWIPER_TRACE names a file, and shown on the canvas with T
+        self.trace_path = swiper_trace.enable_from_env()
+        if self.trace_path:
+            print(f"Tracing to: {self.trace_path}")
+        self.hud = False
+        self.tk_thread = threading.get_ident()
+        self.swipe_started_ns = swiper_trace.now()
         
         self.setup_ui()
         self.bind_keys()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(50, self.poll_prefetched)
+        self.root.after(100, self.poll_deletions)
+        self.root.after(SESSION_SAVE_MS, self.autosave_session)
+        self.root.after(500, self.poll_watcher)
+        if self.trace_path:
+            self.root.after(1000, self.flush_trace)
     
-    def init_database(self):
-        """Initialize SQLite database for caching image metadata"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS image_cache (
-                filepath TEXT PRIMARY KEY,
-                date_taken TEXT,
-                file_size INTEGER,
-                last_modified REAL
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        print(f"Database initialized at: {self.db_path}")
-    
-    def get_cached_date(self, img_path):
-        """Get date from cache, or extract and cache it if not found"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if file exists in cache and hasn't been modified
-        cursor.execute('SELECT date_taken, last_modified FROM image_cache WHERE filepath = ?', 
-                      (str(img_path),))
-        result = cursor.fetchone()
-        
-        current_mtime = img_path.stat().st_mtime
-        
-        # If cached and file hasn't changed, use cached date
-        if result and result[1] == current_mtime:
-            conn.close()
-            if result[0]:
-                return datetime.fromisoformat(result[0])
-            return None
-        
-        # Otherwise, extract date and update cache
-        img_date = self.extract_image_date(img_path)
-        file_size = img_path.stat().st_size
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO image_cache (filepath, date_taken, file_size, last_modified)
-            VALUES (?, ?, ?, ?)
-        ''', (str(img_path), 
-              img_date.isoformat() if img_date else None,
-              file_size,
-              current_mtime))
-        
-        conn.commit()
-        conn.close()
-        
-        return img_date
-    
-    def extract_image_date(self, img_path):
-        """Extract date from EXIF data, fall back to file modification date"""
-        try:
-            # Try EXIF data first
-            exif_data = piexif.load(str(img_path))
-            if piexif.ExifIFD.DateTimeOriginal in exif_data['Exif']:
-                date_str = exif_data['Exif'][piexif.ExifIFD.DateTimeOriginal].decode()
-                return datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-        except:
-            pass
-        
-        # Fall back to file modification date
-        try:
-            return datetime.fromtimestamp(img_path.stat().st_mtime)
-        except:
-            return None
-    
-    def matches_this_day(self, img_date, reference_date=None):
-        """Check if image was taken on this day in any year"""
-        if img_date is None:
-            return False
-        if reference_date is None:
-            reference_date = datetime.now()
-        return img_date.month == reference_date.month and img_date.day == reference_date.day
-        
     def setup_ui(self):
         # Top bar with folder selection and counter
         top_frame = tk.Frame(self.root, bg='#2b2b2b', pady=10)
@@ -201,6 +168,36 @@ class ImageOrganizer:
         )
         self.this_day_check.pack(side=tk.LEFT, padx=10)
         
+        # Duplicates checkbox
+        self.duplicates_var = tk.BooleanVar(value=False)
+        self.duplicates_check = tk.Checkbutton(
+            top_frame,
+            text="🔁 Duplicates",
+            variable=self.duplicates_var,
+            command=self.toggle_duplicates,
+            bg='#2b2b2b',
+            fg='#64B5F6',
+            selectcolor='#1a1a1a',
+            font=('Arial', 10, 'bold'),
+            cursor='hand2'
+        )
+        self.duplicates_check.pack(side=tk.LEFT, padx=10)
+        
+        # Grid checkbox
+        self.grid_var = tk.BooleanVar(value=False)
+        self.grid_check = tk.Checkbutton(
+            top_frame,
+            text="▦ Grid",
+            variable=self.grid_var,
+            command=self.toggle_grid,
+            bg='#2b2b2b',
+            fg='white',
+            selectcolor='#1a1a1a',
+            font=('Arial', 10),
+            cursor='hand2'
+        )
+        self.grid_check.pack(side=tk.LEFT, padx=10)
+        
         # Stats label
         self.stats_label = tk.Label(
             top_frame,
@@ -211,6 +208,16 @@ class ImageOrganizer:
         )
         self.stats_label.pack(side=tk.LEFT, padx=20)
         
+        # Timing label (time-to-first-pixel for the current image)
+        self.timing_label = tk.Label(
+            top_frame,
+            text="",
+            bg='#2b2b2b',
+            fg='#888888',
+            font=('Arial', 9)
+        )
+        self.timing_label.pack(side=tk.LEFT, padx=10)
+        
         # Image display area
         self.canvas = tk.Canvas(
             self.root,
@@ -218,6 +225,7 @@ class ImageOrganizer:
             highlightthickness=0
         )
         self.canvas.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        self.canvas.bind('<Configure>', self.on_canvas_resize)
         
         # Date label (shows when photo was taken)
         self.date_label = tk.Label(
@@ -248,6 +256,16 @@ class ImageOrganizer:
         )
         self.filename_label.pack(pady=(0, 5))
         
+        # Status line (e.g. undo confirmations) - doesn't interrupt swiping like a dialog would
+        self.status_label = tk.Label(
+            self.root,
+            text="",
+            bg='#2b2b2b',
+            fg='#FF9800',
+            font=('Arial', 9)
+        )
+        self.status_label.pack()
+        
         # Button frame
         button_frame = tk.Frame(self.root, bg='#2b2b2b', pady=20)
         button_frame.pack()
@@ -298,14 +316,14 @@ class ImageOrganizer:
         self.keep_btn.pack(side=tk.LEFT, padx=20)
         
         # Instructions
-        instructions = tk.Label(
+        self.instructions_label = tk.Label(
             self.root,
-            text="Keyboard shortcuts: Q = Delete | W = Keep | ← = Previous | → = Next | Backspace = Undo",
+            text=SWIPE_INSTRUCTIONS,
             bg='#2b2b2b',
             fg='#888888',
             font=('Arial', 9)
         )
-        instructions.pack(pady=5)
+        self.instructions_label.pack(pady=5)
         
     def bind_keys(self):
         self.root.bind('<Left>', lambda e: self.previous_image())
@@ -315,173 +333,546 @@ class ImageOrganizer:
         self.root.bind('w', lambda e: self.keep_image())
         self.root.bind('W', lambda e: self.keep_image())
         self.root.bind('<BackSpace>', lambda e: self.undo_delete())
+        # Grid mode
+        self.root.bind('<Up>', lambda e: self.grid_move(-self.grid.columns) if self.grid_mode else None)
+        self.root.bind('<Down>', lambda e: self.grid_move(self.grid.columns) if self.grid_mode else None)
+        self.root.bind('<space>', lambda e: self.grid_toggle_selection(self.grid.cursor) if self.grid_mode else None)
+        self.root.bind('<Prior>', lambda e: self.grid_scroll(-self.grid.rows) if self.grid_mode else None)
+        self.root.bind('<Next>', lambda e: self.grid_scroll(self.grid.rows) if self.grid_mode else None)
+        self.root.bind('g', lambda e: self.grid_key())
+        self.root.bind('G', lambda e: self.grid_key())
+        self.root.bind('t', lambda e: self.toggle_hud())
+        self.root.bind('T', lambda e: self.toggle_hud())
+        self.canvas.bind('<Button-1>', self.on_canvas_click)
+        self.canvas.bind('<Double-Button-1>', self.on_canvas_double_click)
+        self.canvas.bind('<MouseWheel>', lambda e: self.grid_scroll(-1 if e.delta > 0 else 1) if self.grid_mode else None)
+        self.canvas.bind('<Button-4>', lambda e: self.grid_scroll(-1) if self.grid_mode else None)
+        self.canvas.bind('<Button-5>', lambda e: self.grid_scroll(1) if self.grid_mode else None)
+    
+    def on_close(self):
+        self.stop_background_scans()
+        self.thumbs.shutdown()
+        self.engine.close()
+        swiper_trace.close()
+        self.root.destroy()
+    
+    def get_canvas_size(self):
+        """Current canvas size, forcing a layout pass the first time"""
+        if self.canvas_size is None:
+            with span('update_idletasks'):
+                self.root.update_idletasks()
+            self.canvas_size = (max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height()))
+        return self.canvas_size
+    
+    def on_canvas_resize(self, event):
+        """Drop prefetched work for the old size and redraw once resizing settles"""
+        new_size = (max(1, event.width), max(1, event.height))
+        if new_size == self.canvas_size:
+            return
+        self.canvas_size = new_size
+        self.engine.prefetcher.cancel()
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(150, self.redraw_after_resize)
+    
+    def redraw_after_resize(self):
+        self.resize_job = None
+        if self.duplicates_mode:
+            if self.cluster_members:
+                self.draw_cluster()
+            return
+        if self.grid_mode:
+            self.thumbs.cancel()
+            self.grid.resize(self.canvas_size)
+        if self.engine.images and self.engine.current_index < len(self.engine.images):
+            self.show_current_image()
+    
+    def poll_prefetched(self):
+        """Turn images decoded by the workers into PhotoImages, on the Tk thread"""
+        while True:
+            try:
+                key = self.engine.prefetcher.ready.get_nowait()
+            except queue.Empty:
+                break
+            img = self.engine.image_cache.get(key)
+            if img is not None and self.engine.image_cache.get_photo(key) is None:
+                with span('photo_image'):
+                    photo = ImageTk.PhotoImage(img)
+                self.engine.image_cache.attach_photo(key, photo)
+        
+        # Thumbnails for the grid page
+        while True:
+            try:
+                key = self.thumbs.ready.get_nowait()
+            except queue.Empty:
+                break
+            if self.grid_mode:
+                self.draw_tile(key)
+        
+        # Swap the full-quality image in for the quick preview once it's decoded
+        future = self.full_future
+        if future is not None and future.done():
+            self.full_future = None
+            img_path = self.full_future_path
+            still_current = (self.engine.current_index < len(self.engine.images)
+                             and self.engine.images[self.engine.current_index] == img_path)
+            if still_current and not future.cancelled():
+                if future.exception() is not None:
+                    self.show_load_error(img_path, future.exception())
+                elif future.result() is not None:
+                    key, img = future.result()
+                    photo = self.engine.image_cache.get_photo(key)
+                    if photo is None:
+                        with span('photo_image'):
+                            photo = ImageTk.PhotoImage(img)
+                        self.engine.image_cache.attach_photo(key, photo)
+                    self.draw_photo(photo)
+        
+        # PhotoImages the workers evicted are only deleted here, on the Tk thread
+        self.engine.image_cache.release_photos()
+        self.thumbs.cache.release_photos()
+        self.root.after(20, self.poll_prefetched)
+    
+    def schedule_prefetch(self):
+        """Queue the next few images (and the previous one) for background decoding"""
+        self.engine.prefetch(self.get_canvas_size())
         
     def select_folder(self):
         folder = filedialog.askdirectory(title="Select folder with images")
         if folder:
-            self.processed_count = 0
-            self.deleted_count = 0
-            self.space_saved_mb = 0
-            self.stats_label.config(text="Processed: 0 | Deleted: 0 | Saved: 0 MB")
             self.load_images(folder)
     
     def toggle_subdirs(self):
-        self.include_subdirs = self.subdirs_var.get()
+        """Re-filter the loaded catalog, staying on the current image if it's still included"""
+        self.engine.include_subdirs = self.subdirs_var.get()
+        if self.engine.catalog is not None:
+            self.apply_view(keep_current=True)
     
     def toggle_this_day(self):
-        """Toggle On This Day mode and reload images if folder is already selected"""
-        self.on_this_day_mode = self.this_day_var.get()
-        # If images are already loaded, re-filter them
-        if hasattr(self, 'current_folder') and self.current_folder:
-            self.load_images(self.current_folder)
-            
-    def load_images(self, folder):
-        self.current_folder = folder
-        self.images = []
-        path = Path(folder)
-        
-        # Show loading message for On This Day mode
-        if self.on_this_day_mode:
-            self.counter_label.config(text="Scanning for 'On This Day' photos...")
-            self.root.update()
-        
-        # Recursively or non-recursively find image files based on checkbox
-        if self.include_subdirs:
-            for ext in self.image_extensions:
-                self.images.extend(path.rglob(f'*{ext}'))
-                self.images.extend(path.rglob(f'*{ext.upper()}'))
+        """Toggle On This Day mode, re-filtering the loaded catalog"""
+        self.engine.on_this_day_mode = self.this_day_var.get()
+        if self.engine.catalog is not None:
+            self.apply_view()
+    
+    def apply_view(self, keep_current=False):
+        """Replace the review order after a checkbox change"""
+        if self.duplicates_mode:
+            # Look for duplicates among what the other checkboxes now select
+            self.find_duplicates()
+            return
+        self.engine.set_view(keep_current)
+        self.show_view()
+    
+    def show_view(self):
+        """Start on a freshly built review order"""
+        if self.grid is not None:
+            self.grid.selected.clear()
+        if self.engine.images:
+            self.start_review()
         else:
-            for ext in self.image_extensions:
-                self.images.extend(path.glob(f'*{ext}'))
-                self.images.extend(path.glob(f'*{ext.upper()}'))
-        
-        # Remove duplicates and sort
-        self.images = sorted(list(set(self.images)))
-        
-        # Filter by "On This Day" if enabled
-        if self.on_this_day_mode:
-            total_images = len(self.images)
-            filtered_images = []
-            for i, img in enumerate(self.images):
-                # Update progress every 100 images
-                if i % 100 == 0:
-                    self.counter_label.config(text=f"Scanning {i}/{total_images}...")
-                    self.root.update()
-                
-                img_date = self.get_cached_date(img)
-                if self.matches_this_day(img_date):
-                    filtered_images.append((img, img_date))
-            
-            # Sort by year (oldest first) to show progression over years
-            filtered_images.sort(key=lambda x: x[1] if x[1] else datetime.min)
-            self.images = [img for img, date in filtered_images]
+            self.show_empty_view()
+    
+    def start_review(self):
+        self.waiting_for_scan = False
+        self.delete_btn.config(state=tk.NORMAL)
+        self.keep_btn.config(state=tk.NORMAL)
+        self.show_current_image()
+    
+    def show_empty_view(self):
+        """Nothing matches the checkboxes - say why, or wait if the scan or index is still running"""
+        self.waiting_for_scan = True
+        self.canvas.delete("all")
+        self.path_label.config(text="")
+        self.filename_label.config(text="")
+        self.date_label.config(text="")
+        if self.engine.scanner is not None:
+            self.counter_label.config(text="Scanning...")
+        elif self.engine.index_updater is not None and not self.engine.dates_ready:
+            if self.engine.on_this_day_mode:
+                self.counter_label.config(text="Indexing photo dates for 'On This Day'...")
+            else:
+                self.counter_label.config(text="Loading...")
+        elif self.engine.on_this_day_mode:
+            today = datetime.now().strftime('%B %d')
+            messagebox.showinfo("No Memories", f"No photos found from {today} in previous years.")
+            self.counter_label.config(text="No images loaded")
+        else:
+            messagebox.showinfo("No Images", "No images found in the selected folder.")
+            self.counter_label.config(text="No images loaded")
             
-            if not self.images:
-                today = datetime.now().strftime('%B %d')
-                messagebox.showinfo("No Memories", f"No photos found from {today} in previous years.")
+    def load_images(self, folder):
+        if self.duplicates_mode:
+            self.duplicates_var.set(False)
+            self.leave_duplicates_mode()
+        if self.grid is not None:
+            self.grid.selected.clear()
+        self.stop_background_scans()
+        self.waiting_for_scan = True
+        
+        source = self.engine.open_folder(folder)
+        self.update_stats()
+        if source == 'session':
+            # Picking up where the last session left off; the checkboxes follow its settings
+            self.random_var.set(self.engine.random_mode)
+            self.subdirs_var.set(self.engine.include_subdirs)
+            self.this_day_var.set(self.engine.on_this_day_mode)
+            self.root.after(100, self.poll_index_updater, self.engine.index_updater)
+            self.show_view()
+            return
+        if source == 'index':
+            # Seen this folder before - loading from the index
+            self.counter_label.config(text="Loading...")
+            self.root.after(100, self.poll_index_updater, self.engine.index_updater)
+            return
+        
+        self.counter_label.config(text="Scanning...")
+        self.root.after(50, self.poll_scan, self.engine.scanner)
+    
+    def poll_scan(self, scanner):
+        """Pick up batches of paths from the background scan"""
+        if scanner is not self.engine.scanner:
+            # A newer scan has replaced this one
+            return
+        
+        _, finished = self.engine.poll_scan()
+        
+        if finished:
+            if not len(self.engine.catalog):
+                messagebox.showinfo("No Images", "No images found in the selected folder.")
                 self.counter_label.config(text="No images loaded")
                 return
+            progress = scanner.progress
+            self.scan_summary = (f"scanned {progress.entries:,} entries in {progress.elapsed:.1f}s, "
+                                 f"{progress.rate:,.0f}/sec")
+            # Now index the dates, for the date label and On This Day
+            self.start_index_update()
         
-        if not self.images:
-            messagebox.showinfo("No Images", "No images found in the selected folder.")
-            return
+        if self.waiting_for_scan and self.engine.current_index < len(self.engine.images):
+            self.start_review()
+        elif self.waiting_for_scan and finished:
+            self.show_empty_view()
+        elif self.grid_mode and len(self.grid_tiles) < self.grid.per_page:
+            # Fill the rest of the page as images are found
+            self.draw_grid()
+        elif self.engine.images:
+            self.update_counter()
         
-        # Apply random order if enabled (but not in On This Day mode)
-        if self.random_mode and not self.on_this_day_mode:
-            random.shuffle(self.images)
-            
-        self.current_index = 0
-        self.show_current_image()
-        self.delete_btn.config(state=tk.NORMAL)
-        self.keep_btn.config(state=tk.NORMAL)
+        if not finished:
+            self.root.after(100, self.poll_scan, scanner)
     
-    def toggle_random_mode(self):
-        self.random_mode = self.random_var.get()
-        # If images are already loaded, reshuffle or resort
-        if self.images:
-            if self.random_mode:
-                random.shuffle(self.images)
+    def stop_background_scans(self):
+        self.engine.stop_workers()
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.stop()
+            self.duplicate_finder = None
+    
+    def start_index_update(self, preload=False):
+        """Bring the metadata index up to date in the background (only changed directories are re-read)"""
+        updater = self.engine.start_index_update(preload=preload)
+        self.root.after(100, self.poll_index_updater, updater)
+    
+    def poll_index_updater(self, updater):
+        if updater is not self.engine.index_updater:
+            return
+        catalogs, finished = self.engine.poll_index()
+        for catalog in catalogs:
+            self.use_catalog(catalog)
+        if not finished:
+            if self.waiting_for_scan and self.engine.on_this_day_mode and not self.engine.dates_ready:
+                dates = updater.extractor.progress
+                self.counter_label.config(
+                    text=f"Indexing photo dates... {updater.progress.images:,} images found, "
+                         f"{dates.done:,}/{dates.submitted:,} dates read ({dates.rate:,.0f}/sec)"
+                )
+            self.root.after(100, self.poll_index_updater, updater)
+            return
+        if updater.error is not None:
+            print(f"WARNING: could not update the metadata index: {updater.error}")
+    
+    def use_catalog(self, catalog):
+        """Switch to a catalog built from the index, carrying on from the current image"""
+        # Nothing being reviewed yet?
+        restart = self.waiting_for_scan or (self.engine.on_this_day_mode and not self.engine.dates_ready)
+        if self.grid is not None:
+            self.grid.selected.clear()
+        finished = self.engine.current_index >= len(self.engine.images)
+        unchanged = self.engine.use_catalog(catalog, restart)
+        if restart:
+            if self.duplicates_mode:
+                self.find_duplicates()
             else:
-                self.images = sorted(self.images)
-            self.current_index = 0
+                self.show_view()
+            return
+        if self.duplicates_mode:
+            # The canvas is showing a duplicate group; the swipe order is picked up on leaving
+            return
+        if unchanged:
+            self.update_counter()
+        elif not (finished and self.engine.current_index >= len(self.engine.images)):
+            # (Already showing "All done!" - don't announce it again)
             self.show_current_image()
-        
-    def show_current_image(self):
-        if not self.images or self.current_index >= len(self.images):
-            messagebox.showinfo("Done!", "All images have been reviewed!")
+    
+    def toggle_duplicates(self):
+        """Switch between swiping single images and reviewing groups of near-identical ones"""
+        if not self.duplicates_var.get():
+            self.leave_duplicates_mode()
+            if self.engine.catalog is not None:
+                self.apply_view(keep_current=True)
+            return
+        if self.engine.catalog is None or self.engine.scanner is not None or not len(self.engine.catalog):
+            messagebox.showinfo("Duplicates", "Select a folder and let it finish loading first.")
+            self.duplicates_var.set(False)
+            return
+        if self.grid_mode:
+            self.grid_var.set(False)
+            self.toggle_grid()
+        self.duplicates_mode = True
+        self.engine.prefetcher.cancel()
+        self.delete_btn.config(text="✕ KEEP ONLY\nTHIS ONE (Q)")
+        self.keep_btn.config(text="✓ KEEP ALL\n(W)")
+        self.instructions_label.config(text=DUPLICATE_INSTRUCTIONS)
+        self.find_duplicates()
+    
+    def leave_duplicates_mode(self):
+        self.duplicates_mode = False
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.stop()
+            self.duplicate_finder = None
+        self.clusters = []
+        self.cluster_members = []
+        self.tile_photos = []
+        self.delete_btn.config(text="✕ DELETE\n(Q)")
+        self.keep_btn.config(text="✓ KEEP\n(W)")
+        self.instructions_label.config(text=SWIPE_INSTRUCTIONS)
+    
+    def find_duplicates(self):
+        """Hash (only what isn't hashed yet) and group the selected images in the background"""
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.stop()
+        catalog = self.engine.catalog
+        rows = catalog.select(recursive=self.engine.include_subdirs, month_day=self.engine.this_day_filter())
+        entries = [(catalog.path(row), catalog.mtime[row], catalog.size[row]) for row in rows]
+        self.duplicate_rows = {entry[0]: row for entry, row in zip(entries, rows)}
+        self.duplicate_catalog = catalog
+        self.clusters = []
+        self.cluster_members = []
+        self.canvas.delete("all")
+        self.counter_label.config(text="Looking for duplicates...")
+        self.delete_btn.config(state=tk.DISABLED)
+        self.keep_btn.config(state=tk.DISABLED)
+        self.duplicate_finder = DuplicateFinder(self.engine.store, self.engine.folder, entries).start()
+        self.root.after(100, self.poll_duplicate_finder, self.duplicate_finder)
+    
+    def poll_duplicate_finder(self, finder):
+        if finder is not self.duplicate_finder:
+            return
+        if not finder.done:
+            progress = finder.progress
+            if progress.submitted:
+                self.counter_label.config(
+                    text=f"Looking for duplicates... {progress.done:,}/{progress.submitted:,} images hashed "
+                         f"({progress.rate:,.0f}/sec)"
+                )
+            self.root.after(100, self.poll_duplicate_finder, finder)
+            return
+        self.duplicate_finder = None
+        if finder.error is not None or not finder.clusters:
+            if finder.error is not None:
+                messagebox.showerror("Error", f"Could not look for duplicates: {finder.error}")
+            else:
+                messagebox.showinfo("Duplicates", "No duplicates or burst shots found.")
+            self.duplicates_var.set(False)
+            self.leave_duplicates_mode()
+            self.apply_view(keep_current=True)
+            return
+        self.clusters = finder.clusters
+        self.cluster_index = 0
+        self.delete_btn.config(state=tk.NORMAL)
+        self.keep_btn.config(state=tk.NORMAL)
+        self.show_cluster()
+    
+    def show_cluster(self):
+        """Show the current duplicate group, skipping groups whittled down to one or already kept"""
+        while self.cluster_index < len(self.clusters):
+            members = [m for m in self.clusters[self.cluster_index] if not self.engine.deletions.is_deleted(m[0])]
+            if len(members) > 1 and not all(self.is_kept(path) for path, _ in members):
+                break
+            self.cluster_index += 1
+        else:
+            self.cluster_members = []
+            self.tile_photos = []
+            self.canvas.delete("all")
             self.delete_btn.config(state=tk.DISABLED)
             self.keep_btn.config(state=tk.DISABLED)
             self.counter_label.config(text="All done!")
-            self.canvas.delete("all")
             self.path_label.config(text="")
             self.filename_label.config(text="")
-            self.date_label.config(text="")
+            messagebox.showinfo("Done!", "All duplicate groups have been reviewed!")
+            return
+        self.cluster_members = members
+        # Suggest keeping the biggest file, usually the best quality copy
+        self.cluster_pick = max(range(len(members)), key=lambda i: members[i][1])
+        self.counter_label.config(
+            text=f"Group {self.cluster_index + 1} of {len(self.clusters)} ({len(members)} similar images)"
+        )
+        self.date_label.config(text="")
+        self.draw_cluster()
+    
+    def draw_cluster(self):
+        """Tile the group's images across the canvas"""
+        members = self.cluster_members
+        canvas_width, canvas_height = self.get_canvas_size()
+        columns = math.ceil(math.sqrt(len(members)))
+        rows = math.ceil(len(members) / columns)
+        tile_width = canvas_width // columns
+        tile_height = canvas_height // rows
+        self.cluster_layout = (columns, tile_width, tile_height)
+        self.canvas.delete("all")
+        self.tile_photos = []
+        for i, (path, size) in enumerate(members):
+            x = (i % columns) * tile_width + tile_width // 2
+            y = (i // columns) * tile_height
+            caption = Path(path).name
+            if size:
+                caption += f" - {size / (1024 * 1024):.1f} MB"
+            try:
+                img = load_scaled(Path(path), (max(1, tile_width - 16), max(1, tile_height - 36)))
+                photo = ImageTk.PhotoImage(img)
+                self.tile_photos.append(photo)
+                self.canvas.create_image(x, y + (tile_height - 20) // 2, image=photo, anchor=tk.CENTER)
+            except Exception as e:
+                self.canvas.create_text(x, y + tile_height // 2, text=f"Could not load: {e}", fill='#f44336')
+            self.canvas.create_text(x, y + tile_height - 12, text=caption, fill='#cccccc', font=('Arial', 9))
+        self.highlight_pick()
+    
+    def highlight_pick(self):
+        columns, tile_width, tile_height = self.cluster_layout
+        col, row = self.cluster_pick % columns, self.cluster_pick // columns
+        self.canvas.delete("pick")
+        self.canvas.create_rectangle(
+            col * tile_width + 3, row * tile_height + 3,
+            (col + 1) * tile_width - 3, (row + 1) * tile_height - 3,
+            outline='#4CAF50', width=4, tags="pick"
+        )
+        img_path = Path(self.cluster_members[self.cluster_pick][0])
+        self.path_label.config(text=str(img_path.parent))
+        self.filename_label.config(text=f"Keeping: {img_path.name}")
+    
+    def move_cluster_pick(self, step):
+        if not self.cluster_members:
+            return
+        self.cluster_pick = (self.cluster_pick + step) % len(self.cluster_members)
+        self.highlight_pick()
+    
+    def keep_cluster_pick(self):
+        """Keep the highlighted image and delete the rest of the group - one decision"""
+        if not self.cluster_members:
+            return
+        for i, (path, size) in enumerate(self.cluster_members):
+            if i != self.cluster_pick:
+                self.engine.delete_path(Path(path))
+        self.mark_kept([self.cluster_members[self.cluster_pick][0]])
+        self.engine.processed_count += len(self.cluster_members)
+        self.undo_btn.config(state=tk.NORMAL)
+        self.update_stats()
+        self.cluster_index += 1
+        self.show_cluster()
+    
+    def keep_whole_cluster(self):
+        if not self.cluster_members:
+            return
+        self.mark_kept([path for path, _ in self.cluster_members])
+        self.engine.processed_count += len(self.cluster_members)
+        self.update_stats()
+        self.cluster_index += 1
+        self.show_cluster()
+    
+    def is_kept(self, path):
+        row = self.duplicate_rows.get(path)
+        return row is not None and self.duplicate_catalog.decided[row] == 1
+    
+    def mark_kept(self, paths):
+        """Record duplicates kept, unless the catalog was swapped since the search (the rows would be stale)"""
+        if self.duplicate_catalog is not self.engine.catalog:
+            return
+        for path in paths:
+            row = self.duplicate_rows.get(path)
+            if row is not None:
+                self.duplicate_catalog.decided[row] = 1
+    
+    def update_counter(self):
+        text = f"Image {self.engine.current_index + 1} of {len(self.engine.images)}"
+        if self.grid_mode:
+            visible = self.grid.visible(len(self.engine.images))
+            text = f"Images {visible.start + 1}-{visible.stop} of {len(self.engine.images)}"
+            if self.grid.selected:
+                text += f" | {len(self.grid.selected)} selected"
+        if self.engine.scanner is not None:
+            text += f" (scanning... {self.engine.scanner.progress.rate:,.0f} entries/sec)"
+        elif self.scan_summary:
+            text += f" ({self.scan_summary})"
+        self.counter_label.config(text=text)
+    
+    def toggle_random_mode(self):
+        self.engine.random_mode = self.random_var.get()
+        # If images are already loaded, reshuffle or resort
+        if self.engine.images:
+            self.apply_view()
+        
+    def show_current_image(self):
+        if self.engine.scanner is not None and self.engine.current_index >= len(self.engine.images):
+            # Reviewed everything found so far - carry on when the next batch arrives
+            self.waiting_for_scan = True
+            self.counter_label.config(text=f"Scanning... ({self.engine.scanner.progress.rate:,.0f} entries/sec)")
+            return
+        if not self.engine.images or self.engine.current_index >= len(self.engine.images):
+            self.show_all_reviewed()
+            return
+        if self.grid_mode:
+            self.draw_grid()
             return
             
-        img_path = self.images[self.current_index]
+        img_path = self.engine.images[self.engine.current_index]
+        self.swipe_started = time.perf_counter()
+        self.swipe_started_ns = swiper_trace.now()
+        self.first_paint_ms = None
+        self.full_future = None
+        canvas_size = self.get_canvas_size()
         
         try:
-            # Check if file exists (may have been deleted)
-            if not img_path.exists():
-                if self.current_index < len(self.images) - 1:
-                    self.current_index += 1
-                    self.show_current_image()
-                elif self.current_index > 0:
-                    self.current_index -= 1
-                    self.show_current_image()
-                return
-            
-            # Load and resize image
-            if img_path.suffix.lower() in ['.heic', '.heif']:
-                try:
-                    import pillow_heif
-                    heif_file = pillow_heif.read_heif(str(img_path))
-                    img = Image.frombytes(
-                        heif_file.mode,
-                        heif_file.size,
-                        heif_file.data,
-                        "raw",
-                    )
-                except Exception as heic_error:
-                    # Fallback: try opening with Pillow directly (some HEIC files work this way)
-                    try:
-                        img = Image.open(img_path)
-                    except:
-                        # If both methods fail, raise the original error
-                        raise heic_error
-            else:
-                img = Image.open(img_path)
-            
-            # Get canvas size
-            self.root.update()
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
+            # The watcher keeps the list current, so nothing here asks the disk whether the
+            # file exists - one deleted since it last looked fails to decode below instead
+            img_path, stat, key, img = self.engine.lookup(self.engine.current_index, canvas_size)
             
-            # Calculate scaling
-            img_width, img_height = img.size
-            scale = min(canvas_width / img_width, canvas_height / img_height, 1)
-            
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convert to PhotoImage
-            self.photo = ImageTk.PhotoImage(img)
-            
-            # Display on canvas (centered)
-            self.canvas.delete("all")
-            x = canvas_width // 2
-            y = canvas_height // 2
-            self.canvas.create_image(x, y, image=self.photo, anchor=tk.CENTER)
+            # Use the prefetched PhotoImage if it's ready
+            photo = self.engine.image_cache.get_photo(key)
+            if photo is None:
+                if img is None:
+                    # Not decoded yet - show a quick preview now and swap in the
+                    # full-quality image when the background decode finishes
+                    preview = quick_preview(img_path, canvas_size)
+                    if preview is not None:
+                        self.full_future = self.engine.prefetcher.submit(img_path, canvas_size)
+                        self.full_future_path = img_path
+                        with span('photo_image'):
+                            photo = ImageTk.PhotoImage(preview)
+                        self.draw_photo(photo, final=False)
+                        photo = None
+                    else:
+                        img = self.engine.decode(img_path, stat, canvas_size)
+                if img is not None:
+                    with span('photo_image'):
+                        photo = ImageTk.PhotoImage(img)
+                    self.engine.image_cache.attach_photo(key, photo)
+            if photo is not None:
+                self.draw_photo(photo)
             
             # Update labels
-            self.counter_label.config(
-                text=f"Image {self.current_index + 1} of {len(self.images)}"
-            )
+            self.update_counter()
+            self.scan_summary = None
             
             # Show date when photo was taken
-            img_date = self.get_cached_date(img_path)
+            img_date = self.engine.date_taken(self.engine.current_index)
             if img_date:
                 years_ago = datetime.now().year - img_date.year
                 date_text = img_date.strftime('%B %d, %Y')
@@ -494,117 +885,368 @@ class ImageOrganizer:
             self.path_label.config(text=str(img_path.parent))
             self.filename_label.config(text=img_path.name)
             
-        except Exception as e:
-            error_msg = f"Could not load image: {img_path.name}\n\nError: {str(e)}\n\n"
-            if img_path.suffix.lower() in ['.heic', '.heif']:
-                error_msg += "This is a HEIC file. Make sure you have installed:\npip install pillow-heif\n\n"
-            error_msg += "Skip to next image?"
+            self.schedule_prefetch()
             
-            if messagebox.askyesno("Error Loading Image", error_msg):
-                if self.current_index < len(self.images) - 1:
-                    self.current_index += 1
-                    self.show_current_image()
-                else:
-                    messagebox.showinfo("Done!", "No more images to display.")
+        except FileNotFoundError:
+            # Deleted here, or gone from disk before the watcher noticed - skip to the
+            # nearest image that's still there
+            if self.engine.step(1) or self.engine.step(-1):
+                self.show_current_image()
+            else:
+                self.show_all_reviewed()
+        except Exception as e:
+            self.show_load_error(img_path, e)
+    
+    def show_all_reviewed(self):
+        if messagebox.askyesno("Done!", "All images have been reviewed!\n\n"
+                               "Go through this folder again from the beginning?"):
+            # Forget what was kept, so the fresh pass doesn't skip anything
+            self.engine.reset_decisions()
+            self.update_stats()
+            self.apply_view()
+            return
+        self.delete_btn.config(state=tk.DISABLED)
+        self.keep_btn.config(state=tk.DISABLED)
+        self.counter_label.config(text="All done!")
+        self.canvas.delete("all")
+        self.grid_tiles = {}
+        self.grid_photos = {}
+        self.path_label.config(text="")
+        self.filename_label.config(text="")
+        self.date_label.config(text="")
+    
+    def toggle_grid(self):
+        """Switch between one image at a time and a contact sheet of thumbnails"""
+        self.grid_mode = self.grid_var.get()
+        if self.grid_mode:
+            if self.duplicates_mode:
+                self.duplicates_var.set(False)
+                self.leave_duplicates_mode()
+            self.engine.prefetcher.cancel()
+            self.full_future = None
+            self.grid = GridPage(self.get_canvas_size())
+            self.grid.cursor = self.engine.current_index
+            self.instructions_label.config(text=GRID_INSTRUCTIONS)
+            self.delete_btn.config(text="✕ DELETE\nSELECTED (Q)")
+            self.keep_btn.config(text="✓ KEEP\nPAGE (W)")
+            self.timing_label.config(text="")
+            self.date_label.config(text="")
+        else:
+            self.thumbs.cancel()
+            self.thumbs.cache.clear()
+            # Carry on swiping from the image the grid cursor was on
+            if self.grid is not None and self.grid.cursor < len(self.engine.images):
+                self.engine.current_index = self.grid.cursor
+            self.grid_tiles = {}
+            self.grid_photos = {}
+            self.instructions_label.config(text=SWIPE_INSTRUCTIONS)
+            self.delete_btn.config(text="✕ DELETE\n(Q)")
+            self.keep_btn.config(text="✓ KEEP\n(W)")
+        if self.engine.images:
+            self.show_current_image()
+    
+    def grid_key(self):
+        self.grid_var.set(not self.grid_var.get())
+        self.toggle_grid()
+    
+    def draw_grid(self):
+        """Draw the page starting at current_index; only its thumbnails (and the next page's) are decoded"""
+        total = len(self.engine.images)
+        self.grid.show(self.engine.current_index, total)
+        visible = self.grid.visible(total)
+        paths = self.engine.images[visible.start:visible.stop]
+        self.canvas.delete("all")
+        self.grid_photos = {}
+        self.grid_tiles = {str(path): index for index, path in zip(visible, paths)}
+        for index in visible:
+            x0, y0, x1, y1 = self.grid.cell(index)
+            self.canvas.create_rectangle(x0 + 2, y0 + 2, x1 - 2, y1 - 2, fill='#232323', outline='')
+        
+        # Thumbnails already in memory come straight back through the ready queue
+        next_page = self.engine.images[visible.stop:visible.stop + self.grid.per_page]
+        self.thumbs.request(paths + next_page, self.grid.thumb_size)
+        self.draw_grid_marks()
+    
+    def draw_tile(self, key):
+        """Put a decoded thumbnail in its cell, if it's still on the page"""
+        index = self.grid_tiles.get(key[0])
+        if index is None or index in self.grid_photos:
+            return
+        photo = self.thumbs.cache.get_photo(key)
+        if photo is None:
+            img = self.thumbs.cache.get(key)
+            if img is None:
+                return
+            photo = ImageTk.PhotoImage(img)
+            self.thumbs.cache.attach_photo(key, photo)
+        self.grid_photos[index] = photo
+        x0, y0, x1, y1 = self.grid.cell(index)
+        self.canvas.create_image((x0 + x1) // 2, (y0 + y1) // 2, image=photo, anchor=tk.CENTER)
+        self.canvas.tag_raise("mark")
+    
+    def draw_grid_marks(self):
+        """Selection, deletion and cursor overlays for the page"""
+        self.canvas.delete("mark")
+        total = len(self.engine.images)
+        for index in self.grid.visible(total):
+            x0, y0, x1, y1 = self.grid.cell(index)
+            if self.engine.deletions.is_deleted(self.engine.images[index]):
+                self.canvas.create_line(x0 + 10, y0 + 10, x1 - 10, y1 - 10, fill='#f44336', width=3, tags="mark")
+                self.canvas.create_line(x0 + 10, y1 - 10, x1 - 10, y0 + 10, fill='#f44336', width=3, tags="mark")
+            elif index in self.grid.selected:
+                self.canvas.create_rectangle(x0 + 3, y0 + 3, x1 - 3, y1 - 3, outline='#f44336', width=4, tags="mark")
+                self.canvas.create_text(x1 - 16, y0 + 16, text="✕", fill='#f44336',
+                                        font=('Arial', 14, 'bold'), tags="mark")
+        if self.grid.cursor in self.grid.visible(total):
+            x0, y0, x1, y1 = self.grid.cell(self.grid.cursor)
+            self.canvas.create_rectangle(x0 + 1, y0 + 1, x1 - 1, y1 - 1, outline='white', width=2, tags="mark")
+            cursor_path = self.engine.images[self.grid.cursor]
+            self.path_label.config(text=str(cursor_path.parent))
+            self.filename_label.config(text=cursor_path.name)
+        self.update_counter()
+    
+    def grid_move(self, delta):
+        first = self.grid.first
+        self.grid.move_cursor(delta, len(self.engine.images))
+        if self.grid.first != first:
+            # Scrolled - the page now starts somewhere else
+            self.engine.current_index = self.grid.first
+            self.draw_grid()
+        else:
+            self.draw_grid_marks()
+    
+    def grid_scroll(self, rows):
+        if not self.engine.images:
+            return
+        self.grid.scroll(rows, len(self.engine.images))
+        self.engine.current_index = self.grid.first
+        self.draw_grid()
+    
+    def grid_toggle_selection(self, index):
+        if index is None or index >= len(self.engine.images) or self.engine.deletions.is_deleted(self.engine.images[index]):
+            return
+        self.grid.toggle(index)
+        self.draw_grid_marks()
+    
+    def on_canvas_click(self, event):
+        if not self.grid_mode:
+            return
+        index = self.grid.index_at(event.x, event.y, len(self.engine.images))
+        if index is not None:
+            self.grid.cursor = index
+            self.grid_toggle_selection(index)
+    
+    def on_canvas_double_click(self, event):
+        """Open the double-clicked thumbnail full size"""
+        if not self.grid_mode:
+            return
+        index = self.grid.index_at(event.x, event.y, len(self.engine.images))
+        if index is not None:
+            # The first click of the double-click toggled it; undo that
+            self.grid.toggle(index)
+            self.grid.cursor = index
+            self.grid_key()
+    
+    def grid_delete_selected(self):
+        """Delete the selected thumbnails (or the one under the cursor) and keep the rest of the page"""
+        visible = self.grid.visible(len(self.engine.images))
+        if not visible:
+            return
+        selected = [index for index in visible if index in self.grid.selected]
+        if not selected and self.grid.cursor in visible:
+            selected = [self.grid.cursor]
+        for index in selected:
+            if not self.engine.deletions.is_deleted(self.engine.images[index]):
+                self.engine.delete_path(self.engine.images[index])
+        if selected:
+            self.undo_btn.config(state=tk.NORMAL)
+        self.finish_grid_page(visible)
+    
+    def finish_grid_page(self, visible):
+        """Count the page as decided, keeping what wasn't deleted, and move on to the next one"""
+        for index in visible:
+            if not self.engine.deletions.is_deleted(self.engine.images[index]):
+                self.engine.keep_index(index)
+        self.engine.processed_count += len(visible)
+        self.update_stats()
+        self.grid.selected.clear()
+        self.engine.current_index = visible.stop
+        self.engine.skip_decided()
+        self.grid.cursor = self.engine.current_index
+        self.show_current_image()
+    
+    def draw_photo(self, photo, final=True):
+        """Display a PhotoImage centred on the canvas and record how long it took"""
+        self.photo = photo
+        canvas_width, canvas_height = self.get_canvas_size()
+        with span('draw'):
+            self.canvas.delete("all")
+            x = canvas_width // 2
+            y = canvas_height // 2
+            self.canvas.create_image(x, y, image=self.photo, anchor=tk.CENTER)
+        
+        # Time-to-first-pixel, and time until the full-quality image was up
+        elapsed_ms = (time.perf_counter() - self.swipe_started) * 1000
+        if not final:
+            self.first_paint_ms = elapsed_ms
+            self.timing_label.config(text=f"First paint: {elapsed_ms:.0f} ms | Full: ...")
+        elif self.first_paint_ms is not None:
+            self.timing_label.config(text=f"First paint: {self.first_paint_ms:.0f} ms | Full: {elapsed_ms:.0f} ms")
+            self.first_paint_ms = None
+        else:
+            self.timing_label.config(text=f"First paint: {elapsed_ms:.0f} ms")
+        if self.hud:
+            self.draw_hud()
+    
+    def toggle_hud(self):
+        """Show or hide the per-stage timing of the last swipe (turns span recording on)"""
+        self.hud = not self.hud
+        if self.hud:
+            swiper_trace.enable()
+            self.timing_label.config(text="Timing: swipe to see the breakdown")
+        else:
+            self.canvas.delete("hud")
+            if not self.trace_path:
+                swiper_trace.disable()
+    
+    def draw_hud(self):
+        """Overlay the time each stage of the last swipe took, slowest first"""
+        until = swiper_trace.now()
+        path = self.engine.current_path
+        stages = swiper_trace.breakdown(self.tk_thread, self.swipe_started_ns, until,
+                                        str(path) if path is not None else None)
+        lines = [f"swipe {(until - self.swipe_started_ns) / 1e6:8.1f} ms"]
+        for name, ms in sorted(stages.items(), key=lambda item: -item[1]):
+            lines.append(f"  {name:<18}{ms:8.1f} ms")
+        self.canvas.delete("hud")
+        text = self.canvas.create_text(12, 12, text="\n".join(lines), anchor=tk.NW, fill='#00E676',
+                                       font=('Courier', 9), tags="hud")
+        x0, y0, x1, y1 = self.canvas.bbox(text)
+        background = self.canvas.create_rectangle(x0 - 6, y0 - 6, x1 + 6, y1 + 6, fill='#000000',
+                                                  outline='', stipple='gray50', tags="hud")
+        self.canvas.tag_lower(background, text)
+    
+    def autosave_session(self):
+        """Snapshot the session now and then, so a crash loses at most a few decisions"""
+        self.engine.save_session()
+        self.root.after(SESSION_SAVE_MS, self.autosave_session)
+    
+    def flush_trace(self):
+        """Write finished spans to the trace file every second"""
+        swiper_trace.flush()
+        self.root.after(1000, self.flush_trace)
+    
+    def show_load_error(self, img_path, e):
+        error_msg = f"Could not load image: {img_path.name}\n\nError: {str(e)}\n\n"
+        if img_path.suffix.lower() in ['.heic', '.heif']:
+            error_msg += "This is a HEIC file. Make sure you have installed:\npip install pillow-heif\n\n"
+        elif img_path.suffix.lower() in RAW_EXTENSIONS:
+            error_msg += "This is a RAW file. Only the JPEG preview embedded by the camera can be shown.\n\n"
+        error_msg += "Skip to next image?"
+        
+        if messagebox.askyesno("Error Loading Image", error_msg):
+            if self.engine.current_index < len(self.engine.images) - 1:
+                self.engine.current_index += 1
+                self.show_current_image()
+            else:
+                messagebox.showinfo("Done!", "No more images to display.")
             
     def delete_image(self):
-        if not self.images or self.current_index >= len(self.images):
+        if self.duplicates_mode:
+            self.keep_cluster_pick()
+            return
+        if self.grid_mode:
+            self.grid_delete_selected()
+            return
+        # Only queues the delete - the trash move and cache update happen in the background
+        if self.engine.delete() is None:
             return
-            
-        img_path = self.images[self.current_index]
         
-        try:
-            file_size_bytes = img_path.stat().st_size
-            file_size_mb = file_size_bytes / (1024 * 1024)
-            
-            winshell.delete_file(str(img_path), no_confirm=True, allow_undo=True)
-            
-            # Remove from database cache when deleted
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM image_cache WHERE filepath = ?', (str(img_path),))
-            conn.commit()
-            conn.close()
-            
-            self.last_deleted = img_path
-            self.last_deleted_size = file_size_mb
-            self.undo_btn.config(state=tk.NORMAL)
-            self.deleted_count += 1
-            self.processed_count += 1
-            self.space_saved_mb += file_size_mb
-            self.stats_label.config(text=f"Processed: {self.processed_count} | Deleted: {self.deleted_count} | Saved: {self.space_saved_mb:.1f} MB")
-            self.current_index += 1
-            self.show_current_image()
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not delete file: {str(e)}")
+        self.undo_btn.config(state=tk.NORMAL)
+        self.update_stats()
+        self.show_current_image()
     
     def undo_delete(self):
-        if not self.last_deleted:
+        if self.engine.undo() is None:
             return
         
-        try:
-            winshell.undelete(str(self.last_deleted))
-            
-            # Re-add to cache when restored
-            img_date = self.extract_image_date(self.last_deleted)
-            file_size = self.last_deleted.stat().st_size
-            current_mtime = self.last_deleted.stat().st_mtime
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO image_cache (filepath, date_taken, file_size, last_modified)
-                VALUES (?, ?, ?, ?)
-            ''', (str(self.last_deleted), 
-                  img_date.isoformat() if img_date else None,
-                  file_size,
-                  current_mtime))
-            conn.commit()
-            conn.close()
-            
-            messagebox.showinfo("Undo", f"Restored: {self.last_deleted.name}")
-            self.last_deleted = None
+        self.update_stats()
+        if not self.engine.deletions.can_undo:
             self.undo_btn.config(state=tk.DISABLED)
-            self.deleted_count -= 1
-            self.processed_count -= 1
-            self.space_saved_mb -= self.last_deleted_size
-            self.last_deleted_size = 0
-            self.stats_label.config(text=f"Processed: {self.processed_count} | Deleted: {self.deleted_count} | Saved: {self.space_saved_mb:.1f} MB")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not restore file: {str(e)}\nYou may need to restore it manually from Recycle Bin.")
-            
+        if self.grid_mode and self.engine.images:
+            self.draw_grid_marks()
+    
+    def poll_deletions(self):
+        """Handle results from the background deletion worker"""
+        for outcome, deletion, error in self.engine.deletion_results():
+            name = Path(deletion.path).name
+            if outcome == 'delete_failed':
+                messagebox.showerror("Error", f"Could not delete file: {name}\n\n{str(error)}")
+            elif outcome == 'restored':
+                self.status_label.config(text=f"↶ Restored: {name}")
+            elif outcome == 'restore_failed':
+                messagebox.showerror("Error", f"Could not restore file: {str(error)}\nYou may need to restore it manually from the trash.")
+            self.update_stats()
+            self.undo_btn.config(state=tk.NORMAL if self.engine.deletions.can_undo else tk.DISABLED)
+        self.root.after(100, self.poll_deletions)
+    
+    def poll_watcher(self):
+        """Pick up images added to or removed from the folder outside the app"""
+        finished = self.engine.current_index >= len(self.engine.images)
+        current = self.engine.current_path
+        added, removed = self.engine.poll_watcher()
+        if added:
+            self.status_label.config(text=f"📥 {added} new image{'s' if added != 1 else ''} found")
+        if (added or removed) and not self.duplicates_mode and self.engine.scanner is None:
+            if removed and self.grid is not None:
+                # Selections are positions, which have just moved
+                self.grid.selected.clear()
+            if (self.waiting_for_scan or finished) and self.engine.current_index < len(self.engine.images):
+                self.start_review()
+            elif self.engine.current_path != current or self.grid_mode:
+                self.show_current_image()
+            elif self.engine.images:
+                self.update_counter()
+        self.root.after(500, self.poll_watcher)
+    
+    def update_stats(self):
+        self.stats_label.config(text=f"Processed: {self.engine.processed_count} | Deleted: {self.engine.deleted_count} | Saved: {self.engine.space_saved_mb:.1f} MB")
+    
     def keep_image(self):
-        if not self.images or self.current_index >= len(self.images):
+        if self.duplicates_mode:
+            self.keep_whole_cluster()
             return
-            
-        self.processed_count += 1
-        self.stats_label.config(text=f"Processed: {self.processed_count} | Deleted: {self.deleted_count} | Saved: {self.space_saved_mb:.1f} MB")
-        self.current_index += 1
+        if self.grid_mode:
+            self.finish_grid_page(self.grid.visible(len(self.engine.images)))
+            return
+        if not self.engine.keep():
+            return
+        self.update_stats()
         self.show_current_image()
     
     def previous_image(self):
-        if not self.images:
+        if self.duplicates_mode:
+            self.move_cluster_pick(-1)
             return
-        original_index = self.current_index
-        while self.current_index > 0:
-            self.current_index -= 1
-            if self.images[self.current_index].exists():
-                self.show_current_image()
-                return
-        self.current_index = original_index
+        if self.grid_mode:
+            self.grid_move(-1)
+            return
+        if self.engine.step(-1):
+            self.show_current_image()
     
     def next_image(self):
-        if not self.images:
-            return
-        self.processed_count += 1
-        self.stats_label.config(text=f"Processed: {self.processed_count} | Deleted: {self.deleted_count} | Saved: {self.space_saved_mb:.1f} MB")
-        original_index = self.current_index
-        while self.current_index < len(self.images) - 1:
-            self.current_index += 1
-            if self.images[self.current_index].exists():
-                self.show_current_image()
-                return
-        self.current_index = original_index
+        if self.duplicates_mode:
+            self.move_cluster_pick(1)
+            return
+        if self.grid_mode:
+            self.grid_move(1)
+            return
+        if not self.engine.images:
+            return
+        self.engine.processed_count += 1
+        self.update_stats()
+        if self.engine.step(1):
+            self.show_current_image()
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,196 @@
+"""Benchmark: serial piexif date extraction vs the header-only process pool.
+
+Builds a synthetic corpus of JPEG, TIFF and HEIC-like files, each carrying a
+DateTimeOriginal tag in front of a few MB of filler, then times:
+
+  piexif-serial   piexif.load on every file, one at a time (the old path)
+  header-serial   swiper_exif.read_date_taken, one at a time
+  header-pool     swiper_exif.DateExtractor writing into a scratch store
+
+Usage:
+    python bench_exif.py [--files 2000] [--size-mb 4] [--workers N] [--json]
+
+The corpus lives in a temporary directory unless --corpus is given (it is
+reused if it already exists). The OS file cache is not dropped between runs,
+so the first mode to run pays for cold reads - use --modes to reorder.
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from swiper_exif import DateExtractor, read_date_taken
+from swiper_store import MetadataStore
+
+
+def exif_tiff(date, byte_order='<'):
+    """Minimal TIFF structure: IFD0 -> Exif IFD -> DateTimeOriginal"""
+    date_bytes = date.strftime('%Y:%m:%d %H:%M:%S').encode() + b'\0'
+    mark = b'II' if byte_order == '<' else b'MM'
+    header = mark + struct.pack(byte_order + 'HI', 42, 8)
+    # IFD0 at 8: one entry, then next-IFD offset
+    exif_ifd_offset = 8 + 2 + 12 + 4
+    ifd0 = struct.pack(byte_order + 'H', 1)
+    ifd0 += struct.pack(byte_order + 'HHII', 0x8769, 4, 1, exif_ifd_offset)
+    ifd0 += struct.pack(byte_order + 'I', 0)
+    # Exif IFD: one ASCII entry pointing just past itself
+    date_offset = exif_ifd_offset + 2 + 12 + 4
+    exif_ifd = struct.pack(byte_order + 'H', 1)
+    exif_ifd += struct.pack(byte_order + 'HHII', 0x9003, 2, len(date_bytes), date_offset)
+    exif_ifd += struct.pack(byte_order + 'I', 0)
+    return header + ifd0 + exif_ifd + date_bytes
+
+
+def make_jpeg(date, filler):
+    tiff = b'Exif\0\0' + exif_tiff(date)
+    app1 = b'\xff\xe1' + struct.pack('>H', len(tiff) + 2) + tiff
+    sos = b'\xff\xda' + struct.pack('>H', 8) + b'\x01\x01\x00\x00\x3f\x00'
+    return b'\xff\xd8' + app1 + sos + filler + b'\xff\xd9'
+
+
+def make_tiff(date, filler):
+    return exif_tiff(date, '>') + filler
+
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def make_heic(date, filler):
+    """ISO BMFF file with an 'Exif' item located by iinf/iloc, like a HEIC"""
+    exif_payload = struct.pack('>I', 6) + b'Exif\0\0' + exif_tiff(date, '>')
+    ftyp = _box(b'ftyp', b'heic' + b'\0\0\0\0' + b'mif1heic')
+    infe = _box(b'infe', b'\x02\0\0\0' + struct.pack('>HH', 1, 0) + b'Exif' + b'\0')
+    iinf = _box(b'iinf', b'\0\0\0\0' + struct.pack('>H', 1) + infe)
+
+    def build(exif_offset):
+        # iloc version 0: offset_size=4, length_size=4, base_offset_size=0
+        iloc_body = b'\0\0\0\0' + bytes([0x44, 0x00]) + struct.pack('>H', 1)
+        iloc_body += struct.pack('>HHHII', 1, 0, 1, exif_offset, len(exif_payload))
+        meta = _box(b'meta', b'\0\0\0\0' + iinf + _box(b'iloc', iloc_body))
+        return ftyp + meta
+
+    head = build(0)
+    # Exif data sits at the start of mdat, after the mdat header
+    exif_offset = len(head) + 8
+    head = build(exif_offset)
+    return head + _box(b'mdat', exif_payload + filler)
+
+
+MAKERS = {'.jpg': make_jpeg, '.tif': make_tiff, '.heic': make_heic}
+
+
+def build_corpus(root, files, size_mb, seed=1):
+    """Write files across nested year/month directories; returns their paths"""
+    rng = random.Random(seed)
+    root = Path(root)
+    filler = os.urandom(int(size_mb * 1024 * 1024))
+    start = datetime(2005, 1, 1)
+    paths = []
+    for i in range(files):
+        date = start + timedelta(seconds=rng.randrange(20 * 365 * 24 * 3600))
+        ext = rng.choice(list(MAKERS))
+        directory = root / str(date.year) / f"{date.month:02d}"
+        path = directory / f"IMG_{i:06d}{ext}"
+        paths.append(path)
+        if path.exists():
+            continue
+        directory.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(MAKERS[ext](date, filler))
+    return paths
+
+
+def bench_piexif_serial(paths):
+    import piexif
+    found = 0
+    for path in paths:
+        try:
+            exif_data = piexif.load(str(path))
+            if piexif.ExifIFD.DateTimeOriginal in exif_data['Exif']:
+                datetime.strptime(exif_data['Exif'][piexif.ExifIFD.DateTimeOriginal].decode(),
+                                  '%Y:%m:%d %H:%M:%S')
+                found += 1
+        except Exception:
+            pass
+    return found
+
+
+def bench_header_serial(paths):
+    return sum(1 for path in paths if read_date_taken(path) is not None)
+
+
+def bench_header_pool(paths, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MetadataStore(Path(tmp) / "bench.db")
+        extractor = DateExtractor(store, workers=workers)
+        extractor.submit(paths)
+        extractor.wait()
+        extractor.close()
+        store.flush()
+        found = store.conn.execute('SELECT COUNT(*) FROM image_cache').fetchone()[0]
+        store.close()
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--size-mb', type=float, default=4)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--corpus', help="Directory to build (or reuse) the corpus in")
+    parser.add_argument('--modes', default='piexif-serial,header-serial,header-pool')
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.corpus:
+        corpus = Path(args.corpus)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        corpus = Path(tmp.name)
+
+    print(f"Building corpus of {args.files} files ({args.size_mb} MB each) in {corpus}...", file=sys.stderr)
+    paths = build_corpus(corpus, args.files, args.size_mb)
+
+    runners = {
+        'piexif-serial': lambda: bench_piexif_serial(paths),
+        'header-serial': lambda: bench_header_serial(paths),
+        'header-pool': lambda: bench_header_pool(paths, args.workers),
+    }
+    results = []
+    for mode in args.modes.split(','):
+        try:
+            started = time.perf_counter()
+            found = runners[mode]()
+            elapsed = time.perf_counter() - started
+        except ImportError as e:
+            print(f"Skipping {mode}: {e}", file=sys.stderr)
+            continue
+        results.append({
+            'mode': mode,
+            'files': len(paths),
+            'dates_found': found,
+            'seconds': round(elapsed, 4),
+            'files_per_sec': round(len(paths) / elapsed, 1),
+        })
+
+    if args.json:
+        print(json.dumps({'size_mb': args.size_mb, 'workers': args.workers or os.cpu_count(),
+                          'results': results}, indent=2))
+    else:
+        for r in results:
+            print(f"{r['mode']:<15} {r['seconds']:>8.3f}s  {r['files_per_sec']:>10,.1f} files/sec  "
+                  f"({r['dates_found']}/{r['files']} dates)")
+
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Benchmark: the headless review engine on a synthetic photo library.
+
+Builds a library of decodable JPEGs and PNGs plus HEIC-like files (see
+bench_exif.make_heic), each with an EXIF DateTimeOriginal, spread across
+nested year / month / event folders with a few sidecar files mixed in. Then
+drives swiper_engine.ReviewEngine the way the Tk UI does and measures:
+
+  scan_seconds       first-time scan of the folder until the walk finishes
+  index_seconds      indexing the dates once the scan is done
+  first_image_ms     opening the folder until the first image is decoded
+  swipe_p50/p99_ms   showing each image (lookup + any decode), with prefetch
+                     running while the "user" looks at it for --think-ms
+  cache_hit_rate     share of swipes served from memory or the previews folder
+  otd_query_ms       On This Day filter over the in-memory catalog
+  otd_sql_ms         the same question asked of the metadata store
+  peak_rss_mb        peak resident memory of this process (and its workers)
+
+The swipes run three times: a cold session on a fresh database, a warm one
+reopening the same folder from the index, then one resuming the warm
+session's snapshot the way a second launch of the app would - carrying on
+from its cursor, past the images it kept.
+
+Usage:
+    python bench_swiper.py [--files 1000] [--swipes 200] [--think-ms 50] [--json] [--output FILE]
+                           [--trace trace.json]
+
+The corpus and the engine's data directory live in temporary directories
+unless --corpus / --data-dir are given (an existing corpus is reused). The
+OS file cache is not dropped, so the cold session is only cold for the app.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from PIL import Image
+
+from bench_exif import make_heic
+import swiper_trace
+from swiper_engine import ReviewEngine
+
+# Roughly the canvas of the default 900x700 window
+CANVAS_SIZE = (860, 480)
+
+# Share of each kind of file in the corpus
+FORMAT_WEIGHTS = {'.jpg': 0.75, '.png': 0.15, '.heic': 0.10}
+
+# Share of images dated today's month and day in some earlier year, so On This Day finds some
+THIS_DAY_SHARE = 0.01
+
+
+def photo_like(rng, size):
+    """A smooth, photo-like image: blown-up random noise compresses and decodes like a real photo"""
+    noise = Image.frombytes('RGB', (16, 12), bytes(rng.getrandbits(8) for _ in range(16 * 12 * 3)))
+    return noise.resize(size, Image.Resampling.BICUBIC)
+
+
+def write_image(path, ext, date, rng, size):
+    if ext == '.heic':
+        path.write_bytes(make_heic(date, os.urandom(256 * 1024)))
+        return
+    stamp = date.strftime('%Y:%m:%d %H:%M:%S')
+    exif = Image.Exif()
+    # Make, Model and DateTime in IFD0 like a camera writes (Pillow skips an empty IFD0 for PNG)
+    exif[0x010F], exif[0x0110], exif[0x0132] = 'Bench', 'Synthetic', stamp
+    exif.get_ifd(0x8769)[0x9003] = stamp
+    img = photo_like(rng, size)
+    if ext == '.jpg':
+        img.save(path, quality=90, exif=exif)
+    else:
+        # Default PNG compression takes seconds per file and doesn't change what's measured
+        img.save(path, exif=exif, compress_level=1)
+
+
+def build_corpus(root, files, megapixels, seed=1):
+    """Write files across nested year/month(/event) directories, skipping ones already there"""
+    rng = random.Random(seed)
+    root = Path(root)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    size = (width, width * 3 // 4)
+    today = datetime.now()
+    start = datetime(2005, 1, 1)
+    formats, weights = zip(*FORMAT_WEIGHTS.items())
+    for i in range(files):
+        if rng.random() < THIS_DAY_SHARE:
+            date = today.replace(year=rng.randrange(2005, today.year), hour=12, day=min(today.day, 28))
+        else:
+            date = start + timedelta(seconds=rng.randrange(20 * 365 * 24 * 3600))
+        ext = rng.choices(formats, weights)[0]
+        directory = root / str(date.year) / f"{date.month:02d}"
+        if rng.random() < 0.3:
+            directory = directory / f"event_{date.day:02d}"
+        path = directory / f"IMG_{i:06d}{ext}"
+        if path.exists():
+            continue
+        directory.mkdir(parents=True, exist_ok=True)
+        write_image(path, ext, date, rng, size)
+        if rng.random() < 0.1:
+            # Sidecars and the like are walked past by the scanner
+            path.with_suffix('.xmp').write_text('<x:xmpmeta xmlns:x="adobe:ns:meta/"/>')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list, or None if it's empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def peak_rss_mb(who='self'):
+    """Peak resident set size so far, or None where the resource module doesn't exist (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return round(usage.ru_maxrss * scale / (1024 * 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def wait_for_first_image(engine, started, canvas_size, poll_interval):
+    """Poll the scan or index until an image can be shown; returns ms since started, or None"""
+    while True:
+        if engine.scanner is not None:
+            _, finished = engine.poll_scan()
+        else:
+            catalogs, finished = engine.poll_index()
+            for catalog in catalogs:
+                engine.use_catalog(catalog, restart=not len(engine.images))
+        while engine.current_index < len(engine.images):
+            try:
+                engine.current_image(canvas_size)
+                return (time.perf_counter() - started) * 1000
+            except Exception:
+                # Undecodable (a HEIC without pillow_heif) - the UI would offer to skip it
+                engine.current_index += 1
+        if finished:
+            return None
+        time.sleep(poll_interval)
+
+
+def finish_loading(engine, scanner, poll_interval):
+    """Poll until the scan (if any) and the index are both done, indexing after a scan like the UI"""
+    scan_seconds = None
+    if scanner is not None:
+        while engine.scanner is not None and not engine.poll_scan()[1]:
+            time.sleep(poll_interval)
+        scan_seconds = scanner.progress.elapsed
+        engine.start_index_update()
+    started = time.perf_counter()
+    while True:
+        catalogs, finished = engine.poll_index()
+        for catalog in catalogs:
+            engine.use_catalog(catalog)
+        if finished:
+            break
+        time.sleep(poll_interval)
+    index_seconds = time.perf_counter() - started
+    return scan_seconds, index_seconds
+
+
+def swipe(engine, swipes, canvas_size, think, from_start=True):
+    """Keep `swipes` images in a row; returns (latencies in ms, undecodable count)"""
+    if from_start:
+        engine.current_index = 0
+    engine.lookups.clear()
+    latencies = []
+    undecodable = 0
+    while len(latencies) < swipes and engine.current_index < len(engine.images):
+        started = time.perf_counter()
+        try:
+            engine.current_image(canvas_size)
+        except Exception:
+            undecodable += 1
+            engine.keep()
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        engine.prefetch(canvas_size)
+        time.sleep(think)
+        engine.keep()
+    return latencies, undecodable
+
+
+def run_session(name, data_dir, corpus, args, results, resume=False):
+    engine = ReviewEngine(data_dir)
+    try:
+        started = time.perf_counter()
+        source = engine.open_folder(str(corpus), resume=resume)
+        scanner = engine.scanner
+        first_image_ms = wait_for_first_image(engine, started, CANVAS_SIZE, args.poll_ms / 1000)
+        scan_seconds, index_seconds = finish_loading(engine, scanner, args.poll_ms / 1000)
+        latencies, undecodable = swipe(engine, args.swipes, CANVAS_SIZE, args.think_ms / 1000,
+                                       from_start=source != 'session')
+
+        # On This Day: the in-memory filter the UI uses, and the SQL query it replaced
+        engine.on_this_day_mode = True
+        started = time.perf_counter()
+        matches = engine.set_view()
+        otd_query_ms = (time.perf_counter() - started) * 1000
+        today = datetime.now()
+        started = time.perf_counter()
+        engine.store.this_day(corpus, today.month, today.day)
+        otd_sql_ms = (time.perf_counter() - started) * 1000
+        # Leave the snapshot saved on close reviewing the whole folder again
+        engine.on_this_day_mode = False
+        engine.set_view()
+
+        results.append({
+            'session': name,
+            'source': source,
+            'images': len(engine.catalog),
+            'scan_seconds': round(scan_seconds, 3) if scan_seconds is not None else None,
+            'index_seconds': round(index_seconds, 3),
+            'first_image_ms': round(first_image_ms, 1) if first_image_ms is not None else None,
+            'swipes': len(latencies),
+            'undecodable': undecodable,
+            'swipe_p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+            'swipe_p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+            'cache_hit_rate': round(engine.hit_rate, 3) if engine.hit_rate is not None else None,
+            'otd_matches': matches,
+            'otd_query_ms': round(otd_query_ms, 2),
+            'otd_sql_ms': round(otd_sql_ms, 2),
+        })
+    finally:
+        engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--megapixels', type=float, default=3)
+    parser.add_argument('--swipes', type=int, default=200)
+    parser.add_argument('--think-ms', type=float, default=50, help="Time spent looking at each image")
+    parser.add_argument('--poll-ms', type=float, default=20, help="How often to poll, like the UI's after()")
+    parser.add_argument('--corpus', help="Directory to build (or reuse) the corpus in")
+    parser.add_argument('--data-dir', help="Where the engine keeps its database and previews (emptied first)")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--output', help="Also write the JSON results to this file")
+    parser.add_argument('--trace', help="Export a span trace (.json for Chrome/Perfetto, .jsonl for lines)")
+    args = parser.parse_args()
+
+    tmp = []
+    if args.corpus:
+        corpus = Path(args.corpus)
+    else:
+        tmp.append(tempfile.TemporaryDirectory())
+        corpus = Path(tmp[-1].name)
+    if args.data_dir:
+        data_dir = Path(args.data_dir)
+        data_dir.mkdir(parents=True, exist_ok=True)
+        for name in ('OnThisDay_cache.db', 'OnThisDay_cache.db-wal', 'OnThisDay_cache.db-shm', 'deletions.journal'):
+            (data_dir / name).unlink(missing_ok=True)
+    else:
+        tmp.append(tempfile.TemporaryDirectory())
+        data_dir = Path(tmp[-1].name)
+
+    print(f"Building corpus of {args.files} files ({args.megapixels} MP) in {corpus}...", file=sys.stderr)
+    started = time.perf_counter()
+    build_corpus(corpus, args.files, args.megapixels)
+    print(f"Corpus ready in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    if args.trace:
+        swiper_trace.enable(args.trace)
+    sessions = []
+    for name in ('cold', 'warm', 'resume'):
+        print(f"Running {name} session...", file=sys.stderr)
+        run_session(name, data_dir, corpus, args, sessions, resume=name == 'resume')
+    swiper_trace.close()
+
+    report = {
+        'benchmark': 'bench_swiper',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': {'files': args.files, 'megapixels': args.megapixels, 'swipes': args.swipes,
+                   'think_ms': args.think_ms, 'canvas': list(CANVAS_SIZE)},
+        'sessions': sessions,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_workers_mb': peak_rss_mb('children'),
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for s in sessions:
+            scan = f"{s['scan_seconds']:.2f}s" if s['scan_seconds'] is not None else f"from {s['source']}"
+            print(f"{s['session']:<6} {s['images']:,} images | scan {scan} | index {s['index_seconds']:.2f}s | "
+                  f"first image {s['first_image_ms']} ms | swipe p50 {s['swipe_p50_ms']} ms, "
+                  f"p99 {s['swipe_p99_ms']} ms | hit rate {s['cache_hit_rate']} | "
+                  f"OTD {s['otd_matches']} in {s['otd_query_ms']} ms (SQL {s['otd_sql_ms']} ms)")
+        print(f"peak RSS {report['peak_rss_mb']} MB (workers {report['peak_rss_workers_mb']} MB)")
+
+    for t in tmp:
+        t.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Compact in-memory catalog of the images under a folder.
+
+Instead of a list of Path objects, each image is one row across a few typed
+arrays: an interned directory id, the end offset of its name in one shared
+buffer of UTF-8 file names, and packed mtime, size and date-taken columns.
+What the UI steps through is a CatalogView - an array of row numbers - so
+sorting, shuffling and the On This Day and subdirectory filters only build a
+new permutation of row numbers; no paths are rebuilt and the filesystem is
+never touched. A catalog also serialises to a compact blob (to_bytes), which
+is how review sessions are snapshotted and restored without re-reading the
+index.
+"""
+import json
+import os
+import random
+import struct
+import zlib
+from array import array
+from datetime import datetime
+from pathlib import Path
+
+# Dates are packed as YYYYMMDDhhmmss integers, which sort chronologically;
+# 0 means the date isn't known (yet)
+NO_DATE = 0
+
+
+def pack_date(date_taken):
+    """Pack an ISO format date string (or None) into an integer"""
+    if not date_taken:
+        return NO_DATE
+    digits = (date_taken[0:4] + date_taken[5:7] + date_taken[8:10]
+              + date_taken[11:13] + date_taken[14:16] + date_taken[17:19])
+    return int(digits.ljust(14, '0'))
+
+
+def unpack_date(packed):
+    """The datetime for a packed date, or None"""
+    if packed == NO_DATE:
+        return None
+    return datetime.strptime(str(packed), '%Y%m%d%H%M%S')
+
+
+def path_sort_key(filepath):
+    """Sort key that orders path strings the way sorted() orders Path objects.
+
+    Separators sort before every other character, so a directory's contents
+    come straight after it, and case is ignored where the OS ignores it.
+    """
+    return os.path.normcase(filepath).replace(os.sep, '\0')
+
+
+class Catalog:
+    """Images under one folder, stored column-wise and in path order.
+
+    The folder watcher's changes are applied in place: new images are
+    appended out of order (insert), which clears `ordered`, and images that
+    have gone are only marked (remove) - select() leaves them out.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normpath(str(root))
+        self.dirs = []
+        self.dir_ids = {}
+        self.dir_of = array('I')
+        self.names = bytearray()
+        self.name_ends = array('Q')
+        self.mtime = array('d')
+        self.size = array('q')
+        self.taken = array('q')
+        # 1 for images already kept in this folder's review session
+        self.decided = bytearray()
+        self.ordered = True
+        self.removed = set()
+        self.root_id = self.intern_dir(self.root)
+
+    @classmethod
+    def from_store(cls, store, folder):
+        """Build a catalog from the metadata index, without touching the filesystem"""
+        catalog = cls(folder)
+        for filepath, date_taken, file_size, last_modified in store.iter_tree(folder):
+            catalog.add(filepath, last_modified or 0.0, file_size or 0, pack_date(date_taken))
+        return catalog
+
+    def __len__(self):
+        return len(self.dir_of)
+
+    def intern_dir(self, dirpath):
+        dir_id = self.dir_ids.get(dirpath)
+        if dir_id is None:
+            dir_id = self.dir_ids[dirpath] = len(self.dirs)
+            self.dirs.append(dirpath)
+        return dir_id
+
+    def add(self, filepath, mtime=0.0, size=0, taken=NO_DATE):
+        """Append one image; rows must be added in path order. Returns its row number"""
+        dirpath, name = os.path.split(os.fspath(filepath))
+        self.dir_of.append(self.intern_dir(dirpath))
+        self.names += name.encode('utf-8', 'surrogatepass')
+        self.name_ends.append(len(self.names))
+        self.mtime.append(mtime)
+        self.size.append(size)
+        self.taken.append(taken)
+        self.decided.append(0)
+        return len(self.dir_of) - 1
+
+    def insert(self, filepath, mtime=0.0, size=0, taken=NO_DATE):
+        """Append one image found after the catalog was built, whatever its path"""
+        self.ordered = False
+        return self.add(filepath, mtime, size, taken)
+
+    def remove(self, rows):
+        self.removed.update(rows)
+
+    def find(self, filepaths):
+        """{filepath: row} for those of the paths that are in the catalog.
+
+        One pass over the rows, only decoding names in the directories asked
+        about, so a batch of watcher changes costs the same as one.
+        """
+        wanted = {}
+        for filepath in filepaths:
+            dirpath, name = os.path.split(filepath)
+            dir_id = self.dir_ids.get(dirpath)
+            if dir_id is not None:
+                wanted.setdefault(dir_id, {})[name] = filepath
+        found = {}
+        if not wanted:
+            return found
+        removed = self.removed
+        for row, dir_id in enumerate(self.dir_of):
+            names = wanted.get(dir_id)
+            if names is not None and row not in removed:
+                filepath = names.get(self.name(row))
+                if filepath is not None:
+                    found[filepath] = row
+        return found
+
+    def rows_under(self, dirpaths):
+        """Rows in or beneath any of the directories"""
+        prefixes = tuple(dirpath.rstrip(os.sep) + os.sep for dirpath in dirpaths)
+        dir_ids = {dir_id for dir_id, dirpath in enumerate(self.dirs)
+                   if dirpath in dirpaths or dirpath.startswith(prefixes)}
+        if not dir_ids:
+            return []
+        return [row for row, dir_id in enumerate(self.dir_of) if dir_id in dir_ids]
+
+    def extend(self, filepaths):
+        """Append images with unknown metadata (e.g. straight from a scan); returns their rows"""
+        start = len(self)
+        for filepath in filepaths:
+            self.add(filepath)
+        return range(start, len(self))
+
+    def name(self, row):
+        start = self.name_ends[row - 1] if row else 0
+        return self.names[start:self.name_ends[row]].decode('utf-8', 'surrogatepass')
+
+    def path(self, row):
+        return os.path.join(self.dirs[self.dir_of[row]], self.name(row))
+
+    def date_taken(self, row):
+        return unpack_date(self.taken[row])
+
+    def to_bytes(self):
+        """The catalog's columns as one compressed blob (decided flags not included)"""
+        header = json.dumps({'root': self.root, 'dirs': self.dirs, 'rows': len(self),
+                             'names': len(self.names), 'ordered': self.ordered,
+                             'removed': sorted(self.removed)}).encode('utf-8', 'surrogatepass')
+        return zlib.compress(b''.join([
+            struct.pack('<I', len(header)), header,
+            self.dir_of.tobytes(), self.name_ends.tobytes(), self.mtime.tobytes(),
+            self.size.tobytes(), self.taken.tobytes(), bytes(self.names),
+        ]), 1)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Rebuild a catalog saved by to_bytes (on the same machine - arrays are native byte order)"""
+        data = memoryview(zlib.decompress(blob))
+        header_len, = struct.unpack_from('<I', data)
+        header = json.loads(bytes(data[4:4 + header_len]).decode('utf-8', 'surrogatepass'))
+        catalog = cls(header['root'])
+        catalog.dirs = header['dirs']
+        catalog.dir_ids = {dirpath: dir_id for dir_id, dirpath in enumerate(catalog.dirs)}
+        catalog.root_id = catalog.dir_ids[catalog.root]
+        offset = 4 + header_len
+        rows = header['rows']
+        for column in (catalog.dir_of, catalog.name_ends, catalog.mtime, catalog.size, catalog.taken):
+            end = offset + rows * column.itemsize
+            column.frombytes(data[offset:end])
+            offset = end
+        catalog.names = bytearray(data[offset:offset + header['names']])
+        catalog.decided = bytearray(rows)
+        catalog.ordered = header.get('ordered', True)
+        catalog.removed = set(header.get('removed', ()))
+        return catalog
+
+    def select(self, rows=None, recursive=True, month_day=None):
+        """The rows passing the subdirectory and On This Day filters, as an array.
+
+        month_day is a (month, day) tuple; matches are ordered oldest first.
+        Otherwise rows keep their order (path order if rows is None).
+        """
+        if rows is None:
+            rows = range(len(self))
+        if self.removed:
+            removed = self.removed
+            rows = [row for row in rows if row not in removed]
+        if not recursive:
+            dir_of, root_id = self.dir_of, self.root_id
+            rows = [row for row in rows if dir_of[row] == root_id]
+        if month_day is not None:
+            taken = self.taken
+            wanted = month_day[0] * 100 + month_day[1]
+            rows = [row for row in rows if taken[row] // 1000000 % 10000 == wanted]
+            rows.sort(key=taken.__getitem__)
+        return array('I', rows)
+
+    def match_rows(self, old):
+        """Map an older catalog of the same folder onto this one.
+
+        Returns (remap, added): remap[old_row] is the row for the same path
+        here or -1 if it's gone, and added lists rows that are new here. Both
+        catalogs are in path order (the old one is sorted first if the watcher
+        appended to it), so this is a single merge pass.
+        """
+        remap = array('i', [-1]) * len(old)
+        added = array('I')
+        order = [row for row in range(len(old)) if row not in old.removed]
+        if not old.ordered:
+            order.sort(key=lambda row: path_sort_key(old.path(row)))
+
+        def old_key_at(i):
+            return path_sort_key(old.path(order[i])) if i < len(order) else None
+
+        i = 0
+        old_key = old_key_at(0)
+        for row in range(len(self)):
+            key = path_sort_key(self.path(row))
+            while old_key is not None and old_key < key:
+                i += 1
+                old_key = old_key_at(i)
+            if old_key == key:
+                remap[order[i]] = row
+                i += 1
+                old_key = old_key_at(i)
+            else:
+                added.append(row)
+        return remap, added
+
+
+class CatalogView:
+    """An ordering of catalog rows that indexes like a list of Paths"""
+
+    def __init__(self, catalog, rows=None):
+        self.catalog = catalog
+        self.rows = rows if rows is not None else array('I')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Path(self.catalog.path(row)) for row in self.rows[index]]
+        return Path(self.catalog.path(self.rows[index]))
+
+    def position(self, row):
+        """Index of a catalog row in this view, or None"""
+        try:
+            return self.rows.index(row)
+        except ValueError:
+            return None
+
+    def append(self, rows):
+        self.rows.extend(rows)
+
+    def discard(self, rows, cursor):
+        """Drop a set of rows; returns the cursor's new position (the next image that's left)"""
+        before = sum(1 for row in self.rows[:cursor] if row in rows)
+        self.rows = array('I', [row for row in self.rows if row not in rows])
+        return cursor - before
+
+    def insert_in_order(self, rows, first_unreviewed, key):
+        """Add rows where key sorts them, but never before first_unreviewed (binary search)"""
+        for row in rows:
+            row_key = key(row)
+            low, high = min(first_unreviewed, len(self.rows)), len(self.rows)
+            while low < high:
+                middle = (low + high) // 2
+                if key(self.rows[middle]) <= row_key:
+                    low = middle + 1
+                else:
+                    high = middle
+            self.rows.insert(low, row)
+
+    def shuffle_in(self, rows, first_unreviewed):
+        """Add rows at random positions from first_unreviewed onwards (inside-out Fisher-Yates)"""
+        first_unreviewed = min(first_unreviewed, len(self.rows))
+        for row in rows:
+            self.rows.append(row)
+            j = random.randint(first_unreviewed, len(self.rows) - 1)
+            self.rows[-1], self.rows[j] = self.rows[j], self.rows[-1]
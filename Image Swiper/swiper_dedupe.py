@@ -0,0 +1,195 @@
+"""Perceptual-hash index for finding duplicates and burst shots in Image Swiper.
+
+Every image gets a 64-bit difference hash (dHash): the image is shrunk to
+9x8 greyscale and each bit records whether a pixel is darker than its right
+neighbour. Copies, re-saves, resizes and shots fired a fraction of a second
+apart hash to the same or nearly the same bits. Hashes live in the
+image_hashes table of the metadata store, keyed by path and mtime, so only
+new or changed files are ever hashed - on a process pool, reading as little
+of each file as possible. Near neighbours are found by multi-index hashing
+(see find_clusters) and joined into clusters.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+
+from swiper_exif import ExtractProgress
+from swiper_loader import open_image
+
+HASH_SIZE = 8
+
+# Hashes at most this many bits apart (out of 64) count as the same picture
+DUPLICATE_DISTANCE = 4
+
+
+def dhash(img):
+    """64-bit difference hash of a Pillow image"""
+    img = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+    pixels = img.tobytes()
+    bits = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            bits = (bits << 1) | (row[x] < row[x + 1])
+    return bits
+
+
+def hash_file(path):
+    """dHash of an image file, decoding JPEGs at 1/8 scale (RAW files via their preview)"""
+    img = open_image(Path(path))
+    if img.format == 'JPEG':
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    return dhash(img)
+
+
+def hash_chunk(paths):
+    """Worker entry point: (path, hash or None, mtime) for a chunk of files, skipping vanished ones"""
+    records = []
+    for path in paths:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        try:
+            value = hash_file(path)
+        except Exception:
+            # Undecodable - remembered as such so it isn't retried every session
+            value = None
+        records.append((path, value, mtime))
+    return records
+
+
+def band_masks(max_distance, bits=HASH_SIZE * HASH_SIZE):
+    """(shift, mask) for max_distance + 1 bands covering the hash as evenly as possible"""
+    bands = max_distance + 1
+    masks = []
+    shift = 0
+    for i in range(bands):
+        width = bits // bands + (1 if i < bits % bands else 0)
+        masks.append((shift, (1 << width) - 1))
+        shift += width
+    return masks
+
+
+def find_clusters(hashed, max_distance=DUPLICATE_DISTANCE):
+    """Group (item, hash) pairs into clusters of near-identical images.
+
+    Uses multi-index hashing: each hash is cut into max_distance + 1 bands,
+    and two hashes at most max_distance bits apart must agree exactly on at
+    least one band, so only items sharing a band value are ever compared.
+    Returns lists of two or more items, each in input order, ordered by
+    where their first item appeared. Clusters are transitive: a burst where
+    each shot is close to the next ends up as one cluster.
+    """
+    # Union-find over positions
+    parent = list(range(len(hashed)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Exact copies are joined up front, so each distinct hash is only compared once
+    first_with = {}
+    for position, (_, value) in enumerate(hashed):
+        parent[position] = first_with.setdefault(value, position)
+    values = list(first_with)
+    positions = list(first_with.values())
+
+    for shift, mask in band_masks(max_distance):
+        buckets = {}
+        for i, value in enumerate(values):
+            buckets.setdefault((value >> shift) & mask, []).append(i)
+        for bucket in buckets.values():
+            if len(bucket) < 2:
+                continue
+            for n, i in enumerate(bucket):
+                value = values[i]
+                for j in bucket[n + 1:]:
+                    if (value ^ values[j]).bit_count() <= max_distance:
+                        root_a, root_b = find(positions[i]), find(positions[j])
+                        if root_a != root_b:
+                            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = {}
+    for position in range(len(hashed)):
+        groups.setdefault(find(position), []).append(hashed[position][0])
+    return [group for _, group in sorted(groups.items()) if len(group) > 1]
+
+
+class DuplicateFinder:
+    """Hashes whatever isn't hashed yet, then clusters, all on a background thread.
+
+    entries are (path, mtime, size) tuples; an mtime of 0 means unknown and
+    the file is stat'ed. When done, `clusters` holds lists of (path, size).
+    Poll `done` and `progress` from the Tk thread.
+    """
+
+    def __init__(self, store, folder, entries, workers=None, chunk_size=32,
+                 max_distance=DUPLICATE_DISTANCE):
+        self.store = store
+        self.folder = folder
+        self.entries = entries
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_distance = max_distance
+        self.progress = ExtractProgress()
+        self.stop_event = threading.Event()
+        self.clusters = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="duplicate-finder", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def _run(self):
+        try:
+            hashes = self.store.hashes_under(self.folder)
+            todo = []
+            for path, mtime, _ in self.entries:
+                known = hashes.get(path)
+                if known is not None and not mtime:
+                    # Catalog built by a scan, so the mtime isn't known yet - ask the file
+                    try:
+                        mtime = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                if known is None or known[1] != mtime:
+                    todo.append(path)
+            self._hash(todo, hashes)
+            if self.stop_event.is_set():
+                return
+            hashed = [((path, size), hashes[path][0]) for path, _, size in self.entries
+                      if hashes.get(path, (None,))[0] is not None]
+            self.clusters = find_clusters(hashed, self.max_distance)
+        except Exception as e:
+            self.error = e
+
+    def _hash(self, paths, hashes):
+        if not paths:
+            return
+        self.progress.submitted = len(paths)
+        chunks = [paths[i:i + self.chunk_size] for i in range(0, len(paths), self.chunk_size)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(hash_chunk, chunk) for chunk in chunks]
+            for future, chunk in zip(futures, chunks):
+                if self.stop_event.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                records = future.result()
+                self.store.set_hashes(records)
+                for path, value, mtime in records:
+                    hashes[path] = (value, mtime)
+                self.progress.done += len(chunk)
+        self.store.flush()
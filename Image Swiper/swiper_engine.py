@@ -0,0 +1,645 @@
+"""Headless review engine for Image Swiper.
+
+ReviewEngine holds everything about a review session that isn't drawing:
+the metadata store, the catalog and review order, the background scan and
+index workers, the decoded-image caches and the keep / delete / undo
+bookkeeping. The Tk UI drives it from its event handlers and after() polls
+and only turns what it hands back into widgets, so none of this needs a
+display - bench_swiper.py drives the same engine headless.
+
+Nothing here blocks on a worker: poll_scan(), poll_index() and
+poll_watcher() drain whatever the workers have produced so far and return
+straight away. Once the index is up to date a FolderWatcher follows the
+folder, and files added or removed outside the app are applied to the
+catalog and review order as they happen, so moving between images never
+has to ask the filesystem whether a file still exists.
+
+A session - catalog, review order, cursor, kept images, settings and
+counters - is snapshotted into the store (save_session) and restored when
+the folder is opened again, before the filesystem has been looked at; the
+index is then reconciled in the background as usual.
+"""
+import json
+import os
+import queue
+import random
+from array import array
+from collections import Counter, namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from swiper_catalog import Catalog, CatalogView, pack_date, path_sort_key
+from swiper_exif import read_date_taken
+from swiper_loader import ImageCache, Prefetcher, cache_key, PREFETCH_AHEAD, PREFETCH_BEHIND
+from swiper_previews import PreviewCache, DEFAULT_PREVIEW_BYTES
+from swiper_scanner import Scanner, IndexUpdater
+from swiper_store import MetadataStore
+from swiper_trace import span
+from swiper_trash import DeletionQueue
+from swiper_watcher import FolderWatcher
+
+# Supported image formats
+IMAGE_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif',
+    '.ico', '.heic', '.heif', '.jfif', '.ppm', '.pgm', '.pbm', '.pnm',
+    '.svg', '.raw', '.cr2', '.nef', '.arw', '.dng', '.orf'
+}
+
+# What the decoders need from os.stat, read from the catalog instead
+CatalogStat = namedtuple('CatalogStat', 'st_mtime st_size')
+
+
+class ReviewEngine:
+    """One review session: which images, in what order, where the cursor is and what was decided.
+
+    data_dir holds OnThisDay_cache.db, deletions.journal and the previews
+    folder. `images` is a CatalogView over `catalog`; `lookups` counts where
+    each displayed image came from ('memory', 'preview' or 'miss' - decoded on demand).
+    """
+
+    def __init__(self, data_dir, preview_bytes=DEFAULT_PREVIEW_BYTES, trash_backend=None,
+                 extensions=IMAGE_EXTENSIONS):
+        data_dir = Path(data_dir)
+        self.db_path = data_dir / "OnThisDay_cache.db"
+        self.store = MetadataStore(self.db_path)
+        # Deletes run on a background worker; the journal lets unfinished ones resume after a crash
+        self.deletions = DeletionQueue(self.store, data_dir / "deletions.journal", backend=trash_backend)
+        # Canvas-sized previews are kept on disk between sessions, next to the database
+        self.previews = PreviewCache(self.store, data_dir / "previews", max_bytes=preview_bytes,
+                                     stat=self.path_stat)
+        # Decoded images are prefetched in the background into a memory-capped cache
+        self.image_cache = ImageCache()
+        self.prefetcher = Prefetcher(self.image_cache, loader=self.previews.load, stat=self.path_stat)
+        # {path: CatalogStat} for the images around the cursor, for the workers
+        self.known_stats = {}
+        self.extensions = extensions
+
+        self.folder = None
+        self.catalog = None
+        self.dates_ready = False
+        self.images = []
+        self.current_index = 0
+        self.random_mode = False
+        self.include_subdirs = True
+        self.on_this_day_mode = False
+        self.scanner = None
+        self.index_updater = None
+        self.watcher = None
+        self.lookups = Counter()
+        # (catalog, rows, removed rows) as of the last session snapshot, so unchanged catalogs aren't re-saved
+        self.saved_catalog = None
+        self.saved_state = None
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.processed_count = 0
+        self.deleted_count = 0
+        self.space_saved_mb = 0
+
+    def close(self):
+        self.save_session()
+        self.stop_workers()
+        self.prefetcher.shutdown()
+        self.deletions.close()
+        self.previews.close()
+        self.store.close()
+
+    # Loading a folder
+
+    def open_folder(self, folder, resume=True):
+        """Start loading a folder in the background.
+
+        Returns 'session' if the last review of it was restored, 'index' if
+        it comes from the index (seen before) or 'scan' if it's being scanned
+        for the first time; poll_scan / poll_index pick up the results.
+        """
+        self.save_session()
+        self.stop_workers()
+        self.prefetcher.cancel()
+        self.folder = folder
+        self.saved_catalog = None
+        self.saved_state = None
+
+        if resume and self.restore_session():
+            # Carry on straight away; the index catches up with the filesystem in the
+            # background and its catalog is swapped in without moving the cursor
+            self.start_index_update(preload=False)
+            return 'session'
+        if not resume:
+            # Starting over - the old snapshot mustn't come back if this one never gets saved
+            self.store.forget_session(folder)
+
+        self.reset_counts()
+        self.catalog = Catalog(folder)
+        self.dates_ready = False
+        self.images = CatalogView(self.catalog)
+        self.current_index = 0
+
+        if self.store.is_indexed(folder):
+            # Seen this folder before - the catalog comes from the index, then any
+            # directories that changed since are re-read in the background
+            self.start_index_update(preload=True)
+            return 'index'
+
+        # Walk the whole tree once in the background; images can be shown as soon as
+        # the first batch arrives, and dates are indexed once the walk is done
+        self.scanner = Scanner(folder, self.extensions).start()
+        return 'scan'
+
+    def poll_scan(self):
+        """Add whatever the scan has found since the last call; returns (images added, finished)"""
+        scanner = self.scanner
+        if scanner is None:
+            return 0, True
+        new_images = []
+        finished = False
+        while True:
+            try:
+                batch = scanner.batches.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                finished = True
+                break
+            new_images.extend(batch)
+        if finished:
+            self.scanner = None
+        if new_images:
+            with span('add_images', count=len(new_images)):
+                self.add_images(new_images)
+        return len(new_images), finished
+
+    def add_images(self, new_images):
+        """Add scanned images to the catalog, and to the review order if they pass the filters"""
+        rows = self.build_view(self.catalog.extend(new_images))
+        if not self.random_mode:
+            # The scanner yields paths in sorted order, so appending keeps the order sorted
+            self.images.append(rows)
+        else:
+            # Each new image swaps with a random unreviewed slot
+            self.images.shuffle_in(rows, self.current_index + 1)
+
+    def start_index_update(self, preload=False):
+        """Bring the metadata index up to date in the background (only changed directories are re-read)"""
+        self.index_updater = IndexUpdater(self.store, self.folder, self.extensions, preload=preload).start()
+        return self.index_updater
+
+    def poll_index(self):
+        """Catalogs the index updater has built since the last call, and whether it has finished"""
+        updater = self.index_updater
+        if updater is None:
+            return [], True
+        # Checked before draining so a catalog put just before finishing isn't missed
+        finished = updater.done
+        catalogs = []
+        while True:
+            try:
+                catalogs.append(updater.catalogs.get_nowait())
+            except queue.Empty:
+                break
+        if finished:
+            self.index_updater = None
+            # From here on the watcher keeps the index (and catalog) current
+            self.start_watcher()
+        return catalogs, finished
+
+    def start_watcher(self):
+        if self.watcher is None and self.folder is not None:
+            self.watcher = FolderWatcher(self.store, self.folder, self.extensions).start()
+        return self.watcher
+
+    def poll_watcher(self):
+        """Apply what the folder watcher has seen since the last call; returns (images added, images removed)"""
+        watcher = self.watcher
+        if watcher is None:
+            return 0, 0
+        changes = []
+        while True:
+            try:
+                changes.extend(watcher.changes.get_nowait())
+            except queue.Empty:
+                break
+        if not changes:
+            return 0, 0
+        with span('apply_changes', count=len(changes)):
+            return self.apply_changes(changes)
+
+    def apply_changes(self, changes):
+        """Bring the catalog and review order in line with (kind, path) changes from the watcher.
+
+        New images go after the cursor - where they sort, or at random in
+        random order - so they're still to come. Files deleted here stay put
+        (they can be undone); anything else that has gone is dropped.
+        """
+        catalog = self.catalog
+        added = [path for kind, path in changes if kind == 'added']
+        removed = [path for kind, path in changes if kind == 'removed' and not self.deletions.is_deleted(path)]
+        removed_dirs = [path for kind, path in changes if kind == 'removed_dir']
+        found = catalog.find(added + removed)
+        # The watcher has already written their rows
+        metadata = self.store.get_many(added)
+        new_rows = []
+        for filepath in added:
+            if filepath not in metadata:
+                continue
+            date_taken, size, mtime = metadata[filepath]
+            row = found.get(filepath)
+            if row is None:
+                new_rows.append(catalog.insert(filepath, mtime or 0.0, size or 0, pack_date(date_taken)))
+            else:
+                # Rewritten in place
+                catalog.mtime[row] = mtime or 0.0
+                catalog.size[row] = size or 0
+                catalog.taken[row] = pack_date(date_taken)
+
+        gone = {found[path] for path in removed if path in found}
+        if removed_dirs:
+            gone.update(row for row in catalog.rows_under(removed_dirs)
+                        if not self.deletions.is_deleted(catalog.path(row)))
+        gone -= catalog.removed
+        if gone:
+            catalog.remove(gone)
+            self.current_index = self.images.discard(gone, self.current_index)
+
+        rows = self.build_view(new_rows) if new_rows else []
+        if rows:
+            if self.random_mode:
+                self.images.shuffle_in(rows, self.current_index + 1)
+            elif self.on_this_day_mode:
+                self.images.insert_in_order(rows, self.current_index + 1, catalog.taken.__getitem__)
+            else:
+                self.images.insert_in_order(rows, self.current_index + 1,
+                                            lambda row: path_sort_key(catalog.path(row)))
+        return len(new_rows), len(gone)
+
+    def use_catalog(self, catalog, restart=False):
+        """Switch to a catalog built from the index, carrying on from the current image.
+
+        With restart the review order is simply rebuilt. Returns True if the
+        cursor is still on the same image, so nothing needs redrawing.
+        """
+        old_catalog = self.catalog
+        self.catalog = catalog
+        self.dates_ready = True
+        remap = None
+        if 1 in old_catalog.decided:
+            # Images kept earlier stay kept in the new catalog
+            remap, added = catalog.match_rows(old_catalog)
+            for old_row, row in enumerate(remap):
+                if row >= 0 and old_catalog.decided[old_row]:
+                    catalog.decided[row] = 1
+        if restart:
+            self.set_view()
+            return False
+
+        if remap is None:
+            remap, added = catalog.match_rows(old_catalog)
+        current = None
+        if self.current_index < len(self.images):
+            current = self.images[self.current_index]
+            current_row = remap[self.images.rows[self.current_index]]
+        if self.random_mode:
+            # Keep the shuffled order: drop images that have gone and shuffle in new ones
+            reviewed = [remap[row] for row in self.images.rows[:self.current_index] if remap[row] >= 0]
+            rest = [remap[row] for row in self.images.rows[self.current_index:] if remap[row] >= 0]
+            self.images = CatalogView(catalog, array('I', reviewed + rest))
+            self.current_index = len(reviewed)
+            self.images.shuffle_in(self.build_view(added), self.current_index + 1)
+        else:
+            self.images = CatalogView(catalog, self.build_view())
+            position = self.images.position(current_row) if current is not None and current_row >= 0 else None
+            if position is not None:
+                self.current_index = position
+        return (current is not None and self.current_index < len(self.images)
+                and self.images[self.current_index] == current)
+
+    def stop_workers(self):
+        if self.scanner is not None:
+            self.scanner.stop()
+            self.scanner = None
+        if self.index_updater is not None:
+            self.index_updater.stop()
+            self.index_updater = None
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    # The review order
+
+    def this_day_filter(self):
+        """(month, day) to filter on in On This Day mode, otherwise None"""
+        if not self.on_this_day_mode:
+            return None
+        today = datetime.now()
+        return (today.month, today.day)
+
+    def build_view(self, rows=None):
+        """Catalog rows filtered and ordered for the current settings - no filesystem access"""
+        rows = self.catalog.select(rows, recursive=self.include_subdirs, month_day=self.this_day_filter())
+        if self.random_mode:
+            random.shuffle(rows)
+        return rows
+
+    def set_view(self, keep_current=False):
+        """Rebuild the review order after a setting changed; returns how many images it holds"""
+        current_row = None
+        if keep_current and self.current_index < len(self.images):
+            current_row = self.images.rows[self.current_index]
+        self.prefetcher.cancel()
+        self.images = CatalogView(self.catalog, self.build_view())
+        position = self.images.position(current_row) if current_row is not None else None
+        self.current_index = position or 0
+        if position is None:
+            self.skip_decided()
+        return len(self.images)
+
+    @property
+    def current_path(self):
+        if self.current_index < len(self.images):
+            return self.images[self.current_index]
+        return None
+
+    def date_taken(self, index):
+        """When the image at a position was taken (straight from the catalog once the index is loaded)"""
+        if self.dates_ready:
+            return self.catalog.date_taken(self.images.rows[index])
+        return self.get_cached_date(self.images[index])
+
+    def get_cached_date(self, img_path):
+        """Get date from cache, or extract and cache it if not found"""
+        with span('get_cached_date'):
+            return self._cached_date(img_path)
+
+    def _cached_date(self, img_path):
+        cached = self.store.get(img_path)
+
+        stat = img_path.stat()
+        current_mtime = stat.st_mtime
+
+        # If cached and file hasn't changed, use cached date
+        if cached and cached[2] == current_mtime:
+            if cached[0]:
+                return datetime.fromisoformat(cached[0])
+            return None
+
+        # Otherwise, extract date and queue a cache update
+        img_date = self.extract_image_date(img_path)
+        self.store.upsert(img_path,
+                          img_date.isoformat() if img_date else None,
+                          stat.st_size,
+                          current_mtime)
+
+        return img_date
+
+    def extract_image_date(self, img_path):
+        """Extract date from EXIF data, fall back to file modification date"""
+        # Try EXIF data first (only the file's header structures are read)
+        img_date = read_date_taken(img_path)
+        if img_date is not None:
+            return img_date
+
+        # Fall back to file modification date
+        try:
+            return datetime.fromtimestamp(img_path.stat().st_mtime)
+        except:
+            return None
+
+    # Decoded images
+
+    def row_stat(self, row):
+        """A catalog row's mtime and size, as the index and watcher last saw them"""
+        mtime = self.catalog.mtime[row]
+        if not mtime:
+            # Not indexed yet (straight from a first scan) - only now is the disk asked
+            with span('stat'):
+                return os.stat(self.catalog.path(row))
+        return CatalogStat(mtime, self.catalog.size[row])
+
+    def path_stat(self, img_path):
+        """stat for the decode workers: from the catalog for images near the cursor, else the disk"""
+        stat = self.known_stats.get(str(img_path))
+        return stat if stat is not None else os.stat(img_path)
+
+    def lookup(self, index, canvas_size):
+        """(path, stat, cache key, image) for the image at a position in the review
+        order; the image comes from memory or the previews folder, and is None if
+        it still has to be decoded. The stat comes from the catalog, so a file
+        removed outside the app only shows up when decoding it fails.
+
+        Raises FileNotFoundError for files deleted here.
+        """
+        img_path = self.images[index]
+        if self.deletions.is_deleted(img_path):
+            raise FileNotFoundError(img_path)
+        stat = self.row_stat(self.images.rows[index])
+        self.known_stats[str(img_path)] = stat
+        key = cache_key(img_path, stat.st_mtime, canvas_size)
+        img = self.image_cache.get(key)
+        if img is not None:
+            self.lookups['memory'] += 1
+            return img_path, stat, key, img
+        # Reviewed before? Then a preview is waiting on disk
+        img = self.previews.get(img_path, stat, canvas_size)
+        if img is not None:
+            self.lookups['preview'] += 1
+            self.image_cache.put(key, img)
+        else:
+            self.lookups['miss'] += 1
+        return img_path, stat, key, img
+
+    def decode(self, img_path, stat, canvas_size):
+        """Decode a file that lookup() missed, reusing any in-flight background decode"""
+        return self.prefetcher.load(img_path, stat.st_mtime, canvas_size)
+
+    def current_image(self, canvas_size):
+        """The current image scaled to canvas_size, decoding it here if it isn't ready"""
+        img_path, stat, _, img = self.lookup(self.current_index, canvas_size)
+        if img is None:
+            img = self.decode(img_path, stat, canvas_size)
+        return img
+
+    def prefetch(self, canvas_size):
+        """Queue the next few images (and the previous one) for background decoding"""
+        start = max(0, self.current_index - PREFETCH_BEHIND)
+        end = min(len(self.images), self.current_index + 1 + PREFETCH_AHEAD)
+        # The current image stays in the list so its full decode isn't cancelled
+        current = self.images[self.current_index:self.current_index + 1]
+        ahead = self.images[self.current_index + 1:end]
+        behind = self.images[start:self.current_index]
+        rows = self.images.rows
+        self.known_stats = {str(self.images[index]): self.row_stat(rows[index]) for index in range(start, end)
+                            if self.catalog.mtime[rows[index]]}
+        self.prefetcher.request(current + ahead + behind, canvas_size)
+
+    @property
+    def hit_rate(self):
+        """Share of lookups served without decoding, or None before the first"""
+        total = sum(self.lookups.values())
+        if not total:
+            return None
+        return 1 - self.lookups['miss'] / total
+
+    # Decisions
+
+    def keep(self):
+        """Keep the current image and move on; False if there's nothing to decide"""
+        if self.current_index >= len(self.images):
+            return False
+        self.catalog.decided[self.images.rows[self.current_index]] = 1
+        self.processed_count += 1
+        self.advance()
+        return True
+
+    def keep_index(self, index):
+        """Mark the image at a position as kept without moving (grid pages)"""
+        self.catalog.decided[self.images.rows[index]] = 1
+
+    def delete(self):
+        """Queue the current image for the trash and move on; returns its Deletion, or None"""
+        if self.current_index >= len(self.images):
+            return None
+        # Only queue the delete - the trash move and cache update happen in the background
+        deletion = self.delete_path(self.images[self.current_index])
+        self.processed_count += 1
+        self.advance()
+        return deletion
+
+    def delete_path(self, img_path):
+        """Queue any file for the trash (grid and duplicate decisions); counted as deleted"""
+        self.deleted_count += 1
+        return self.deletions.delete(img_path)
+
+    def undo(self):
+        """Undo the most recent delete; returns its Deletion, or None if there's nothing to undo"""
+        deletion = self.deletions.undo()
+        if deletion is not None:
+            self.deleted_count -= 1
+            self.processed_count -= 1
+        return deletion
+
+    def advance(self):
+        """Move past the current image and any after it that were kept in an earlier sitting"""
+        self.current_index += 1
+        self.skip_decided()
+
+    def skip_decided(self):
+        rows, decided = self.images.rows, self.catalog.decided
+        while self.current_index < len(rows) and decided[rows[self.current_index]]:
+            self.current_index += 1
+
+    def reset_decisions(self):
+        """Forget which images were kept, to review the whole folder again from the start"""
+        self.catalog.decided = bytearray(len(self.catalog))
+        self.reset_counts()
+        self.current_index = 0
+        # The next save writes a whole new snapshot instead of updating the old one
+        self.store.forget_session(self.folder)
+        self.saved_catalog = None
+        self.saved_state = None
+
+    def step(self, direction):
+        """Move to the nearest available image in a direction (+1 / -1); False if there isn't one"""
+        index = self.current_index + direction
+        while 0 <= index < len(self.images):
+            # Files removed elsewhere are dropped by the watcher; ones deleted here are skipped
+            if not self.deletions.is_deleted(self.images[index]):
+                self.current_index = index
+                return True
+            index += direction
+        return False
+
+    def deletion_results(self):
+        """Drain the deletion worker's results, updating the counts; yields (outcome, deletion, error)"""
+        while True:
+            try:
+                outcome, deletion, error = self.deletions.results.get_nowait()
+            except queue.Empty:
+                return
+            if outcome == 'deleted':
+                deletion.counted = True
+                self.space_saved_mb += deletion.size_mb
+            elif outcome == 'delete_failed':
+                with self.deletions.lock:
+                    still_undoable = deletion in self.deletions.undo_stack
+                    if still_undoable:
+                        self.deletions.undo_stack.remove(deletion)
+                if still_undoable:
+                    self.deleted_count -= 1
+                    self.processed_count -= 1
+            elif outcome == 'restored':
+                if getattr(deletion, 'counted', False):
+                    self.space_saved_mb -= deletion.size_mb
+                    deletion.counted = False
+            elif outcome == 'restore_failed':
+                self.deleted_count += 1
+                self.processed_count += 1
+            yield outcome, deletion, error
+
+    # Session snapshots
+
+    def session_state(self):
+        return {
+            'current_index': self.current_index,
+            'random_mode': self.random_mode,
+            'include_subdirs': self.include_subdirs,
+            'on_this_day_mode': self.on_this_day_mode,
+            'this_day': self.this_day_filter(),
+            'dates_ready': self.dates_ready,
+            'processed_count': self.processed_count,
+            'deleted_count': self.deleted_count,
+            'space_saved_mb': self.space_saved_mb,
+            'rows': len(self.catalog),
+        }
+
+    def save_session(self):
+        """Snapshot the session for this folder; the catalog is only re-saved if it changed"""
+        if self.folder is None or self.catalog is None or not len(self.catalog):
+            return False
+        state = json.dumps(self.session_state())
+        decided = bytes(self.catalog.decided)
+        if (state, decided) == self.saved_state:
+            return False
+        catalog = None
+        if self.saved_catalog != (self.catalog, len(self.catalog), len(self.catalog.removed)):
+            with span('save_catalog', rows=len(self.catalog)):
+                catalog = self.catalog.to_bytes()
+        with span('save_session'):
+            self.store.save_session(self.folder, state, decided, self.images.rows.tobytes(), catalog)
+        self.saved_catalog = (self.catalog, len(self.catalog), len(self.catalog.removed))
+        self.saved_state = (state, decided)
+        return True
+
+    def restore_session(self):
+        """Pick up this folder's last session from its snapshot; False if there isn't a usable one"""
+        saved = self.store.load_session(self.folder)
+        if saved is None or saved[1] is None:
+            return False
+        with span('restore_session'):
+            state, catalog_blob, decided, view_rows = saved
+            state = json.loads(state)
+            catalog = Catalog.from_bytes(catalog_blob)
+            rows = array('I')
+            rows.frombytes(view_rows)
+            if (len(catalog) != state['rows'] or len(decided) != len(catalog)
+                    or (rows and max(rows) >= len(catalog))):
+                return False
+            catalog.decided = bytearray(decided)
+
+        self.catalog = catalog
+        self.dates_ready = state['dates_ready']
+        self.random_mode = state['random_mode']
+        self.include_subdirs = state['include_subdirs']
+        self.on_this_day_mode = state['on_this_day_mode']
+        self.processed_count = state['processed_count']
+        self.deleted_count = state['deleted_count']
+        self.space_saved_mb = state['space_saved_mb']
+        self.saved_catalog = (catalog, len(catalog), len(catalog.removed))
+        this_day = state['this_day']
+        if self.on_this_day_mode and tuple(this_day or ()) != self.this_day_filter():
+            # Saved on another day - that day's images aren't today's
+            self.images = CatalogView(catalog)
+            self.set_view()
+        else:
+            self.images = CatalogView(catalog, rows)
+            self.current_index = min(state['current_index'], len(rows))
+        return True
@@ -0,0 +1,557 @@
+"""Header-only EXIF date extraction for Image Swiper.
+
+Instead of handing the whole file to piexif, only the container structure at
+the start of the file is read (a small leading buffer plus the odd targeted
+seek) to find DateTimeOriginal. Supported containers: JPEG, TIFF and the
+TIFF-based RAW formats, HEIC/HEIF, WebP and PNG. The same walk also finds the
+small JPEG thumbnail most cameras embed in IFD1, used for instant first paint,
+and for RAW files the largest embedded JPEG preview (read_raw_info).
+
+DateExtractor runs this over many files on a process pool, a chunk of files
+per task, and streams the results into the metadata store.
+"""
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Most headers fit comfortably in the first read
+HEAD_BYTES = 64 * 1024
+
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_THUMBNAIL_OFFSET = 0x0201
+TAG_THUMBNAIL_LENGTH = 0x0202
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPG_FROM_RAW = 0x002E  # Panasonic RW2
+
+# Byte sizes of TIFF field types
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+
+class _Source:
+    """Random access over a file that serves reads from the leading buffer when it can"""
+
+    def __init__(self, f, head_bytes=HEAD_BYTES):
+        self.f = f
+        self.head = f.read(head_bytes)
+
+    def read(self, offset, length):
+        if offset < 0 or length < 0:
+            return b''
+        end = offset + length
+        if end <= len(self.head):
+            return self.head[offset:end]
+        self.f.seek(offset)
+        return self.f.read(length)
+
+
+def parse_exif_datetime(value):
+    """datetime from an EXIF 'YYYY:MM:DD HH:MM:SS' string, or None"""
+    try:
+        if isinstance(value, bytes):
+            value = value.split(b'\0', 1)[0].decode('ascii')
+        return datetime.strptime(value.strip(), '%Y:%m:%d %H:%M:%S')
+    except (ValueError, UnicodeDecodeError):
+        # Blank or placeholder dates like '0000:00:00 00:00:00'
+        return None
+
+
+def read_ifd(src, base, offset, byte_order):
+    """{tag: (type, count, raw value/offset field)} for the IFD at base + offset"""
+    count_bytes = src.read(base + offset, 2)
+    if len(count_bytes) < 2:
+        return {}
+    (count,) = struct.unpack(byte_order + 'H', count_bytes)
+    data = src.read(base + offset + 2, count * 12)
+    entries = {}
+    for i in range(len(data) // 12):
+        tag, field_type, field_count = struct.unpack(byte_order + 'HHI', data[i * 12:i * 12 + 8])
+        entries[tag] = (field_type, field_count, data[i * 12 + 8:i * 12 + 12])
+    return entries
+
+
+def read_ifd_chain(src, base, byte_order, first_offset, limit=8):
+    """Yield the IFDs linked from first_offset (IFD0, IFD1, ...)"""
+    offset = first_offset
+    seen = set()
+    while offset and offset not in seen and len(seen) < limit:
+        seen.add(offset)
+        entries = read_ifd(src, base, offset, byte_order)
+        if not entries:
+            return
+        yield entries
+        count = len(entries)
+        next_bytes = src.read(base + offset + 2 + count * 12, 4)
+        if len(next_bytes) < 4:
+            return
+        (offset,) = struct.unpack(byte_order + 'I', next_bytes)
+
+
+def field_value(src, base, byte_order, field):
+    """Raw bytes of an IFD field, following the offset when it doesn't fit inline"""
+    field_type, count, raw = field
+    size = TIFF_TYPE_SIZES.get(field_type, 1) * count
+    if size <= 4:
+        return raw[:size]
+    (offset,) = struct.unpack(byte_order + 'I', raw)
+    return src.read(base + offset, size)
+
+
+def field_int(byte_order, field):
+    """First integer value of a SHORT or LONG field"""
+    field_type, _, raw = field
+    if field_type == 3:
+        return struct.unpack(byte_order + 'H', raw[:2])[0]
+    return struct.unpack(byte_order + 'I', raw)[0]
+
+
+def tiff_header(src, base):
+    """(byte order, first IFD offset) for a TIFF header at base, or None"""
+    header = src.read(base, 8)
+    if len(header) < 8:
+        return None
+    if header[:2] == b'II':
+        byte_order = '<'
+    elif header[:2] == b'MM':
+        byte_order = '>'
+    else:
+        return None
+    # The magic number varies (42 for TIFF, 'RO'/'RS' for ORF, 0x55 for RW2), so it isn't checked
+    (first_ifd,) = struct.unpack(byte_order + 'I', header[4:8])
+    return byte_order, first_ifd
+
+
+def field_ints(src, base, byte_order, field):
+    """All values of a SHORT or LONG array field"""
+    field_type, count, _ = field
+    code = 'H' if field_type == 3 else 'I'
+    data = field_value(src, base, byte_order, field)
+    count = min(count, len(data) // struct.calcsize(code))
+    return list(struct.unpack(byte_order + code * count, data[:count * struct.calcsize(code)]))
+
+
+def next_ifd_offset(src, base, offset, byte_order):
+    count_bytes = src.read(base + offset, 2)
+    if len(count_bytes) < 2:
+        return 0
+    (count,) = struct.unpack(byte_order + 'H', count_bytes)
+    next_bytes = src.read(base + offset + 2 + count * 12, 4)
+    if len(next_bytes) < 4:
+        return 0
+    return struct.unpack(byte_order + 'I', next_bytes)[0]
+
+
+def scan_tiff(src, base, max_ifds=32):
+    """Walk every IFD of a TIFF structure once.
+
+    Follows the IFD0/IFD1 chain plus the Exif IFD and SubIFDs (where NEF and
+    DNG keep their previews). Returns (DateTimeOriginal or None, candidates)
+    where candidates are (offset, length) of embedded JPEG streams found via
+    JPEGInterchangeFormat, single-strip JPEG-compressed images (CR2, DNG
+    previews) or the RW2 JpgFromRaw tag. Offsets are absolute in the file.
+    """
+    header = tiff_header(src, base)
+    if header is None:
+        return None, []
+    byte_order, first_ifd = header
+    date_taken = None
+    candidates = []
+    queue = [(first_ifd, True)]
+    seen = set()
+    while queue and len(seen) < max_ifds:
+        offset, follow_chain = queue.pop(0)
+        if not offset or offset in seen:
+            continue
+        seen.add(offset)
+        ifd = read_ifd(src, base, offset, byte_order)
+        if not ifd:
+            continue
+
+        if date_taken is None and TAG_DATETIME_ORIGINAL in ifd:
+            date_taken = parse_exif_datetime(field_value(src, base, byte_order, ifd[TAG_DATETIME_ORIGINAL]))
+        if TAG_EXIF_IFD in ifd:
+            queue.append((field_int(byte_order, ifd[TAG_EXIF_IFD]), False))
+        if TAG_SUB_IFDS in ifd:
+            queue.extend((sub, False) for sub in field_ints(src, base, byte_order, ifd[TAG_SUB_IFDS]))
+
+        if TAG_THUMBNAIL_OFFSET in ifd and TAG_THUMBNAIL_LENGTH in ifd:
+            candidates.append((base + field_int(byte_order, ifd[TAG_THUMBNAIL_OFFSET]),
+                               field_int(byte_order, ifd[TAG_THUMBNAIL_LENGTH])))
+        if (TAG_STRIP_OFFSETS in ifd and TAG_STRIP_BYTE_COUNTS in ifd and TAG_COMPRESSION in ifd
+                and field_int(byte_order, ifd[TAG_COMPRESSION]) in (6, 7)):
+            strips = field_ints(src, base, byte_order, ifd[TAG_STRIP_OFFSETS])
+            counts = field_ints(src, base, byte_order, ifd[TAG_STRIP_BYTE_COUNTS])
+            if len(strips) == 1 and len(counts) == 1:
+                candidates.append((base + strips[0], counts[0]))
+        if TAG_JPG_FROM_RAW in ifd:
+            _, count, raw = ifd[TAG_JPG_FROM_RAW]
+            candidates.append((base + struct.unpack(byte_order + 'I', raw)[0], count))
+
+        if follow_chain:
+            queue.append((next_ifd_offset(src, base, offset, byte_order), True))
+    return date_taken, candidates
+
+
+def tiff_date(src, base):
+    """DateTimeOriginal from the TIFF structure starting at base"""
+    return scan_tiff(src, base)[0]
+
+
+def jpeg_frame_size(src, offset, max_scan=HEAD_BYTES):
+    """(width, height) of a JPEG stream Pillow can decode, else None.
+
+    Only baseline/extended/progressive Huffman frames count - the lossless
+    JPEG (SOF3) that CR2 and DNG use for the raw sensor data is rejected.
+    """
+    if src.read(offset, 2) != b'\xff\xd8':
+        return None
+    pos = offset + 2
+    while pos < offset + max_scan:
+        marker = src.read(pos, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        if kind == 0xFF:
+            pos += 1
+            continue
+        if kind in (0xC0, 0xC1, 0xC2):
+            height, width = struct.unpack('>HH', src.read(pos + 5, 4))
+            return width, height
+        if kind in (0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF, 0xD9, 0xDA):
+            return None
+        (length,) = struct.unpack('>H', marker[2:4])
+        pos += 2 + length
+    return None
+
+
+def read_raw_info(path, head_bytes=HEAD_BYTES):
+    """(DateTimeOriginal, JPEG bytes of the largest embedded preview) for a RAW file.
+
+    Both come from a single walk of the TIFF structure; either may be None.
+    Nothing is demosaiced - only the preview the camera already rendered is read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            src = _Source(f, head_bytes)
+            if src.head[:2] not in (b'II', b'MM'):
+                return None, None
+            date_taken, candidates = scan_tiff(src, 0)
+            best = None
+            for offset, length in set(candidates):
+                frame = jpeg_frame_size(src, offset)
+                if frame is None:
+                    continue
+                if best is None or frame[0] * frame[1] > best[0]:
+                    best = (frame[0] * frame[1], offset, length)
+            if best is None:
+                return date_taken, None
+            return date_taken, src.read(best[1], best[2])
+    except (OSError, struct.error, IndexError, ValueError):
+        return None, None
+
+
+def jpeg_exif_base(src):
+    """Offset of the TIFF header inside a JPEG's APP1 Exif segment, or None"""
+    offset = 2
+    while True:
+        marker = src.read(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        if kind == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if kind in (0xD9, 0xDA):
+            # End of image / start of scan - no more metadata segments
+            return None
+        (length,) = struct.unpack('>H', marker[2:4])
+        if kind == 0xE1 and src.read(offset + 4, 6) == b'Exif\0\0':
+            return offset + 10
+        offset += 2 + length
+
+
+def iter_boxes(src, start, end):
+    """Yield (type, payload start, box end) for ISO BMFF boxes between start and end"""
+    offset = start
+    while end is None or offset + 8 <= end:
+        header = src.read(offset, 8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        payload = offset + 8
+        if size == 1:
+            (size,) = struct.unpack('>Q', src.read(offset + 8, 8))
+            payload += 8
+        elif size == 0:
+            if end is None:
+                return
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield box_type, payload, offset + size
+        offset += size
+
+
+def _read_uint(src, offset, size):
+    if size == 0:
+        return 0, offset
+    data = src.read(offset, size)
+    return int.from_bytes(data, 'big'), offset + size
+
+
+def heif_exif_base(src):
+    """Offset of the TIFF header inside a HEIC/HEIF 'Exif' item, or None"""
+    meta = None
+    for box_type, payload, box_end in iter_boxes(src, 0, None):
+        if box_type == b'meta':
+            meta = (payload + 4, box_end)  # skip full box version/flags
+            break
+        if box_type == b'mdat':
+            return None
+    if meta is None:
+        return None
+
+    exif_item = None
+    locations = {}
+    for box_type, payload, box_end in iter_boxes(src, *meta):
+        version = src.read(payload, 1)[0] if box_type in (b'iinf', b'iloc') else 0
+        if box_type == b'iinf':
+            offset = payload + 4 + (2 if version == 0 else 4)
+            for entry_type, entry_payload, _ in iter_boxes(src, offset, box_end):
+                if entry_type != b'infe':
+                    continue
+                entry_version = src.read(entry_payload, 1)[0]
+                if entry_version < 2:
+                    continue
+                id_size = 2 if entry_version == 2 else 4
+                item_id, pos = _read_uint(src, entry_payload + 4, id_size)
+                if src.read(pos + 2, 4) == b'Exif':
+                    exif_item = item_id
+        elif box_type == b'iloc':
+            sizes = src.read(payload + 4, 2)
+            offset_size, length_size = sizes[0] >> 4, sizes[0] & 0x0F
+            base_offset_size = sizes[1] >> 4
+            index_size = sizes[1] & 0x0F if version in (1, 2) else 0
+            item_count, pos = _read_uint(src, payload + 6, 2 if version < 2 else 4)
+            for _ in range(item_count):
+                item_id, pos = _read_uint(src, pos, 2 if version < 2 else 4)
+                if version in (1, 2):
+                    pos += 2  # construction method
+                pos += 2  # data reference index
+                base_offset, pos = _read_uint(src, pos, base_offset_size)
+                extent_count, pos = _read_uint(src, pos, 2)
+                first_extent = None
+                for _ in range(extent_count):
+                    pos += index_size
+                    extent_offset, pos = _read_uint(src, pos, offset_size)
+                    _, pos = _read_uint(src, pos, length_size)
+                    if first_extent is None:
+                        first_extent = base_offset + extent_offset
+                if first_extent is not None:
+                    locations[item_id] = first_extent
+
+    if exif_item is None or exif_item not in locations:
+        return None
+    item_start = locations[exif_item]
+    # The item begins with a 4-byte offset to the TIFF header (usually past 'Exif\0\0')
+    (tiff_offset,) = struct.unpack('>I', src.read(item_start, 4))
+    return item_start + 4 + tiff_offset
+
+
+def webp_exif_base(src):
+    offset = 12
+    while True:
+        header = src.read(offset, 8)
+        if len(header) < 8:
+            return None
+        chunk_type, size = struct.unpack('<4sI', header)
+        if chunk_type == b'EXIF':
+            start = offset + 8
+            return start + 6 if src.read(start, 6) == b'Exif\0\0' else start
+        offset += 8 + size + (size & 1)
+
+
+def png_exif_base(src):
+    offset = 8
+    while True:
+        header = src.read(offset, 8)
+        if len(header) < 8:
+            return None
+        size, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            return offset + 8
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        offset += 12 + size
+
+
+def find_tiff_base(src):
+    """Offset of the EXIF TIFF structure for whatever container src holds, or None"""
+    head = src.head
+    if head[:2] == b'\xff\xd8':
+        return jpeg_exif_base(src)
+    if head[:2] in (b'II', b'MM'):
+        # TIFF and TIFF-based RAW (CR2, NEF, ARW, DNG, ORF, ...)
+        return 0
+    if head[4:8] == b'ftyp':
+        return heif_exif_base(src)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return webp_exif_base(src)
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return png_exif_base(src)
+    return None
+
+
+def read_date_taken(path, head_bytes=HEAD_BYTES):
+    """DateTimeOriginal for an image, reading only its header structures, or None"""
+    try:
+        with open(path, 'rb') as f:
+            src = _Source(f, head_bytes)
+            base = find_tiff_base(src)
+            if base is None:
+                return None
+            return tiff_date(src, base)
+    except (OSError, struct.error, IndexError, ValueError):
+        return None
+
+
+def read_exif_thumbnail(path, head_bytes=HEAD_BYTES):
+    """JPEG bytes of the thumbnail embedded in IFD1 of the EXIF data, or None"""
+    try:
+        with open(path, 'rb') as f:
+            src = _Source(f, head_bytes)
+            base = find_tiff_base(src)
+            if base is None:
+                return None
+            header = tiff_header(src, base)
+            if header is None:
+                return None
+            byte_order, first_ifd = header
+            ifds = list(read_ifd_chain(src, base, byte_order, first_ifd, limit=2))
+            if len(ifds) < 2:
+                return None
+            ifd1 = ifds[1]
+            if TAG_THUMBNAIL_OFFSET not in ifd1 or TAG_THUMBNAIL_LENGTH not in ifd1:
+                return None
+            offset = field_int(byte_order, ifd1[TAG_THUMBNAIL_OFFSET])
+            length = field_int(byte_order, ifd1[TAG_THUMBNAIL_LENGTH])
+            data = src.read(base + offset, length)
+            if len(data) != length or data[:2] != b'\xff\xd8':
+                return None
+            return data
+    except (OSError, struct.error, IndexError, ValueError):
+        return None
+
+
+def extract_date_record(path):
+    """(path, ISO date, size, mtime) - EXIF date, falling back to the file's mtime"""
+    stat = os.stat(path)
+    img_date = read_date_taken(path) or datetime.fromtimestamp(stat.st_mtime)
+    return path, img_date.isoformat(), stat.st_size, stat.st_mtime
+
+
+def extract_chunk(paths):
+    """Worker entry point: date records for a chunk of files, skipping vanished ones"""
+    records = []
+    for path in paths:
+        try:
+            records.append(extract_date_record(path))
+        except OSError:
+            pass
+    return records
+
+
+class ExtractProgress:
+    """Counters the UI can poll while a DateExtractor is running"""
+
+    def __init__(self):
+        self.submitted = 0
+        self.done = 0
+        self.started = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.done / max(time.perf_counter() - self.started, 1e-9)
+
+
+class DateExtractor:
+    """Extracts dates for many files on a process pool, writing them to the store.
+
+    submit() splits paths into chunks and blocks while too many chunks are in
+    flight, so memory stays bounded however many files are queued. Results
+    are upserted into the store as each chunk completes.
+    """
+
+    def __init__(self, store, workers=None, chunk_size=64, on_progress=None):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.in_flight = threading.BoundedSemaphore(self.workers * 4)
+        self.futures = set()
+        self.lock = threading.Lock()
+        self.progress = ExtractProgress()
+        self.error = None
+
+    def submit(self, paths):
+        paths = [str(p) for p in paths]
+        if not paths:
+            return
+        if self.executor is None:
+            # Started lazily - an unchanged library never pays for the worker processes
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        for start in range(0, len(paths), self.chunk_size):
+            chunk = paths[start:start + self.chunk_size]
+            self.in_flight.acquire()
+            with self.lock:
+                self.progress.submitted += len(chunk)
+            future = self.executor.submit(extract_chunk, chunk)
+            with self.lock:
+                self.futures.add(future)
+            future.add_done_callback(lambda f, n=len(chunk): self._collect(f, n))
+
+    def wait(self):
+        """Block until every submitted chunk has been written to the store"""
+        while True:
+            with self.lock:
+                pending = list(self.futures)
+            if not pending:
+                break
+            for future in pending:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            # Results can arrive a moment before their callback has stored them
+            time.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+
+    def close(self, cancel=False):
+        if self.executor is not None:
+            self.executor.shutdown(wait=not cancel, cancel_futures=cancel)
+            self.executor = None
+
+    def _collect(self, future, chunk_len):
+        try:
+            if not future.cancelled():
+                for path, date_taken, size, mtime in future.result():
+                    self.store.upsert(path, date_taken, size, mtime)
+                with self.lock:
+                    self.progress.done += chunk_len
+                if self.on_progress is not None:
+                    self.on_progress(self.progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.lock:
+                self.futures.discard(future)
+            self.in_flight.release()
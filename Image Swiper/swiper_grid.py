@@ -0,0 +1,114 @@
+"""Contact-sheet (grid) mode for Image Swiper.
+
+The grid shows a page of thumbnails starting at the review cursor. Only the
+page on screen and the next one are ever decoded - thumbnails go through a
+Prefetcher on a pool as wide as the machine, into their own memory-capped
+cache - so paging through 100k images holds a few pages of thumbnails at most.
+GridPage is the Tk-free bookkeeping: which tiles are on screen, where the
+keyboard cursor is and what is selected.
+"""
+import os
+from PIL import Image
+
+from swiper_loader import ImageCache, Prefetcher, load_scaled, quick_preview
+
+# Width and height of one grid cell, in pixels
+TILE_SIZE = 200
+
+# Gap around each thumbnail inside its cell
+TILE_PADDING = 6
+
+# Memory budget for decoded thumbnails (a few pages' worth)
+THUMB_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def load_thumbnail(img_path, size):
+    """A thumbnail fitting size: the cheap preview where there is one, else a reduced decode"""
+    try:
+        return quick_preview(img_path, size) or load_scaled(img_path, size)
+    except Exception:
+        # Undecodable files get a blank tile rather than holding up the page
+        return Image.new('RGB', (max(1, size[0] // 2), max(1, size[1] // 2)), '#3a2020')
+
+
+def thumbnail_prefetcher(workers=None):
+    """Prefetcher for grid thumbnails, with its own cache so it can't evict full-size images"""
+    return Prefetcher(ImageCache(THUMB_CACHE_BYTES), workers=workers or os.cpu_count(),
+                      loader=load_thumbnail)
+
+
+class GridPage:
+    """Layout, cursor and selection for one page of the grid.
+
+    Indexes are positions in the review order; the page shows
+    first .. first + columns * rows - 1.
+    """
+
+    def __init__(self, canvas_size, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.first = 0
+        self.cursor = 0
+        self.selected = set()
+        self.resize(canvas_size)
+
+    def resize(self, canvas_size):
+        width, height = canvas_size
+        self.columns = max(1, width // self.tile_size)
+        self.rows = max(1, height // self.tile_size)
+        # Centre the grid on the canvas
+        self.left = (width - self.columns * self.tile_size) // 2
+        self.top = (height - self.rows * self.tile_size) // 2
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+    @property
+    def thumb_size(self):
+        side = max(1, self.tile_size - 2 * TILE_PADDING)
+        return side, side
+
+    def visible(self, total):
+        return range(self.first, min(self.first + self.per_page, total))
+
+    def show(self, first, total):
+        """Start the page at first, keeping the cursor on it"""
+        self.first = max(0, min(first, max(total - 1, 0)))
+        if not self.first <= self.cursor < self.first + self.per_page:
+            self.cursor = self.first
+        self.cursor = min(self.cursor, max(total - 1, 0))
+
+    def move_cursor(self, delta, total):
+        """Move the cursor, scrolling a row at a time when it leaves the page"""
+        if not total:
+            return
+        self.cursor = max(0, min(self.cursor + delta, total - 1))
+        while self.cursor < self.first:
+            self.first = max(0, self.first - self.columns)
+        while self.cursor >= self.first + self.per_page:
+            self.first += self.columns
+
+    def scroll(self, rows, total):
+        self.show(self.first + rows * self.columns, total)
+
+    def toggle(self, index):
+        if index in self.selected:
+            self.selected.discard(index)
+        else:
+            self.selected.add(index)
+
+    def cell(self, index):
+        """(x0, y0, x1, y1) of the cell showing an index on this page"""
+        slot = index - self.first
+        x0 = self.left + (slot % self.columns) * self.tile_size
+        y0 = self.top + (slot // self.columns) * self.tile_size
+        return x0, y0, x0 + self.tile_size, y0 + self.tile_size
+
+    def index_at(self, x, y, total):
+        """The index under a canvas position, or None"""
+        col = (x - self.left) // self.tile_size
+        row = (y - self.top) // self.tile_size
+        if not (0 <= col < self.columns and 0 <= row < self.rows):
+            return None
+        index = self.first + row * self.columns + col
+        return index if index < total else None
@@ -0,0 +1,371 @@
+"""Image decoding and background prefetching for Image Swiper.
+
+Decoding and resizing happen on worker threads (Pillow releases the GIL while
+it decodes and resamples), so the Tk thread only has to wrap an already
+scaled image in a PhotoImage and draw it. When an image isn't ready yet,
+quick_preview() gives the Tk thread something to show within milliseconds
+while the full decode finishes in the background.
+"""
+import io
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from swiper_exif import read_exif_thumbnail, read_raw_info
+from swiper_trace import span
+
+HEIC_EXTENSIONS = {'.heic', '.heif'}
+RAW_EXTENSIONS = {'.cr2', '.nef', '.arw', '.dng', '.orf', '.raw'}
+
+# How far ahead of (and behind) the cursor to decode
+PREFETCH_AHEAD = 4
+PREFETCH_BEHIND = 1
+
+# Passed to Image.resize: shrink with reduce() until within this factor of the target
+REDUCING_GAP = 3.0
+
+# Default memory budget for decoded images held in RAM
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def open_image(img_path):
+    """Open an image, reading HEIC files through pillow_heif directly"""
+    with span('open'):
+        return _open_image(img_path)
+
+
+def _open_image(img_path):
+    if img_path.suffix.lower() in RAW_EXTENSIONS:
+        # Camera RAW: decode the JPEG preview the camera embedded, never the sensor data
+        _, preview = read_raw_info(img_path)
+        if preview is None:
+            raise ValueError("No embedded JPEG preview found in this RAW file")
+        return Image.open(io.BytesIO(preview))
+    if img_path.suffix.lower() in HEIC_EXTENSIONS:
+        try:
+            import pillow_heif
+            with span('heic_decode'):
+                heif_file = pillow_heif.read_heif(str(img_path))
+                return Image.frombytes(
+                    heif_file.mode,
+                    heif_file.size,
+                    heif_file.data,
+                    "raw",
+                )
+        except Exception as heic_error:
+            # Fallback: try opening with Pillow directly (some HEIC files work this way)
+            try:
+                return Image.open(img_path)
+            except Exception:
+                # If both methods fail, raise the original error
+                raise heic_error
+    return Image.open(img_path)
+
+
+def fitted_size(image_size, canvas_size):
+    """Size an image is displayed at: fit inside the canvas, never scaled up"""
+    img_width, img_height = image_size
+    canvas_width, canvas_height = canvas_size
+    scale = min(canvas_width / img_width, canvas_height / img_height, 1)
+    return max(1, int(img_width * scale)), max(1, int(img_height * scale))
+
+
+def displayable(img):
+    # PhotoImage can't display every Pillow mode (e.g. 16-bit greyscale, CMYK)
+    if img.mode not in ('1', 'L', 'P', 'RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    return img
+
+
+def fit_to_canvas(img, canvas_width, canvas_height):
+    """Scale an image down so it fits inside the canvas (never scales up)"""
+    target = fitted_size(img.size, (canvas_width, canvas_height))
+    if img.format == 'JPEG':
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers the target
+        img.draft('RGB', target)
+    # Decoded here rather than inside resize() so the two show up separately in traces
+    with span('decode'):
+        img.load()
+    if img.size != target:
+        # reduce() by an integer factor first, so LANCZOS only runs on a small image
+        with span('resize'):
+            img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return displayable(img)
+
+
+def load_scaled(img_path, canvas_size):
+    """Decode an image and scale it to the canvas, fully loaded in memory"""
+    img = open_image(img_path)
+    img = fit_to_canvas(img, *canvas_size)
+    img.load()
+    return img
+
+
+def _heic_thumbnail(img_path):
+    """(largest embedded thumbnail, full image size) for a HEIC file, or None"""
+    import pillow_heif
+    heif_file = pillow_heif.open_heif(str(img_path))
+    thumbnails = getattr(heif_file, 'thumbnails', None)
+    if not thumbnails:
+        return None
+    thumb = max(thumbnails, key=lambda t: t.size[0] * t.size[1])
+    img = Image.frombytes(thumb.mode, thumb.size, thumb.data, "raw", thumb.mode, thumb.stride)
+    return img, heif_file.size
+
+
+def quick_preview(img_path, canvas_size):
+    """A rough version of the image at its final display size, in a few milliseconds.
+
+    Uses the EXIF thumbnail when there is one, the HEIC thumbnail for HEIC
+    files, or otherwise a JPEG decoded at 1/8 scale. Returns None when there's
+    no cheap route, in which case the caller should just do the full decode.
+    """
+    if img_path.suffix.lower() in RAW_EXTENSIONS:
+        # The embedded preview is already a cheap JPEG decode
+        return None
+    with span('quick_preview'):
+        return _quick_preview(img_path, canvas_size)
+
+
+def _quick_preview(img_path, canvas_size):
+    try:
+        if img_path.suffix.lower() in HEIC_EXTENSIONS:
+            found = _heic_thumbnail(img_path)
+            if found is None:
+                return None
+            thumb, full_size = found
+        else:
+            with Image.open(img_path) as img:  # header only - no pixels decoded yet
+                target = fitted_size(img.size, canvas_size)
+                thumb_bytes = read_exif_thumbnail(img_path)
+                if thumb_bytes is not None:
+                    thumb = Image.open(io.BytesIO(thumb_bytes))
+                elif img.format == 'JPEG':
+                    img.draft('RGB', (max(1, target[0] // 8), max(1, target[1] // 8)))
+                    thumb = img
+                else:
+                    return None
+                return displayable(thumb.resize(target, Image.Resampling.BILINEAR))
+        target = fitted_size(full_size, canvas_size)
+        return displayable(thumb.resize(target, Image.Resampling.BILINEAR))
+    except Exception:
+        # A failed preview isn't an error - the full decode reports problems
+        return None
+
+
+def cache_key(img_path, mtime, canvas_size):
+    """Key for a decoded image - changes if the file or canvas changes"""
+    return (str(img_path), mtime, canvas_size[0], canvas_size[1])
+
+
+def image_bytes(img):
+    """Approximate memory used by a decoded image"""
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageCache:
+    """Thread-safe LRU of scaled images, capped by approximate memory use.
+
+    Each entry holds the scaled Pillow image and, once the Tk thread has
+    created one, the matching PhotoImage so a swipe only has to draw it.
+    Deleting a PhotoImage calls into Tcl, which must only happen on the Tk
+    thread, so ones evicted by the workers wait in `released` until the Tk
+    thread calls release_photos().
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.released = queue.SimpleQueue()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        """Return the scaled Pillow image for a key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def get_photo(self, key):
+        """Return the PhotoImage for a key if the Tk thread has made one"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, img):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[2]
+                self._release(old)
+            size = image_bytes(img)
+            self.entries[key] = [img, None, size]
+            self.current_bytes += size
+            self._evict()
+
+    def attach_photo(self, key, photo):
+        """Store the PhotoImage made from a cached image (Tk thread only)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] is not None:
+                return
+            # The PhotoImage keeps its own copy of the pixels
+            extra = photo.width() * photo.height() * 4
+            entry[1] = photo
+            entry[2] += extra
+            self.current_bytes += extra
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            for entry in self.entries.values():
+                self._release(entry)
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def release_photos(self):
+        """Drop the PhotoImages evicted since the last call (Tk thread only)"""
+        while True:
+            try:
+                self.released.get_nowait()
+            except queue.Empty:
+                return
+
+    def _release(self, entry):
+        if entry[1] is not None:
+            self.released.put(entry[1])
+
+    def _evict(self):
+        # Always keep the most recent entry, even if it alone is over budget
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.current_bytes -= entry[2]
+            self._release(entry)
+
+
+class Prefetcher:
+    """Decodes upcoming images on a worker pool ahead of the cursor.
+
+    request() cancels queued work that is no longer wanted; cancel() also
+    bumps a generation counter so jobs a worker has already picked up are
+    dropped before they start decoding.
+    """
+
+    def __init__(self, cache, workers=None, loader=load_scaled, stat=os.stat):
+        self.cache = cache
+        self.loader = loader
+        # Anything with st_mtime - the engine answers from its catalog instead of the disk
+        self.stat = stat
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.generation = 0
+        self.pending = {}
+        # Re-entrant: done callbacks can fire while request() holds the lock
+        self.lock = threading.RLock()
+        # Keys that finished decoding, for the Tk thread to turn into PhotoImages
+        self.ready = queue.SimpleQueue()
+
+    def request(self, paths, canvas_size):
+        """Replace any queued work with decoding of the given paths, in order"""
+        with self.lock:
+            generation = self.generation
+            wanted = {(str(p), canvas_size) for p in paths}
+            for pending_key, future in list(self.pending.items()):
+                if pending_key not in wanted:
+                    future.cancel()
+                    self.pending.pop(pending_key, None)
+            for img_path in paths:
+                pending_key = (str(img_path), canvas_size)
+                if pending_key in self.pending:
+                    continue
+                future = self.executor.submit(self._work, img_path, canvas_size, generation)
+                self.pending[pending_key] = future
+                future.add_done_callback(lambda f, k=pending_key: self._forget(k, f))
+
+    def submit(self, img_path, canvas_size):
+        """Decode one image in the background right away; returns its future.
+
+        The future's result is (cache key, image), or None if the file vanished.
+        """
+        with self.lock:
+            pending_key = (str(img_path), canvas_size)
+            future = self.pending.get(pending_key)
+            if future is not None and not future.cancelled():
+                return future
+            future = self.executor.submit(self._work, img_path, canvas_size, self.generation)
+            self.pending[pending_key] = future
+            future.add_done_callback(lambda f, k=pending_key: self._forget(k, f))
+            return future
+
+    def cancel(self):
+        """Drop all queued work, e.g. after a jump, reshuffle or resize"""
+        with self.lock:
+            self.generation += 1
+            for future in list(self.pending.values()):
+                future.cancel()
+            self.pending.clear()
+
+    def load(self, img_path, mtime, canvas_size):
+        """Return a scaled image now, reusing the cache or any in-flight decode"""
+        key = cache_key(img_path, mtime, canvas_size)
+        img = self.cache.get(key)
+        if img is not None:
+            return img
+
+        with self.lock:
+            future = self.pending.get((str(img_path), canvas_size))
+        if future is not None:
+            try:
+                result = future.result()
+                if result is not None and result[0] == key:
+                    return result[1]
+            except Exception:
+                # Fall through and decode here so the caller sees the real error
+                pass
+
+        img = self.loader(img_path, canvas_size)
+        self.cache.put(key, img)
+        return img
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forget(self, pending_key, future):
+        with self.lock:
+            if self.pending.get(pending_key) is future:
+                del self.pending[pending_key]
+
+    def _work(self, img_path, canvas_size, generation):
+        if generation != self.generation:
+            return None
+        with span('prefetch', path=str(img_path)):
+            return self._decode(img_path, canvas_size)
+
+    def _decode(self, img_path, canvas_size):
+        try:
+            with span('stat'):
+                mtime = self.stat(img_path).st_mtime
+        except OSError:
+            return None
+        key = cache_key(img_path, mtime, canvas_size)
+        if key in self.cache:
+            self.ready.put(key)
+            return key, self.cache.get(key)
+        img = self.loader(img_path, canvas_size)
+        self.cache.put(key, img)
+        self.ready.put(key)
+        return key, img
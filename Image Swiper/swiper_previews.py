@@ -0,0 +1,146 @@
+"""Persistent on-disk cache of canvas-sized previews for Image Swiper.
+
+Previews live in a `previews` folder next to OnThisDay_cache.db, named by a
+hash of (path, mtime, file size, target size) and sharded into two levels of
+sub-folders so no single folder grows huge. A changed file simply hashes to
+a new name; the stale preview ages out. The `previews` table in the metadata
+store records each file's size and when it was last used, and the least
+recently used previews are deleted once the cache exceeds its byte budget.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
+
+from swiper_loader import load_scaled
+from swiper_trace import span
+
+# Default byte budget for the previews folder
+DEFAULT_PREVIEW_BYTES = 1024 * 1024 * 1024
+
+PREVIEW_QUALITY = 85
+
+
+def preview_key(img_path, mtime, file_size, canvas_size):
+    """Content address for a preview of img_path at canvas_size"""
+    raw = f"{img_path}|{mtime!r}|{file_size}|{canvas_size[0]}x{canvas_size[1]}"
+    return hashlib.sha1(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class PreviewCache:
+    """Size-capped, LRU-evicted folder of previews, indexed in the metadata store"""
+
+    def __init__(self, store, root_dir, max_bytes=DEFAULT_PREVIEW_BYTES, stat=os.stat):
+        self.store = store
+        self.stat = stat
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # WebP is smaller and decodes quickly; fall back to JPEG if Pillow lacks it
+        if features.check('webp'):
+            self.format, self.suffix = 'WEBP', '.webp'
+        else:
+            self.format, self.suffix = 'JPEG', '.jpg'
+        # Encoding and writing previews happens off the decode path
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview-writer")
+        self.total_bytes = self.store.query('SELECT COALESCE(SUM(bytes), 0) FROM previews')[0][0]
+
+    def path_for(self, key):
+        return os.path.join(self.root_dir, key[:2], key[2:4], key + self.suffix)
+
+    def get(self, img_path, stat, canvas_size):
+        """The cached preview for a file (given its os.stat result), or None"""
+        key = preview_key(img_path, stat.st_mtime, stat.st_size, canvas_size)
+        try:
+            with span('preview_read'):
+                img = Image.open(self.path_for(key))
+                img.load()
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or otherwise unreadable - forget it and rebuild
+            self._remove(key)
+            return None
+        self.store.write('UPDATE previews SET last_used = ? WHERE cache_key = ?', (time.time(), key))
+        return img
+
+    def put(self, img_path, stat, canvas_size, img):
+        """Save a preview in the background"""
+        self.writer.submit(self._save, img_path, stat, canvas_size, img)
+
+    def load(self, img_path, canvas_size):
+        """Loader for the Prefetcher: the cached preview, or a decode that gets cached"""
+        with span('stat'):
+            stat = self.stat(img_path)
+        img = self.get(img_path, stat, canvas_size)
+        if img is not None:
+            return img
+        img = load_scaled(img_path, canvas_size)
+        self.put(img_path, stat, canvas_size, img)
+        return img
+
+    def close(self):
+        self.writer.shutdown(wait=True)
+
+    def _save(self, img_path, stat, canvas_size, img):
+        with span('preview_write'):
+            self._write(img_path, stat, canvas_size, img)
+
+    def _write(self, img_path, stat, canvas_size, img):
+        key = preview_key(img_path, stat.st_mtime, stat.st_size, canvas_size)
+        path = self.path_for(key)
+        if img.mode not in ('RGB', 'RGBA', 'L') or (self.format == 'JPEG' and img.mode == 'RGBA'):
+            img = img.convert('RGBA' if self.format == 'WEBP' and 'A' in img.getbands() else 'RGB')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary name first so a reader never sees half a file
+            tmp_path = path + '.tmp'
+            img.save(tmp_path, self.format, quality=PREVIEW_QUALITY)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"WARNING: could not save preview for {img_path}: {e}")
+            return
+        with self.lock:
+            old = self.store.query('SELECT bytes FROM previews WHERE cache_key = ?', (key,))
+            self.total_bytes += size - (old[0][0] if old else 0)
+            self.store.write(
+                'INSERT INTO previews (cache_key, filepath, bytes, last_used) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(cache_key) DO UPDATE SET bytes = excluded.bytes, last_used = excluded.last_used',
+                (key, str(img_path), size, time.time())
+            )
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used previews until comfortably under budget
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.store.query(
+                'SELECT cache_key, bytes FROM previews ORDER BY last_used LIMIT 200'
+            )
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                try:
+                    os.remove(self.path_for(key))
+                except OSError:
+                    pass
+                self.store.write('DELETE FROM previews WHERE cache_key = ?', (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= target:
+                    break
+
+    def _remove(self, key):
+        with self.lock:
+            rows = self.store.query('SELECT bytes FROM previews WHERE cache_key = ?', (key,))
+            if rows:
+                self.total_bytes -= rows[0][0]
+            self.store.write('DELETE FROM previews WHERE cache_key = ?', (key,))
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
@@ -0,0 +1,294 @@
+"""Single-pass directory scanning for Image Swiper.
+
+One os.scandir walk replaces a glob per extension. Entries in each directory
+are visited in sorted order and subdirectories are descended into in place,
+so paths come out in the same order as sorted(list_of_paths) and the UI can
+show the first image while the rest of the tree is still being walked.
+"""
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from swiper_catalog import Catalog
+from swiper_exif import DateExtractor
+from swiper_trace import span
+
+
+class ScanProgress:
+    """Counters for a running scan, readable from any thread"""
+
+    def __init__(self):
+        self.entries = 0
+        self.images = 0
+        # Files added, modified or removed (reconcile_index only)
+        self.changed = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return max(end - self.started, 1e-9)
+
+    @property
+    def rate(self):
+        """Directory entries examined per second"""
+        return self.entries / self.elapsed
+
+
+def _sort_key(entry):
+    # Match Path ordering, which is case-insensitive on Windows
+    return os.path.normcase(entry.name)
+
+
+def walk_images(folder, extensions, recursive=True, progress=None, stop_event=None):
+    """Yield image paths under folder, in sorted order, from a single walk.
+
+    extensions must be lower case (e.g. {'.jpg', '.png'}); matching is one
+    set lookup on the lower-cased suffix of each file name.
+    """
+    def walk(directory):
+        try:
+            with span('scandir'), os.scandir(directory) as it:
+                entries = sorted(it, key=_sort_key)
+        except OSError:
+            # Unreadable directory (permissions, vanished mid-scan) - skip it
+            return
+        for entry in entries:
+            if stop_event is not None and stop_event.is_set():
+                return
+            if progress is not None:
+                progress.entries += 1
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if recursive:
+                    yield from walk(entry.path)
+                continue
+            if os.path.splitext(entry.name)[1].lower() in extensions:
+                if progress is not None:
+                    progress.images += 1
+                yield Path(entry.path)
+
+    yield from walk(os.fspath(folder))
+
+
+class Scanner:
+    """Walks a folder on a background thread and hands over batches of paths.
+
+    The Tk thread polls `batches` with get_nowait(); the first image is sent
+    on its own so it can be displayed straight away. A None item marks the
+    end of the scan.
+    """
+
+    def __init__(self, folder, extensions, recursive=True, batch_size=500, batch_interval=0.25):
+        self.folder = folder
+        self.extensions = {ext.lower() for ext in extensions}
+        self.recursive = recursive
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.progress = ScanProgress()
+        self.batches = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="scanner", daemon=True)
+
+    def start(self):
+        self.progress = ScanProgress()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def done(self):
+        return self.progress.finished is not None
+
+    def _run(self):
+        with span('scan'):
+            self._walk()
+
+    def _walk(self):
+        batch = []
+        last_flush = time.perf_counter()
+        first = True
+        try:
+            for img_path in walk_images(self.folder, self.extensions, self.recursive,
+                                        self.progress, self.stop_event):
+                batch.append(img_path)
+                now = time.perf_counter()
+                if first or len(batch) >= self.batch_size or now - last_flush >= self.batch_interval:
+                    self.batches.put(batch)
+                    batch = []
+                    last_flush = now
+                    first = False
+            if batch and not self.stop_event.is_set():
+                self.batches.put(batch)
+        finally:
+            self.progress.finished = time.perf_counter()
+            self.batches.put(None)
+
+
+def reconcile_index(store, folder, extensions, extractor, progress=None, stop_event=None,
+                    relist=(), on_change=None):
+    """Bring the metadata index for folder up to date, using directory mtimes.
+
+    A directory's mtime changes whenever an entry is added, removed or
+    renamed in it, so a directory whose mtime matches the one recorded last
+    time only costs one stat: its cached rows and known subdirectories are
+    trusted as they are. Changed or new directories are listed, new or
+    modified files are handed to the extractor (see swiper_exif.DateExtractor),
+    and missing ones are dropped.
+    Files edited in place without being renamed are not noticed until their
+    directory changes for some other reason.
+
+    The whole tree under folder is always indexed, so the same index can
+    answer both recursive and top-level-only queries.
+
+    Directories in relist are listed even if their mtime hasn't moved (the
+    watcher uses this for files rewritten in place). on_change, if given,
+    is called with ('added', filepath) for new or modified files once their
+    rows are in the store, ('removed', filepath) and ('removed_dir', dirpath).
+    """
+    extensions = {ext.lower() for ext in extensions}
+    root = os.path.normpath(str(folder))
+    known_dirs = store.directories_under(root)
+    children = {}
+    for dirpath, (parent, _) in known_dirs.items():
+        children.setdefault(parent, []).append(dirpath)
+
+    added = []
+    stack = [(root, os.path.dirname(root))]
+    while stack:
+        if stop_event is not None and stop_event.is_set():
+            break
+        dirpath, parent = stack.pop()
+        try:
+            dir_mtime = os.stat(dirpath).st_mtime
+        except FileNotFoundError:
+            store.forget_directory(dirpath)
+            if progress is not None:
+                progress.changed += 1
+            if on_change is not None:
+                on_change('removed_dir', dirpath)
+            continue
+        except OSError:
+            continue
+
+        known = known_dirs.get(dirpath)
+        if known is not None and known[1] == dir_mtime and dirpath not in relist:
+            # Nothing added, removed or renamed here since last time
+            stack.extend((child, dirpath) for child in children.get(dirpath, []))
+            continue
+
+        # New or changed directory - list it and diff against the cache
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        cached = store.rows_in_directory(dirpath)
+        subdirs = []
+        to_extract = []
+        for entry in entries:
+            if progress is not None:
+                progress.entries += 1
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(os.path.normpath(entry.path))
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            filepath = os.path.normpath(entry.path)
+            row = cached.pop(filepath, None)
+            if progress is not None:
+                progress.images += 1
+            if row is None or row[2] != stat.st_mtime:
+                to_extract.append(filepath)
+        extractor.submit(to_extract)
+        if on_change is not None:
+            added.extend(to_extract)
+
+        # Whatever is left in the cache for this directory has gone
+        for filepath in cached:
+            store.delete(filepath)
+        vanished = [child for child in children.get(dirpath, []) if child not in subdirs]
+        for child in vanished:
+            store.forget_directory(child)
+        if on_change is not None:
+            for filepath in cached:
+                on_change('removed', filepath)
+            for child in vanished:
+                on_change('removed_dir', child)
+        if progress is not None:
+            progress.changed += len(to_extract) + len(cached) + len(vanished)
+
+        # Subdirectories are recorded with no mtime until they have been listed
+        # themselves, so an interrupted update carries on from them next time
+        for subdir in subdirs:
+            if subdir not in known_dirs:
+                store.set_directory(subdir, dirpath, None)
+        store.set_directory(dirpath, parent, dir_mtime)
+        stack.extend((subdir, dirpath) for subdir in subdirs)
+
+    extractor.wait()
+    if progress is not None:
+        progress.finished = time.perf_counter()
+    store.flush()
+    if on_change is not None:
+        for filepath in added:
+            on_change('added', filepath)
+
+
+class IndexUpdater:
+    """Runs reconcile_index on a background thread; poll `done` from the Tk thread.
+
+    Catalogs (see swiper_catalog.py) built from the index are put on
+    `catalogs` for the UI: with preload=True one is built straight away from
+    what was indexed last time, and another after reconciling if anything
+    changed. Without preload, one is always built after reconciling.
+    """
+
+    def __init__(self, store, folder, extensions, preload=False):
+        self.preload = preload
+        self.catalogs = queue.SimpleQueue()
+        self.progress = ScanProgress()
+        self.extractor = DateExtractor(store)
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._run, args=(store, folder, extensions),
+            name="index-updater", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def _run(self, store, folder, extensions):
+        try:
+            if self.preload:
+                self.catalogs.put(Catalog.from_store(store, folder))
+            with span('reconcile_index'):
+                reconcile_index(store, folder, extensions, self.extractor,
+                                self.progress, self.stop_event)
+            if not self.stop_event.is_set() and (self.progress.changed or not self.preload):
+                self.catalogs.put(Catalog.from_store(store, folder))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.extractor.close(cancel=self.stop_event.is_set())
+            self.progress.finished = time.perf_counter()
@@ -0,0 +1,427 @@
+"""Persistent SQLite metadata store for Image Swiper (OnThisDay_cache.db).
+
+One long-lived connection in WAL mode. Writes are buffered and flushed as a
+single transaction per batch instead of one fsync'd commit per image, and
+reads can fetch a whole directory's rows with one IN (...) query.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from swiper_catalog import path_sort_key
+
+
+def date_parts(date_taken):
+    """(year, month, day) from an ISO date string, or Nones"""
+    if not date_taken:
+        return None, None, None
+    return int(date_taken[0:4]), int(date_taken[5:7]), int(date_taken[8:10])
+
+
+def _backfill_v2(conn):
+    # Fill in the columns added in version 2 for rows cached by older versions
+    rows = conn.execute('SELECT filepath, date_taken FROM image_cache').fetchall()
+    conn.executemany(
+        'UPDATE image_cache SET dirpath = ?, taken_year = ?, taken_month = ?, taken_day = ? '
+        'WHERE filepath = ?',
+        [(os.path.dirname(filepath), *date_parts(date_taken), filepath) for filepath, date_taken in rows]
+    )
+
+
+# Bump SCHEMA_VERSION and append the steps for the new version to MIGRATIONS
+# to add columns or tables. A step is an SQL statement or a function taking
+# the connection. PRAGMA user_version records how far an existing database
+# has been migrated.
+SCHEMA_VERSION = 5
+MIGRATIONS = {
+    1: [
+        '''
+        CREATE TABLE IF NOT EXISTS image_cache (
+            filepath TEXT PRIMARY KEY,
+            date_taken TEXT,
+            file_size INTEGER,
+            last_modified REAL
+        )
+        ''',
+    ],
+    2: [
+        # Derived date columns, so On This Day is one indexed query
+        'ALTER TABLE image_cache ADD COLUMN dirpath TEXT',
+        'ALTER TABLE image_cache ADD COLUMN taken_year INTEGER',
+        'ALTER TABLE image_cache ADD COLUMN taken_month INTEGER',
+        'ALTER TABLE image_cache ADD COLUMN taken_day INTEGER',
+        _backfill_v2,
+        'CREATE INDEX IF NOT EXISTS idx_image_cache_dirpath ON image_cache (dirpath)',
+        # Covering index: the On This Day query never touches the table itself
+        '''
+        CREATE INDEX IF NOT EXISTS idx_image_cache_this_day
+        ON image_cache (taken_month, taken_day, dirpath, filepath, date_taken)
+        ''',
+        # Directory mtimes seen at the last index update, for incremental reconciliation
+        '''
+        CREATE TABLE IF NOT EXISTS directories (
+            dirpath TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime REAL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_directories_parent ON directories (parent)',
+    ],
+    3: [
+        # On-disk preview cache entries (see swiper_previews.py), evicted least recently used first
+        '''
+        CREATE TABLE IF NOT EXISTS previews (
+            cache_key TEXT PRIMARY KEY,
+            filepath TEXT,
+            bytes INTEGER,
+            last_used REAL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_previews_last_used ON previews (last_used)',
+    ],
+    4: [
+        # Perceptual hashes for duplicate finding (see swiper_dedupe.py); NULL = couldn't be decoded
+        '''
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            filepath TEXT PRIMARY KEY,
+            dirpath TEXT,
+            dhash INTEGER,
+            last_modified REAL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_image_hashes_dirpath ON image_hashes (dirpath)',
+    ],
+    5: [
+        # The last review session per folder (see ReviewEngine.save_session): settings,
+        # cursor and counters as JSON, the catalog blob, kept flags and view order
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            folder TEXT PRIMARY KEY,
+            saved_at REAL,
+            state TEXT,
+            catalog BLOB,
+            decided BLOB,
+            view_rows BLOB
+        )
+        ''',
+    ],
+}
+
+# Stay under SQLite's bound-parameter limit on older builds
+MAX_QUERY_PARAMS = 900
+
+UPSERT_SQL = '''
+    INSERT INTO image_cache (filepath, date_taken, file_size, last_modified,
+                             dirpath, taken_year, taken_month, taken_day)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(filepath) DO UPDATE SET
+        date_taken = excluded.date_taken,
+        file_size = excluded.file_size,
+        last_modified = excluded.last_modified,
+        dirpath = excluded.dirpath,
+        taken_year = excluded.taken_year,
+        taken_month = excluded.taken_month,
+        taken_day = excluded.taken_day
+'''
+DELETE_SQL = 'DELETE FROM image_cache WHERE filepath = ?'
+DELETE_HASH_SQL = 'DELETE FROM image_hashes WHERE filepath = ?'
+
+HASH_UPSERT_SQL = '''
+    INSERT INTO image_hashes (filepath, dirpath, dhash, last_modified) VALUES (?, ?, ?, ?)
+    ON CONFLICT(filepath) DO UPDATE SET
+        dhash = excluded.dhash,
+        last_modified = excluded.last_modified
+'''
+
+# SQLite integers are signed, so 64-bit hashes are stored shifted into that range
+HASH_OFFSET = 1 << 63
+
+
+class MetadataStore:
+    """Cached image metadata (date taken, size, mtime) keyed by file path.
+
+    Rows are (date_taken, file_size, last_modified) tuples, with date_taken
+    as an ISO format string or None. Writes are queued and become visible to
+    get()/get_many() immediately, but only reach disk on flush(), which
+    happens automatically every batch_size writes or flush_interval seconds.
+    """
+
+    def __init__(self, db_path, batch_size=500, flush_interval=2.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Shared by the Tk thread and background workers, guarded by self.lock
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL only syncs at checkpoints; a crash can lose the last
+        # batch of cache rows, which are simply re-extracted next time
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.migrate()
+
+    def migrate(self):
+        """Bring the schema up to SCHEMA_VERSION"""
+        with self.lock:
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                with self.conn:
+                    for step in MIGRATIONS[target]:
+                        if callable(step):
+                            step(self.conn)
+                        else:
+                            self.conn.execute(step)
+                    self.conn.execute(f'PRAGMA user_version = {target}')
+
+    def get(self, filepath):
+        """Return the cached row for one file, or None"""
+        filepath = str(filepath)
+        with self.lock:
+            if filepath in self.pending:
+                return self.pending[filepath]
+            return self.conn.execute(
+                'SELECT date_taken, file_size, last_modified FROM image_cache WHERE filepath = ?',
+                (filepath,)
+            ).fetchone()
+
+    def get_many(self, filepaths):
+        """Return {filepath: row} for every given file that has a cached row"""
+        filepaths = [str(p) for p in filepaths]
+        rows = {}
+        with self.lock:
+            for start in range(0, len(filepaths), MAX_QUERY_PARAMS):
+                chunk = filepaths[start:start + MAX_QUERY_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                for filepath, *row in self.conn.execute(
+                    f'SELECT filepath, date_taken, file_size, last_modified '
+                    f'FROM image_cache WHERE filepath IN ({placeholders})',
+                    chunk
+                ):
+                    rows[filepath] = tuple(row)
+            # Queued writes win over what's on disk
+            for filepath in filepaths:
+                if filepath in self.pending:
+                    row = self.pending[filepath]
+                    if row is None:
+                        rows.pop(filepath, None)
+                    else:
+                        rows[filepath] = row
+        return rows
+
+    def upsert(self, filepath, date_taken, file_size, last_modified):
+        """Queue an insert-or-update of one file's row"""
+        with self.lock:
+            self.pending[str(filepath)] = (date_taken, file_size, last_modified)
+            self._maybe_flush()
+
+    def delete(self, filepath):
+        """Queue removal of one file's row"""
+        with self.lock:
+            self.pending[str(filepath)] = None
+            self._maybe_flush()
+
+    def write(self, sql, params=()):
+        """Run a write statement now; it is committed with the next flush"""
+        with self.lock:
+            self.conn.execute(sql, params)
+            self._maybe_flush()
+
+    def query(self, sql, params=()):
+        """Run a read-only statement and return all rows"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def flush(self):
+        """Write all queued changes in a single transaction"""
+        with self.lock:
+            upserts = [(path, *row, os.path.dirname(path), *date_parts(row[0]))
+                       for path, row in self.pending.items() if row is not None]
+            deletes = [(path,) for path, row in self.pending.items() if row is None]
+            # Also commits any directory bookkeeping written since the last flush
+            with self.conn:
+                if upserts:
+                    self.conn.executemany(UPSERT_SQL, upserts)
+                if deletes:
+                    self.conn.executemany(DELETE_SQL, deletes)
+                    self.conn.executemany(DELETE_HASH_SQL, deletes)
+            self.pending.clear()
+            self.last_flush = time.monotonic()
+
+    def this_day(self, folder, month, day, recursive=True):
+        """(filepath, date_taken) for images under folder taken on month/day, oldest first"""
+        folder = os.path.normpath(str(folder))
+        with self.lock:
+            self.flush()
+            if recursive:
+                low, high = _prefix_range(folder)
+                rows = self.conn.execute(
+                    'SELECT filepath, date_taken FROM image_cache '
+                    'WHERE taken_month = ? AND taken_day = ? '
+                    'AND (dirpath = ? OR (dirpath >= ? AND dirpath < ?))',
+                    (month, day, folder, low, high)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    'SELECT filepath, date_taken FROM image_cache '
+                    'WHERE taken_month = ? AND taken_day = ? AND dirpath = ?',
+                    (month, day, folder)
+                ).fetchall()
+        rows.sort(key=lambda row: row[1])
+        return rows
+
+    def iter_tree(self, folder):
+        """Yield (filepath, date_taken, file_size, last_modified) for every image under folder.
+
+        Rows come in the same order as sorted() Path objects. They are read
+        through a separate connection, which WAL lets run alongside writers,
+        so a large tree can be streamed without holding up everything else.
+        """
+        folder = os.path.normpath(str(folder))
+        low, high = _prefix_range(folder)
+        self.flush()
+        conn = sqlite3.connect(str(self.db_path))
+        conn.create_function('path_sort_key', 1, path_sort_key, deterministic=True)
+        try:
+            yield from conn.execute(
+                'SELECT filepath, date_taken, file_size, last_modified FROM image_cache '
+                'WHERE dirpath = ? OR (dirpath >= ? AND dirpath < ?) '
+                'ORDER BY path_sort_key(filepath)',
+                (folder, low, high)
+            )
+        finally:
+            conn.close()
+
+    def hashes_under(self, folder):
+        """{filepath: (dhash, last_modified)} for every hashed image under folder"""
+        folder = os.path.normpath(str(folder))
+        low, high = _prefix_range(folder)
+        with self.lock:
+            return {
+                filepath: (None if dhash is None else dhash + HASH_OFFSET, mtime)
+                for filepath, dhash, mtime in self.conn.execute(
+                    'SELECT filepath, dhash, last_modified FROM image_hashes '
+                    'WHERE dirpath = ? OR (dirpath >= ? AND dirpath < ?)',
+                    (folder, low, high)
+                )
+            }
+
+    def set_hashes(self, records):
+        """Store (filepath, dhash or None, last_modified) records; committed with the next flush"""
+        with self.lock:
+            self.conn.executemany(HASH_UPSERT_SQL, [
+                (path, os.path.dirname(path), None if value is None else value - HASH_OFFSET, mtime)
+                for path, value, mtime in records
+            ])
+            self._maybe_flush()
+
+    def save_session(self, folder, state, decided, view_rows, catalog=None):
+        """Store a folder's session snapshot now; catalog=None keeps the previously saved catalog"""
+        folder = os.path.normpath(str(folder))
+        with self.lock:
+            self.flush()
+            with self.conn:
+                if catalog is None:
+                    self.conn.execute(
+                        'UPDATE sessions SET saved_at = ?, state = ?, decided = ?, view_rows = ? '
+                        'WHERE folder = ?',
+                        (time.time(), state, decided, view_rows, folder)
+                    )
+                else:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO sessions (folder, saved_at, state, catalog, decided, view_rows) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (folder, time.time(), state, catalog, decided, view_rows)
+                    )
+
+    def load_session(self, folder):
+        """(state, catalog, decided, view_rows) saved for folder, or None"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT state, catalog, decided, view_rows FROM sessions WHERE folder = ?',
+                (os.path.normpath(str(folder)),)
+            ).fetchone()
+
+    def forget_session(self, folder):
+        """Drop a folder's session snapshot, so it's loaded from the index next time"""
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM sessions WHERE folder = ?', (os.path.normpath(str(folder)),))
+
+    def is_indexed(self, folder):
+        """True once reconcile has recorded this folder at least once"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT 1 FROM directories WHERE dirpath = ?', (os.path.normpath(str(folder)),)
+            ).fetchone() is not None
+
+    def directories_under(self, folder):
+        """{dirpath: (parent, mtime)} for folder and every known subdirectory"""
+        folder = os.path.normpath(str(folder))
+        low, high = _prefix_range(folder)
+        with self.lock:
+            return {
+                dirpath: (parent, mtime) for dirpath, parent, mtime in self.conn.execute(
+                    'SELECT dirpath, parent, mtime FROM directories '
+                    'WHERE dirpath = ? OR (dirpath >= ? AND dirpath < ?)',
+                    (folder, low, high)
+                )
+            }
+
+    def rows_in_directory(self, dirpath):
+        """{filepath: row} for the files cached directly inside one directory"""
+        with self.lock:
+            self.flush()
+            return {
+                filepath: tuple(row) for filepath, *row in self.conn.execute(
+                    'SELECT filepath, date_taken, file_size, last_modified '
+                    'FROM image_cache WHERE dirpath = ?',
+                    (dirpath,)
+                )
+            }
+
+    def set_directory(self, dirpath, parent, mtime):
+        """Record a directory as indexed as of the given mtime (written on next flush)"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO directories (dirpath, parent, mtime) VALUES (?, ?, ?) '
+                'ON CONFLICT(dirpath) DO UPDATE SET parent = excluded.parent, mtime = excluded.mtime',
+                (dirpath, parent, mtime)
+            )
+
+    def forget_directory(self, dirpath):
+        """Drop a vanished directory and everything cached beneath it"""
+        low, high = _prefix_range(dirpath)
+        with self.lock:
+            self.flush()
+            with self.conn:
+                self.conn.execute(
+                    'DELETE FROM image_cache WHERE dirpath = ? OR (dirpath >= ? AND dirpath < ?)',
+                    (dirpath, low, high)
+                )
+                self.conn.execute(
+                    'DELETE FROM image_hashes WHERE dirpath = ? OR (dirpath >= ? AND dirpath < ?)',
+                    (dirpath, low, high)
+                )
+                self.conn.execute(
+                    'DELETE FROM directories WHERE dirpath = ? OR (dirpath >= ? AND dirpath < ?)',
+                    (dirpath, low, high)
+                )
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+    def _maybe_flush(self):
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+
+def _prefix_range(folder):
+    """Bounds such that low <= path < high selects paths strictly inside folder"""
+    folder = folder.rstrip(os.sep) + os.sep
+    return folder, folder[:-1] + chr(ord(os.sep) + 1)
@@ -0,0 +1,197 @@
+"""Span timing for Image Swiper's hot paths.
+
+Stages are wrapped in `with span('resize'):`. While tracing is off (the
+default) span() hands back one shared do-nothing context manager, so an
+instrumented stage costs a function call and a flag check. Once enabled,
+each finished span - name, thread, start and duration - goes into a bounded
+in-memory buffer, which the on-canvas HUD reads, and, if an export path was
+given, is written out for offline analysis: in Chrome's trace event format
+(load it in chrome://tracing or ui.perfetto.dev), or as one JSON object per
+line for a path ending in .jsonl.
+
+Set SWIPER_TRACE=trace.json (or trace.jsonl) before starting the app to
+export; press T in the app to show the HUD.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Environment variable naming the file to export spans to
+TRACE_ENV = 'SWIPER_TRACE'
+
+# Finished spans kept in memory for the HUD
+RECENT_SPANS = 4096
+
+enabled = False
+_recent = deque(maxlen=RECENT_SPANS)
+_unwritten = deque()
+_thread_names = {}
+_exporter = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        thread_id = threading.get_ident()
+        if thread_id not in _thread_names:
+            _thread_names[thread_id] = threading.current_thread().name
+        # (name, thread id, start ns, duration ns, args or None)
+        event = (self.name, thread_id, self.start, end - self.start, self.args)
+        _recent.append(event)
+        if _exporter is not None:
+            _unwritten.append(event)
+        return False
+
+
+def span(name, **args):
+    """Context manager timing one stage; args (e.g. path=...) are kept with the span"""
+    if not enabled:
+        return NULL_SPAN
+    return _Span(name, args or None)
+
+
+def now():
+    """Timestamp on the same clock as the spans"""
+    return time.perf_counter_ns()
+
+
+def enable(export_path=None):
+    """Start recording spans, also exporting them to export_path if given"""
+    global enabled, _exporter
+    if export_path and _exporter is None:
+        _exporter = TraceExporter(export_path)
+    enabled = True
+
+
+def enable_from_env():
+    """Turn on tracing with export if SWIPER_TRACE names a file; returns the path or None"""
+    path = os.environ.get(TRACE_ENV)
+    if path:
+        enable(path)
+    return path
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def breakdown(thread_id, since, until, path=None):
+    """Milliseconds per stage for one swipe.
+
+    Counts spans on thread_id (the Tk thread) that started between since
+    and until, plus spans nested inside a 'prefetch' span for path on a
+    worker thread that was still running after since - the part of the
+    background decode the swipe actually waited for.
+    """
+    events = list(_recent)
+    windows = []
+    if path is not None:
+        for name, tid, start, duration, args in events:
+            if name == 'prefetch' and args and args.get('path') == path and start + duration > since:
+                windows.append((tid, start, start + duration))
+    totals = {}
+    for name, tid, start, duration, _ in events:
+        if tid == thread_id:
+            wanted = since <= start <= until
+        else:
+            wanted = any(tid == w_tid and w_start <= start <= w_end for w_tid, w_start, w_end in windows)
+        if wanted:
+            totals[name] = totals.get(name, 0.0) + duration / 1e6
+    return totals
+
+
+def flush():
+    """Write spans finished since the last flush to the export file, if there is one"""
+    if _exporter is None:
+        return
+    events = []
+    while True:
+        try:
+            events.append(_unwritten.popleft())
+        except IndexError:
+            break
+    if events:
+        _exporter.write(events)
+
+
+def close():
+    global _exporter
+    flush()
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
+
+
+class TraceExporter:
+    """Appends spans to a Chrome trace (a JSON array of complete events) or a JSONL file.
+
+    The Chrome array is only closed by close(); chrome://tracing and
+    Perfetto both load a file cut short by a crash.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.jsonl = self.path.endswith('.jsonl')
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self.named_threads = set()
+        self.first = True
+        if not self.jsonl:
+            self.file.write('[')
+
+    def write(self, events):
+        for name, tid, start, duration, args in events:
+            if self.jsonl:
+                record = {'name': name, 'thread': _thread_names.get(tid, tid),
+                          'start_us': (start - self.origin) / 1000, 'duration_us': duration / 1000}
+                if args:
+                    record['args'] = args
+                self.file.write(json.dumps(record) + '\n')
+                continue
+            if tid not in self.named_threads:
+                # Metadata event so the viewer labels each thread by name
+                self.named_threads.add(tid)
+                self._write_event({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                   'args': {'name': _thread_names.get(tid, str(tid))}})
+            event = {'name': name, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                     'ts': (start - self.origin) / 1000, 'dur': duration / 1000}
+            if args:
+                event['args'] = args
+            self._write_event(event)
+        self.file.flush()
+
+    def close(self):
+        if not self.jsonl:
+            self.file.write('\n]\n')
+        self.file.close()
+
+    def _write_event(self, event):
+        self.file.write(('\n' if self.first else ',\n') + json.dumps(event))
+        self.first = False
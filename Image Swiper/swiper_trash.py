@@ -0,0 +1,323 @@
+"""Trash backends and the background deletion queue for Image Swiper.
+
+Deleting only enqueues a job; a worker thread moves the file to the trash and
+updates the metadata store, so the UI never waits on the filesystem. Every
+job is appended to a journal first, and jobs still unfinished when the app
+last stopped are carried out on the next start. Deletions can be undone any
+number of levels back: a job that hasn't run yet is just cancelled, one that
+has is restored from the trash along with its cached metadata row.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+
+class TrashBackend:
+    """Moves files to a trash that can give them back.
+
+    trash() returns a token (anything JSON-serialisable) that restore() needs.
+    """
+
+    def trash(self, path):
+        raise NotImplementedError
+
+    def restore(self, token):
+        raise NotImplementedError
+
+
+class WindowsRecycleBin(TrashBackend):
+    """The Windows Recycle Bin, via winshell"""
+
+    def __init__(self):
+        import winshell
+        self.winshell = winshell
+
+    def trash(self, path):
+        self.winshell.delete_file(str(path), no_confirm=True, allow_undo=True)
+        return str(path)
+
+    def restore(self, token):
+        self.winshell.undelete(token)
+        return token
+
+
+class FreedesktopTrash(TrashBackend):
+    """The freedesktop.org Trash used by Linux desktops (GNOME, KDE, XFCE, ...).
+
+    Files on the same filesystem as the home directory go to
+    $XDG_DATA_HOME/Trash; files on other mounts go to $topdir/.Trash-$uid,
+    as the specification requires, so nothing is ever copied across devices.
+    """
+
+    def __init__(self, home_trash=None):
+        if home_trash is None:
+            data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+            home_trash = os.path.join(data_home, 'Trash')
+        self.home_trash = home_trash
+
+    def trash(self, path):
+        path = os.path.abspath(str(path))
+        trash_dir, topdir = self._trash_dir_for(path)
+        files_dir = os.path.join(trash_dir, 'files')
+        info_dir = os.path.join(trash_dir, 'info')
+        os.makedirs(files_dir, mode=0o700, exist_ok=True)
+        os.makedirs(info_dir, mode=0o700, exist_ok=True)
+
+        # Paths in a $topdir trash are stored relative to the top directory
+        stored_path = os.path.relpath(path, topdir) if topdir else path
+        info = ("[Trash Info]\n"
+                f"Path={quote(stored_path)}\n"
+                f"DeletionDate={datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}\n")
+
+        # Reserve a unique name by creating its .trashinfo exclusively, then move the file
+        base, ext = os.path.splitext(os.path.basename(path))
+        counter = 1
+        name = base + ext
+        while True:
+            info_path = os.path.join(info_dir, name + '.trashinfo')
+            try:
+                fd = os.open(info_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                break
+            except FileExistsError:
+                counter += 1
+                name = f"{base}.{counter}{ext}"
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(info)
+        try:
+            os.rename(path, os.path.join(files_dir, name))
+        except OSError:
+            os.remove(info_path)
+            raise
+        return [trash_dir, name]
+
+    def restore(self, token):
+        trash_dir, name = token
+        info_path = os.path.join(trash_dir, 'info', name + '.trashinfo')
+        original = None
+        with open(info_path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('Path='):
+                    original = unquote(line[len('Path='):].strip())
+        if original is None:
+            raise ValueError(f"No original path recorded in {info_path}")
+        if not os.path.isabs(original):
+            original = os.path.join(os.path.dirname(os.path.abspath(trash_dir)), original)
+        if os.path.exists(original):
+            raise FileExistsError(f"A file already exists at {original}")
+        os.makedirs(os.path.dirname(original), exist_ok=True)
+        os.rename(os.path.join(trash_dir, 'files', name), original)
+        os.remove(info_path)
+        return original
+
+    def _trash_dir_for(self, path):
+        """(trash directory, topdir or None) for a file, per the spec"""
+        device = os.stat(path).st_dev
+        home_parent = self.home_trash
+        while not os.path.exists(home_parent):
+            home_parent = os.path.dirname(home_parent)
+        if os.stat(home_parent).st_dev == device:
+            return self.home_trash, None
+        # Find the top of the mount holding the file
+        topdir = os.path.dirname(path)
+        while True:
+            parent = os.path.dirname(topdir)
+            if parent == topdir or os.stat(parent).st_dev != device:
+                break
+            topdir = parent
+        return os.path.join(topdir, f'.Trash-{os.getuid()}'), topdir
+
+
+def default_backend():
+    """The platform's trash: Recycle Bin on Windows, freedesktop.org Trash elsewhere"""
+    if os.name == 'nt':
+        return WindowsRecycleBin()
+    return FreedesktopTrash()
+
+
+class Deletion:
+    """One queued delete and what's needed to undo it"""
+
+    def __init__(self, path, cache_row, resumed=False):
+        self.path = path
+        self.cache_row = cache_row
+        # Left over from the last run, rather than asked for in this one (so nobody's waiting on it)
+        self.resumed = resumed
+        # queued -> trashed | gone | failed | cancelled
+        self.state = 'queued'
+        self.token = None
+        self.size_mb = 0
+
+
+class DeletionQueue:
+    """Background deletion worker with a journal and an unbounded undo stack.
+
+    The Tk thread calls delete() and undo() and polls `results` for
+    ('deleted' | 'delete_failed' | 'restored' | 'restore_failed', Deletion, error).
+    """
+
+    def __init__(self, store, journal_path, backend=None):
+        self.store = store
+        self.journal_path = journal_path
+        self.backend = backend or default_backend()
+        self.jobs = queue.Queue()
+        self.results = queue.SimpleQueue()
+        self.undo_stack = []
+        self.deleted_paths = set()
+        self.lock = threading.Lock()
+        self.journal_lock = threading.Lock()
+
+        leftover = self._read_unfinished()
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.thread = threading.Thread(target=self._run, name="deletion-worker", daemon=True)
+        self.thread.start()
+        # Finish deletes that were still queued when the app last stopped
+        for path in leftover:
+            self._enqueue(Deletion(path, None, resumed=True))
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def is_deleted(self, img_path):
+        """True if a delete for this file is queued or done (and not undone)"""
+        return str(img_path) in self.deleted_paths
+
+    def delete(self, img_path):
+        """Queue a file for the trash; returns immediately"""
+        deletion = Deletion(str(img_path), self.store.get(img_path))
+        self._enqueue(deletion)
+        with self.lock:
+            self.undo_stack.append(deletion)
+        return deletion
+
+    def undo(self):
+        """Undo the most recent delete; returns its Deletion, or None if there's nothing to undo"""
+        with self.lock:
+            if not self.undo_stack:
+                return None
+            deletion = self.undo_stack.pop()
+            self.deleted_paths.discard(deletion.path)
+            if deletion.state == 'queued':
+                # The worker hasn't got to it yet - nothing to restore
+                deletion.state = 'cancelled'
+                self._journal('cancelled', deletion.path)
+                self.results.put(('restored', deletion, None))
+                return deletion
+        self.jobs.put(('restore', deletion))
+        return deletion
+
+    def close(self):
+        """Wait for every queued job to finish, then stop the worker"""
+        self.jobs.put(None)
+        self.thread.join()
+        with self.journal_lock:
+            self.journal.close()
+            # Everything is done, so the journal can start afresh next time
+            open(self.journal_path, 'w').close()
+
+    def _enqueue(self, deletion):
+        if not deletion.resumed:
+            self._journal('delete', deletion.path)
+        self.deleted_paths.add(deletion.path)
+        self.jobs.put(('delete', deletion))
+
+    def _journal(self, op, path, sync=False):
+        with self.journal_lock:
+            self.journal.write(json.dumps({'op': op, 'path': path, 'time': time.time()}) + '\n')
+            self.journal.flush()
+            if sync:
+                os.fsync(self.journal.fileno())
+
+    def _read_unfinished(self):
+        """Paths journaled as 'delete' without a matching completion"""
+        unfinished = {}
+        try:
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash
+                        continue
+                    if entry['op'] == 'delete':
+                        unfinished[entry['path']] = True
+                    else:
+                        unfinished.pop(entry['path'], None)
+        except FileNotFoundError:
+            pass
+        return list(unfinished)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            op, deletion = job
+            if op == 'delete':
+                self._do_delete(deletion)
+            else:
+                self._do_restore(deletion)
+
+    def _do_delete(self, deletion):
+        with self.lock:
+            if deletion.state != 'queued':
+                return
+            deletion.state = 'trashing'
+        # The keypress only flushed the journal entry; make it durable before acting on it
+        with self.journal_lock:
+            os.fsync(self.journal.fileno())
+        try:
+            deletion.size_mb = os.stat(deletion.path).st_size / (1024 * 1024)
+            deletion.token = self.backend.trash(deletion.path)
+        except FileNotFoundError:
+            self._journal('done', deletion.path)
+            if deletion.resumed:
+                # A job that had in fact completed before the app stopped
+                deletion.state = 'failed'
+                self.deleted_paths.discard(deletion.path)
+                return
+            # Removed outside the app before it got to the trash: deleted all the same,
+            # but there's nothing to bring back on undo
+            deletion.state = 'gone'
+            self.store.delete(deletion.path)
+            self.results.put(('deleted', deletion, None))
+            return
+        except Exception as e:
+            deletion.state = 'failed'
+            self.deleted_paths.discard(deletion.path)
+            self._journal('failed', deletion.path)
+            self.results.put(('delete_failed', deletion, e))
+            return
+        deletion.state = 'trashed'
+        self.store.delete(deletion.path)
+        self._journal('done', deletion.path)
+        self.results.put(('deleted', deletion, None))
+
+    def _do_restore(self, deletion):
+        if deletion.state == 'gone':
+            self.deleted_paths.add(deletion.path)
+            self.results.put(('restore_failed', deletion,
+                              FileNotFoundError(f"{deletion.path} was already gone before it reached the trash")))
+            return
+        if deletion.state != 'trashed':
+            # The delete failed, so there's nothing in the trash to bring back
+            self.results.put(('restored', deletion, None))
+            return
+        try:
+            self.backend.restore(deletion.token)
+        except Exception as e:
+            # Still in the trash, so it can be undone again
+            with self.lock:
+                deletion.state = 'trashed'
+                self.deleted_paths.add(deletion.path)
+                self.undo_stack.append(deletion)
+            self.results.put(('restore_failed', deletion, e))
+            return
+        deletion.state = 'restored'
+        if deletion.cache_row is not None:
+            self.store.upsert(deletion.path, *deletion.cache_row)
+        self.results.put(('restored', deletion, None))
@@ -0,0 +1,233 @@
+"""Live folder watching for Image Swiper.
+
+While a folder is open, a FolderWatcher keeps its metadata index in step with
+the filesystem, so photos copied in mid-session (a camera card being synced,
+say) turn up without a rescan, and ones deleted or moved away by something
+else drop out. On Linux it listens to inotify (through ctypes - nothing to
+install); elsewhere, or if inotify can't be used (e.g. the watch limit in
+/proc/sys/fs/inotify/max_user_watches is reached), it polls directory mtimes
+every few seconds instead.
+
+Either way, the directories that changed are handed to reconcile_index,
+which updates the image_cache rows, and the resulting changes are put on
+`changes` as lists of (kind, path) with kind 'added', 'removed' or
+'removed_dir'. The Tk thread drains them with ReviewEngine.poll_watcher().
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+from swiper_exif import DateExtractor
+from swiper_scanner import reconcile_index
+from swiper_trace import span
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Files are only looked at once they've been written and closed (or moved in whole)
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+
+# Seconds between passes when polling
+POLL_INTERVAL = 5.0
+
+# Changed directories are synced once events have stopped for SETTLE seconds,
+# or after MAX_DELAY while a long copy keeps them coming
+SETTLE = 0.5
+MAX_DELAY = 2.0
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class FolderWatcher:
+    """Watches a folder tree on a background thread and reports what changed.
+
+    `backend` says which of 'inotify' or 'polling' is in use once started.
+    Nothing is reported for the tree as it was when the watcher started -
+    that's what the index update is for.
+    """
+
+    def __init__(self, store, folder, extensions, poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.folder = os.path.normpath(str(folder))
+        self.extensions = {ext.lower() for ext in extensions}
+        self.poll_interval = poll_interval
+        self.backend = None
+        self.changes = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        try:
+            if _libc is not None:
+                try:
+                    self._watch_inotify()
+                    return
+                except OSError as e:
+                    print(f"WARNING: inotify not available ({e}), checking for changes every "
+                          f"{self.poll_interval:g}s instead")
+            self._watch_polling()
+        except Exception as e:
+            self.error = e
+
+    def sync(self, dirpaths, relist=()):
+        """Reconcile the index under each directory and report the changes"""
+        found = []
+        extractor = DateExtractor(self.store)
+        try:
+            with span('watch_sync', dirs=len(dirpaths)):
+                for dirpath in dirpaths:
+                    if self.stop_event.is_set():
+                        break
+                    reconcile_index(self.store, dirpath, self.extensions, extractor,
+                                    stop_event=self.stop_event, relist=relist,
+                                    on_change=lambda kind, path: found.append((kind, path)))
+        finally:
+            extractor.close(cancel=self.stop_event.is_set())
+        if found and not self.stop_event.is_set():
+            self.changes.put(found)
+
+    # Polling
+
+    def _watch_polling(self):
+        self.backend = 'polling'
+        # Known directories whose mtime hasn't moved cost one stat each
+        while not self.stop_event.wait(self.poll_interval):
+            self.sync([self.folder])
+
+    # inotify
+
+    def _watch_inotify(self):
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        try:
+            self.watches = {}
+            self._add_tree(fd, self.folder)
+            self.backend = 'inotify'
+            # Catch anything that changed between the index update and the watches going in
+            self.sync([self.folder])
+            dirty = set()
+            first_dirty = last_event = 0.0
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], SETTLE / 2)
+                now = time.monotonic()
+                if readable:
+                    changed = self._read_events(fd)
+                    if changed:
+                        if not dirty:
+                            first_dirty = now
+                        dirty |= changed
+                        last_event = now
+                if dirty and (now - last_event >= SETTLE or now - first_dirty >= MAX_DELAY):
+                    # A changed directory's subtree is covered by syncing the directory
+                    tops = [d for d in dirty if not any(_is_inside(d, other) for other in dirty)]
+                    self.sync(tops, relist=dirty)
+                    dirty = set()
+        finally:
+            os.close(fd)
+
+    def _add_tree(self, fd, top):
+        """Watch a directory and every directory beneath it"""
+        stack = [top]
+        while stack:
+            dirpath = stack.pop()
+            wd = _libc.inotify_add_watch(fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    continue
+                raise OSError(err, f"{os.strerror(err)}: {dirpath}")
+            self.watches[wd] = dirpath
+            try:
+                with os.scandir(dirpath) as it:
+                    stack.extend(os.path.normpath(entry.path) for entry in it
+                                 if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def _read_events(self, fd):
+        """Drain pending events; returns the directories they touched"""
+        dirty = set()
+        while True:
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                return dirty
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost - check the whole tree
+                    dirty.add(self.folder)
+                    continue
+                dirpath = self.watches.get(wd)
+                if dirpath is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # Its parent notices it has gone (the folder itself is forgotten by syncing it)
+                    if mask & IN_MOVE_SELF:
+                        _libc.inotify_rm_watch(fd, wd)
+                    dirty.add(self.folder if dirpath == self.folder else os.path.dirname(dirpath))
+                    continue
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._add_tree(fd, os.path.join(dirpath, name))
+                    dirty.add(dirpath)
+                elif mask & IN_CREATE:
+                    # Still being written - IN_CLOSE_WRITE follows
+                    continue
+                elif os.path.splitext(name)[1].lower() in self.extensions:
+                    dirty.add(dirpath)
+
+
+def _is_inside(path, folder):
+    return path != folder and path.startswith(folder.rstrip(os.sep) + os.sep)
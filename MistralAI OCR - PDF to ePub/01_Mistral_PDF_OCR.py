@@ -1,5 +1,9 @@
+import asyncio
 import os
-from mistralai import Mistral
+
+from mistral_ocr import HTTPTransport, ocr_pdf
+from ocr_cache import OCRCache
+from ocr_sink import IMAGES_FOLDER, MarkdownSink
 
 # Add your API key here
 API_KEY = "ENTER-API-KEY-HERE"
@@ -7,49 +11,58 @@ API_KEY = "ENTER-API-KEY-HERE"
 if not API_KEY:
     raise ValueError("Please add your Mistral API key to the 'API_KEY' variable.")
 
-# Initialize the Mistral client
-client = Mistral(api_key=API_KEY)
-
 # Define the path to your local PDF
 file_path = r"\path\to\file.pdf"
 output_file = "ocr_output.md"
 
-try:
-    # Step 1: Upload the PDF to Mistral
+# The PDF is OCR'd this many pages per request, with up to CONCURRENCY requests at once
+# and at most REQUESTS_PER_SECOND starting each second (the free tier allows 1)
+PAGES_PER_CHUNK = 20
+CONCURRENCY = 4
+REQUESTS_PER_SECOND = 1
+
+# Save the images on each page to an "images" folder next to the markdown (the ePub step includes them)
+EXTRACT_IMAGES = True
+
+# Print each page to the console as it's written (slow for big books)
+ECHO_PAGES = False
+
+# OCR'd pages are kept here, so running the same PDF again (or finishing an interrupted run)
+# doesn't OCR anything twice. Set to None to always OCR from scratch.
+CACHE_FILE = "ocr_cache.sqlite"
+
+# Set this to "http://127.0.0.1:8000" to try things out against ocr_stub_server.py
+BASE_URL = "https://api.mistral.ai"
+
+
+async def main():
+    # Step 1: Read the PDF
     with open(file_path, "rb") as pdf_file:
-        uploaded_pdf = client.files.upload(
-            file={
-                "file_name": os.path.basename(file_path),
-                "content": pdf_file,
-            },
-            purpose="ocr"
-        )
-
-    # Step 2: Retrieve the signed URL for the uploaded file
-    signed_url = client.files.get_signed_url(file_id=uploaded_pdf.id)
-
-    # Step 3: Process OCR on the PDF using the signed URL
-    ocr_response = client.ocr.process(
-        model="mistral-ocr-latest",
-        document={
-            "type": "document_url",
-            "document_url": signed_url.url
-        }
-    )
-
-    # Debug print to see the structure of ocr_response (if needed)
-    # print("OCR Response:", ocr_response)
-
-    # Step 4: Save the OCR results to a markdown file
-    with open(output_file, "w", encoding="utf-8") as md_file:
-        for page in ocr_response.pages:  # Loop through the OCR pages
-            # Extract the markdown content from each page
-            page_content = f"## Page {page.index + 1}\n\n{page.markdown}\n\n"
-            md_file.write(page_content)
-            print(page_content)  # Optionally print to the console as well
+        data = pdf_file.read()
+
+    # Step 2: Upload it and OCR it a range of pages at a time (failed ranges are retried),
+    # skipping any pages already in the cache. Each range is added to the markdown file
+    # as soon as it (and the ones before it) are done.
+    transport = HTTPTransport(API_KEY, BASE_URL)
+    cache = OCRCache(CACHE_FILE) if CACHE_FILE else None
+    images_dir = os.path.join(os.path.dirname(os.path.abspath(output_file)), IMAGES_FOLDER) if EXTRACT_IMAGES else None
+    try:
+        with MarkdownSink(output_file, images_dir, echo=ECHO_PAGES) as sink:
+            await ocr_pdf(data, os.path.basename(file_path), transport,
+                          pages_per_chunk=PAGES_PER_CHUNK, concurrency=CONCURRENCY,
+                          rate=REQUESTS_PER_SECOND, include_images=EXTRACT_IMAGES, cache=cache, sink=sink)
+    finally:
+        transport.close()
+        if cache:
+            cache.close()
 
     print(f"OCR results saved to '{output_file}'")
+    if EXTRACT_IMAGES:
+        print(f"{sink.images_saved} images saved to '{images_dir}' ({sink.images_reused} repeats skipped)")
+
 
+try:
+    asyncio.run(main())
 except FileNotFoundError:
     print(f"Error: File not found at '{file_path}'. Please check the path.")
 except Exception as e:
@@ -1,19 +1,15 @@
-import pypandoc
-
-# Download Pandoc if it's not installed
-try:
-    pypandoc.download_pandoc()
-    print("Pandoc successfully downloaded!")
-except Exception as e:
-    print(f"Error downloading Pandoc: {e}")
+from epub_writer import markdown_to_epub
 
 # Path to your markdown file
 input_file = 'ocr_output.md'
 output_file = 'output.epub'
 
-# Convert markdown to EPUB
+# Shown as the book's title by e-readers (None uses the markdown file's name)
+title = None
+
+# Convert markdown to EPUB (no Pandoc needed - images in the markdown's "images" folder are included)
 try:
-    pypandoc.convert_file(input_file, 'epub', outputfile=output_file)
-    print(f"EPUB file saved as '{output_file}'")
+    chapters = markdown_to_epub(input_file, output_file, title)
+    print(f"EPUB file saved as '{output_file}' ({chapters} chapters)")
 except Exception as e:
     print(f"Error during conversion: {e}")
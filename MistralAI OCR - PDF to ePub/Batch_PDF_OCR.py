@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from mistral_ocr import (API_URL, CONCURRENCY, MODEL, PAGES_PER_CHUNK, REQUESTS_PER_SECOND,
+                         HTTPTransport, RateLimiter, ocr_pdf)
+from ocr_cache import OCRCache
+from ocr_jobs import DONE, FAILED, PENDING, RUNNING, JobQueue
+from ocr_sink import IMAGES_FOLDER, MarkdownSink
+
+# Most megabytes of PDFs held in memory at once (a PDF bigger than this still runs, on its own)
+MEMORY_LIMIT_MB = 1024
+
+QUEUE_NAME = ".ocr_jobs.sqlite"
+
+
+def find_pdfs(folder):
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(".pdf"):
+                yield os.path.join(dirpath, filename)
+
+
+def output_path(pdf_path, input_dir, output_dir):
+    # Next to the PDF, or at the same place in output_dir's copy of the folder tree
+    base = os.path.splitext(pdf_path)[0] + ".md"
+    if output_dir is None:
+        return base
+    return os.path.join(output_dir, os.path.relpath(base, input_dir))
+
+
+def enqueue(queue, input_dir, output_dir):
+    queued = skipped = 0
+    for path in find_pdfs(input_dir):
+        stat = os.stat(path)
+        if queue.add(os.path.abspath(path), os.path.abspath(output_path(path, input_dir, output_dir)),
+                     stat.st_size, stat.st_mtime):
+            queued += 1
+        else:
+            skipped += 1
+    return queued, skipped
+
+
+async def run_batch(queue, transport, cache, documents=CONCURRENCY, concurrency=CONCURRENCY,
+                    rate=REQUESTS_PER_SECOND, memory_limit=MEMORY_LIMIT_MB * 1024 * 1024,
+                    pages_per_chunk=PAGES_PER_CHUNK, model=MODEL, images=True):
+    # Up to `documents` PDFs are worked on at once, biggest first so one huge book doesn't
+    # end up running alone at the end, and only as many as fit in memory_limit. Their
+    # requests all share the same `concurrency` slots and rate limit. Images go in an
+    # "images" folder beside each markdown file, shared by the documents in that folder.
+    limiter = RateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    memory_freed = asyncio.Event()
+    in_memory = 0
+
+    async def process(path, output, size):
+        started = time.perf_counter()
+        with open(path, "rb") as pdf_file:
+            data = pdf_file.read()
+        images_dir = os.path.join(os.path.dirname(output), IMAGES_FOLDER) if images else None
+        with MarkdownSink(output, images_dir) as sink:
+            await ocr_pdf(data, os.path.basename(path), transport, model, pages_per_chunk, include_images=images,
+                          cache=cache, sink=sink, limiter=limiter, semaphore=semaphore)
+        del data
+        pages = sink.pages_written
+        queue.finish(path, pages, size)
+        elapsed = time.perf_counter() - started
+        print(f"Done: {path} ({pages} pages in {elapsed:.1f}s) -> {output}")
+
+    async def worker():
+        nonlocal in_memory
+        while True:
+            job = queue.claim(None if in_memory == 0 else memory_limit - in_memory)
+            if job is None:
+                if queue.smallest_pending() is None:
+                    return
+                # Everything left is too big for now
+                memory_freed.clear()
+                await memory_freed.wait()
+                continue
+            path, output, size = job
+            in_memory += size
+            try:
+                await process(path, output, size)
+            except Exception as e:
+                queue.fail(path, e)
+                print(f"Failed: {path} ({e})")
+            finally:
+                in_memory -= size
+                memory_freed.set()
+
+    await asyncio.gather(*(worker() for _ in range(documents)))
+
+
+def format_run(started_at, finished_at, documents, failed, pages, size):
+    elapsed = max((finished_at or started_at) - started_at, 1e-9)
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(started_at))
+    return (f"{when}: {documents:,} documents, {pages:,} pages, {failed:,} failed in {elapsed / 60:.1f} min "
+            f"({pages / elapsed * 60:,.0f} pages/min, {size / elapsed / 1024 / 1024:.2f} MB/s)"
+            f"{'' if finished_at else ' (nothing finished)'}")
+
+
+def print_status(queue):
+    counts = queue.counts()
+    print(", ".join(f"{counts[state]:,} {state}" for state in (PENDING, RUNNING, DONE, FAILED)))
+    for path, error in queue.failures()[:20]:
+        print(f"  failed: {path}: {error}")
+    runs = queue.runs()
+    if runs:
+        print("Recent runs:")
+        for run in runs:
+            print("  " + format_run(*run))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR every PDF in a folder (and its subfolders) to markdown")
+    parser.add_argument("folder", help="Folder of PDFs")
+    parser.add_argument("--output", help="Folder for the markdown files (default: next to each PDF)")
+    parser.add_argument("--api-key", default=os.environ.get("MISTRAL_API_KEY"),
+                        help="Mistral API key (default: the MISTRAL_API_KEY environment variable)")
+    parser.add_argument("--documents", type=int, default=CONCURRENCY, help="PDFs worked on at once")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="OCR requests in flight at once")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Most requests started per second")
+    parser.add_argument("--pages-per-chunk", type=int, default=PAGES_PER_CHUNK, help="Pages per OCR request")
+    parser.add_argument("--memory", type=int, default=MEMORY_LIMIT_MB, help="Most MB of PDFs held in memory")
+    parser.add_argument("--no-images", action="store_true", help="Don't save the images on each page")
+    parser.add_argument("--cache", default="ocr_cache.sqlite", help="OCR cache file (shared with 01_Mistral_PDF_OCR.py)")
+    parser.add_argument("--base-url", default=API_URL, help="API address (e.g. http://127.0.0.1:8000 for the stub)")
+    parser.add_argument("--retry-failed", action="store_true", help="Try the PDFs that failed last time again")
+    parser.add_argument("--status", action="store_true", help="Show the state of the queue and stop")
+    args = parser.parse_args()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    queue = JobQueue(os.path.join(args.output or args.folder, QUEUE_NAME))
+    if args.status:
+        print_status(queue)
+        sys.exit()
+    if not args.api_key:
+        sys.exit("Please give your Mistral API key with --api-key or the MISTRAL_API_KEY environment variable.")
+
+    if not queue.lock():
+        sys.exit("Another batch is already working through this folder.")
+    recovered = queue.recover()
+    if recovered:
+        print(f"Picking up {recovered} PDFs the last run didn't finish")
+    if args.retry_failed:
+        print(f"Retrying {queue.retry_failed()} failed PDFs")
+    queued, skipped = enqueue(queue, args.folder, args.output)
+    print(f"Queued {queued} new or changed PDFs ({skipped} already done or queued)")
+    if not queue.counts()[PENDING]:
+        print("Nothing to do")
+        sys.exit()
+
+    transport = HTTPTransport(args.api_key, args.base_url)
+    cache = OCRCache(args.cache) if args.cache else None
+    queue.start_run()
+    try:
+        asyncio.run(run_batch(queue, transport, cache, args.documents, args.concurrency, args.rate,
+                              args.memory * 1024 * 1024, args.pages_per_chunk, images=not args.no_images))
+    except KeyboardInterrupt:
+        print("Stopped - run the same command again to carry on from here")
+    finally:
+        queue.end_run()
+        transport.close()
+        if cache:
+            cache.close()
+    print_status(queue)
+    queue.close()
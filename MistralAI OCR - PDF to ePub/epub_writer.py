@@ -0,0 +1,432 @@
+"""Markdown to EPUB 3 with nothing but the standard library.
+
+The markdown is read twice, a line at a time: once to choose where chapters
+break and to fingerprint the book, then again to convert each chapter to
+XHTML, which is written straight into its entry in the zip. Chapters break
+at the book's own headings when it has them, at the highest level it uses
+more than once (so a lone "# Title" above "## Chapter" headings doesn't
+swallow the book); a heading that repeats on page after page (a running
+header the OCR picked up) doesn't count. Otherwise each "## Page N" section
+is a chapter. The table of
+contents lists the chapters, both as an EPUB 3 nav document and as an NCX
+for older readers. Images the markdown links to are packed in once each.
+"""
+import hashlib
+import html
+import io
+import os
+import re
+import time
+import uuid
+import zipfile
+from collections import Counter
+
+# A heading seen on at least this many pages is a running header, not a chapter
+RUNNING_HEADING = 3
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+PAGE_HEADING = re.compile(r"^## Page (\d+)\s*$")
+LIST_ITEM = re.compile(r"^\s*(?:([-*+])|(\d+)[.)])\s+(.*)$")
+TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+HORIZONTAL_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+# Control characters aren't allowed in XML at all (OCR output sometimes has form feeds)
+CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+CODE_SPAN = re.compile(r"`([^`]+)`")
+# Matched after escaping, so an optional "title" shows up as &quot;title&quot;
+IMAGE = re.compile(r"!\[([^\]]*)\]\(([^)\s]+)(?:\s+&quot;.*?&quot;)?\)")
+LINK = re.compile(r"\[([^\]]+)\]\(([^)\s]+)(?:\s+&quot;.*?&quot;)?\)")
+BOLD = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+ITALIC = re.compile(r"(?<![\w*])([*_])(?=\S)(.+?)(?<=\S)\1(?![\w*])")
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".gif": "image/gif", ".svg": "image/svg+xml", ".webp": "image/webp",
+}
+
+STYLESHEET = """body { font-family: serif; line-height: 1.4; margin: 0 5%; }
+h1, h2, h3, h4, h5, h6 { font-family: sans-serif; line-height: 1.2; }
+h2.page { font-size: 0.8em; color: #888; border-top: 1px solid #ccc; padding-top: 0.5em; }
+img { max-width: 100%; }
+table { border-collapse: collapse; margin: 1em 0; }
+td, th { border: 1px solid #999; padding: 0.2em 0.5em; }
+pre { white-space: pre-wrap; font-size: 0.85em; }
+blockquote { margin-left: 1.5em; font-style: italic; }
+"""
+
+CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+XHTML_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{lang}" xml:lang="{lang}">
+<head>
+<meta charset="UTF-8"/>
+<title>{title}</title>
+<link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+"""
+
+XHTML_TAIL = "</body>\n</html>\n"
+
+
+def escape(text):
+    return html.escape(text, quote=True)
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as md_file:
+        for line in md_file:
+            yield CONTROL.sub("", line.rstrip("\n").rstrip("\r"))
+
+
+def plan_chapters(path):
+    """First pass: which heading lines start chapters, and a fingerprint of the book.
+
+    Returns (level, running, digest): chapters start at headings of `level`
+    whose text isn't in `running`, or at every "## Page N" if level is None.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    headings = Counter()
+    for line in read_lines(path):
+        digest.update(line.encode("utf-8") + b"\n")
+        match = HEADING.match(line)
+        if match and not PAGE_HEADING.match(line):
+            headings[len(match.group(1)), match.group(2)] += 1
+    running = {text for (_, text), count in headings.items() if count >= RUNNING_HEADING}
+    levels = Counter()
+    for (level, text), count in headings.items():
+        if text not in running:
+            levels[level] += count
+    # A heading level used only once is the book's title, not its one and only chapter
+    repeated = [level for level, count in levels.items() if count > 1]
+    return min(repeated or levels, default=None), running, digest.hexdigest()
+
+
+def inline(text, image_href):
+    """Inline markdown (code, images, links, bold, italic) in one line of text to XHTML"""
+    # Code spans and generated tags are kept out of the way behind placeholders, so the
+    # bold and italic passes can't touch their text or attributes (e.g. "_" in a URL)
+    kept = []
+
+    def keep(markup):
+        kept.append(markup)
+        return f"\0{len(kept) - 1}\0"
+
+    def image(match):
+        href = image_href(html.unescape(match.group(2)))
+        if href is None:
+            return f"[{match.group(1)}]"
+        return keep(f'<img src="{escape(href)}" alt="{match.group(1)}"/>')
+
+    text = escape(CODE_SPAN.sub(lambda m: keep(f"<code>{escape(m.group(1))}</code>"), text))
+    text = IMAGE.sub(image, text)
+    text = LINK.sub(lambda m: keep(f'<a href="{m.group(2)}">') + m.group(1) + keep("</a>"), text)
+    text = BOLD.sub(r"<strong>\2</strong>", text)
+    text = ITALIC.sub(r"<em>\2</em>", text)
+    return re.sub(r"\0(\d+)\0", lambda m: kept[int(m.group(1))], text)
+
+
+class BlockConverter:
+    """Turns markdown lines into XHTML a block at a time; feed() returns whatever's finished"""
+
+    def __init__(self, image_href):
+        self.image_href = image_href
+        self.paragraph = []
+        self.list_tag = None
+        self.table = None
+        self.fence = None
+        self.quote = []
+        self.heading_ids = 0
+
+    def feed(self, line):
+        out = []
+        if self.fence is not None:
+            if line.strip().startswith("```"):
+                out.append(f"<pre><code>{escape(chr(10).join(self.fence))}</code></pre>\n")
+                self.fence = None
+            else:
+                self.fence.append(line)
+            return out
+        stripped = line.strip()
+
+        if self.table is not None:
+            if "|" in stripped:
+                if not TABLE_RULE.match(stripped):
+                    self.table.append(split_row(stripped))
+                return out
+            out += self.close_table()
+
+        if not stripped:
+            return out + self.close()
+        if stripped.startswith("```"):
+            out += self.close()
+            self.fence = []
+            return out
+        if stripped.startswith(">"):
+            out += self.close(keep_quote=True)
+            self.quote.append(stripped.lstrip(">").strip())
+            return out
+        out += self.close_quote()
+
+        heading = HEADING.match(stripped)
+        if heading:
+            out += self.close()
+            level = len(heading.group(1))
+            self.heading_ids += 1
+            css = ' class="page"' if PAGE_HEADING.match(stripped) else ""
+            out.append(f'<h{level} id="h{self.heading_ids}"{css}>{self.inline(heading.group(2))}</h{level}>\n')
+            return out
+        if HORIZONTAL_RULE.match(stripped):
+            out += self.close()
+            out.append("<hr/>\n")
+            return out
+        if stripped.startswith("|") and stripped.endswith("|"):
+            out += self.close()
+            self.table = [split_row(stripped)]
+            return out
+        item = LIST_ITEM.match(line)
+        if item:
+            tag = "ul" if item.group(1) else "ol"
+            out += self.close_paragraph()
+            if self.list_tag != tag:
+                out += self.close_list()
+                out.append(f"<{tag}>\n")
+                self.list_tag = tag
+            out.append(f"<li>{self.inline(item.group(3))}</li>\n")
+            return out
+        if self.list_tag:
+            out += self.close_list()
+        self.paragraph.append(stripped)
+        return out
+
+    def inline(self, text):
+        return inline(text, self.image_href)
+
+    def close(self, keep_quote=False):
+        out = self.close_paragraph() + self.close_list() + self.close_table()
+        if self.fence is not None:
+            out.append(f"<pre><code>{escape(chr(10).join(self.fence))}</code></pre>\n")
+            self.fence = None
+        if not keep_quote:
+            out += self.close_quote()
+        return out
+
+    def close_paragraph(self):
+        if not self.paragraph:
+            return []
+        text = "<br/>\n".join(self.inline(line) for line in self.paragraph)
+        self.paragraph = []
+        return [f"<p>{text}</p>\n"]
+
+    def close_list(self):
+        if not self.list_tag:
+            return []
+        tag, self.list_tag = self.list_tag, None
+        return [f"</{tag}>\n"]
+
+    def close_quote(self):
+        if not self.quote:
+            return []
+        text = "<br/>\n".join(self.inline(line) for line in self.quote if line)
+        self.quote = []
+        return [f"<blockquote><p>{text}</p></blockquote>\n"]
+
+    def close_table(self):
+        if self.table is None:
+            return []
+        rows, self.table = self.table, None
+        width = max(len(row) for row in rows)
+        out = ["<table>\n"]
+        for number, row in enumerate(rows):
+            cell = "th" if number == 0 and len(rows) > 1 else "td"
+            cells = "".join(f"<{cell}>{self.inline(text)}</{cell}>" for text in row + [""] * (width - len(row)))
+            out.append(f"<tr>{cells}</tr>\n")
+        out.append("</table>\n")
+        return out
+
+
+def split_row(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+class EpubWriter:
+    """An EPUB being written: chapters are streamed in one at a time, the package files go in at the end"""
+
+    def __init__(self, path, title, identifier, language="en"):
+        self.path = path
+        self.title = title
+        self.identifier = identifier
+        self.language = language
+        self.chapters = []
+        self.images = {}
+        self.images_to_pack = []
+        self.chapter = None
+        self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        # The mimetype has to come first, uncompressed, so readers can tell what the file is from its first bytes
+        self.zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr("META-INF/container.xml", CONTAINER)
+        self.zip.writestr("OEBPS/style.css", STYLESHEET)
+
+    def start_chapter(self, title):
+        self.end_chapter()
+        name = f"chapter_{len(self.chapters) + 1:04d}.xhtml"
+        self.chapters.append((name, title))
+        entry = zipfile.ZipInfo(f"OEBPS/{name}", time.localtime()[:6])
+        entry.compress_type = zipfile.ZIP_DEFLATED
+        self.chapter = io.TextIOWrapper(self.zip.open(entry, "w"), encoding="utf-8")
+        self.chapter.write(XHTML_HEAD.format(lang=self.language, title=escape(title)))
+
+    def write(self, fragments):
+        for fragment in fragments:
+            self.chapter.write(fragment)
+
+    def end_chapter(self):
+        if self.chapter is not None:
+            self.chapter.write(XHTML_TAIL)
+            self.chapter.close()
+            self.chapter = None
+        # Nothing else can go in the zip while a chapter is being streamed into it
+        for source, href in self.images_to_pack:
+            # Already compressed - deflating it again only costs time
+            self.zip.write(source, f"OEBPS/{href}", compress_type=zipfile.ZIP_STORED)
+        self.images_to_pack = []
+
+    def add_image(self, source):
+        """Pack an image file (once); returns its href from a chapter, or None if it can't be found"""
+        if source not in self.images:
+            extension = os.path.splitext(source)[1].lower()
+            if extension not in MEDIA_TYPES or not os.path.isfile(source):
+                print(f"WARNING: Image not found or not supported, left out: {source}")
+                self.images[source] = None
+            else:
+                href = f"images/{len(self.images) + 1:05d}{extension}"
+                self.images_to_pack.append((source, href))
+                self.images[source] = href
+        return self.images[source]
+
+    def close(self):
+        self.end_chapter()
+        self.zip.writestr("OEBPS/content.opf", self.package())
+        self.zip.writestr("OEBPS/nav.xhtml", self.nav())
+        self.zip.writestr("OEBPS/toc.ncx", self.ncx())
+        self.zip.close()
+
+    def abandon(self):
+        """Close the zip after a failure part way through, so the half-written file can be deleted"""
+        try:
+            if self.chapter is not None:
+                # The zip won't close while a chapter entry is still open
+                self.chapter.close()
+        finally:
+            self.chapter = None
+            self.zip.close()
+
+    def package(self):
+        modified = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        items = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+                 '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>',
+                 '<item id="css" href="style.css" media-type="text/css"/>']
+        items += [f'<item id="c{number}" href="{name}" media-type="application/xhtml+xml"/>'
+                  for number, (name, _) in enumerate(self.chapters, 1)]
+        items += [f'<item id="i{number}" href="{href}" media-type="{MEDIA_TYPES[os.path.splitext(href)[1]]}"/>'
+                  for number, href in enumerate(filter(None, self.images.values()), 1)]
+        spine = [f'<itemref idref="c{number}"/>' for number in range(1, len(self.chapters) + 1)]
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="{self.language}">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">{self.identifier}</dc:identifier>
+    <dc:title>{escape(self.title)}</dc:title>
+    <dc:language>{self.language}</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    {chr(10).join("    " + item for item in items).strip()}
+  </manifest>
+  <spine toc="ncx">
+    {chr(10).join("    " + item for item in spine).strip()}
+  </spine>
+</package>
+"""
+
+    def nav(self):
+        entries = "\n".join(f'      <li><a href="{name}">{escape(title)}</a></li>' for name, title in self.chapters)
+        return (XHTML_HEAD.format(lang=self.language, title=escape(self.title)) + f"""<nav epub:type="toc" id="toc">
+  <h1>{escape(self.title)}</h1>
+  <ol>
+{entries}
+  </ol>
+</nav>
+""" + XHTML_TAIL)
+
+    def ncx(self):
+        points = "\n".join(
+            f'    <navPoint id="n{number}" playOrder="{number}"><navLabel><text>{escape(title)}</text></navLabel>'
+            f'<content src="{name}"/></navPoint>'
+            for number, (name, title) in enumerate(self.chapters, 1))
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head><meta name="dtb:uid" content="{self.identifier}"/></head>
+  <docTitle><text>{escape(self.title)}</text></docTitle>
+  <navMap>
+{points}
+  </navMap>
+</ncx>
+"""
+
+
+def markdown_to_epub(md_path, epub_path, title=None, language="en"):
+    """Convert a markdown file (e.g. ocr_output.md) to an EPUB; returns the number of chapters"""
+    title = title or os.path.splitext(os.path.basename(md_path))[0]
+    level, running, digest = plan_chapters(md_path)
+    identifier = f"urn:uuid:{uuid.UUID(digest)}"
+    base = os.path.dirname(os.path.abspath(md_path))
+
+    temp_path = epub_path + ".tmp"
+    writer = EpubWriter(temp_path, title, identifier, language)
+    try:
+        converter = BlockConverter(lambda src: writer.add_image(os.path.join(base, src)))
+        held = []
+        for line in read_lines(md_path):
+            stripped = line.strip()
+            if level is not None and converter.fence is None and (not stripped or PAGE_HEADING.match(stripped)):
+                # A page marker goes with whatever follows it, so chapters don't end on one
+                held.append(line)
+                continue
+            heading = HEADING.match(stripped)
+            if heading and converter.fence is None:
+                if level is None:
+                    starts = PAGE_HEADING.match(stripped) is not None
+                else:
+                    starts = len(heading.group(1)) == level and heading.group(2) not in running
+                if starts:
+                    if writer.chapter is not None:
+                        writer.write(converter.close())
+                    writer.start_chapter(re.sub(r"[*_`]", "", heading.group(2)) or title)
+            if writer.chapter is None:
+                writer.start_chapter(title)
+            for held_line in held:
+                writer.write(converter.feed(held_line))
+            held = []
+            writer.write(converter.feed(line))
+        if writer.chapter is None:
+            writer.start_chapter(title)
+        for held_line in held:
+            writer.write(converter.feed(held_line))
+        writer.write(converter.close())
+        writer.close()
+    except BaseException:
+        try:
+            writer.abandon()
+        except Exception:
+            pass  # the file's being deleted anyway; the error worth reporting is the first one
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, epub_path)
+    return len(writer.chapters)
@@ -0,0 +1,366 @@
+"""Page-chunked OCR with the Mistral OCR API.
+
+The PDF is uploaded once and then OCR'd a range of pages at a time (the OCR
+endpoint's `pages` option), several ranges at once, so a 900-page book is
+dozens of short requests instead of one very long one. A failed request only
+costs its own range, which is retried with exponential backoff and jitter.
+The pages are put back in order by their `index`. Given an OCRCache, pages
+already OCR'd aren't asked for again.
+
+Requests go through a transport, so the same code runs against the real API
+or a local imitation of it (ocr_stub_server.py):
+
+    transport = HTTPTransport(API_KEY)                          # api.mistral.ai
+    transport = HTTPTransport("test", "http://127.0.0.1:8000")  # the stub
+
+A transport is anything with async upload(), signed_url(), ocr() and delete()
+methods like HTTPTransport's. Only the standard library is needed.
+"""
+import asyncio
+import http.client
+import json
+import random
+import re
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from ocr_cache import document_key
+
+API_URL = "https://api.mistral.ai"
+MODEL = "mistral-ocr-latest"
+
+# Pages per OCR request, requests in flight at once, and most requests started per second
+PAGES_PER_CHUNK = 20
+CONCURRENCY = 4
+REQUESTS_PER_SECOND = 1.0
+
+# Tries per request, and the backoff between them in seconds (doubling each time, up to the cap)
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+# Seconds to wait on a single HTTP request
+REQUEST_TIMEOUT = 300
+
+# Worth trying again: timeouts, conflicts, rate limiting and server errors
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# The trailer points at the catalog, the catalog at the root of the page tree, and that
+# says how many pages there are: << /Type /Pages /Kids [...] /Count 900 >>
+ROOT_REF = re.compile(rb"/Root\s+(\d+)\s+\d+\s+R")
+PAGES_REF = re.compile(rb"/Pages\s+(\d+)\s+\d+\s+R")
+PAGE_COUNT = re.compile(rb"/Count\s+(\d+)")
+OBJECT_STREAM = re.compile(rb"(<<[^>]*/Type\s*/ObjStm\b[^>]*>>)\s*stream\r?\n")
+
+
+class TransportError(Exception):
+    """A request that failed; `status` is the HTTP status, or None if there wasn't a response"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status in RETRY_STATUSES
+
+
+class HTTPTransport:
+    """The Mistral REST API over urllib, each request on a thread of its own"""
+
+    def __init__(self, api_key, base_url=API_URL, timeout=REQUEST_TIMEOUT, max_connections=16):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="ocr-http")
+
+    async def upload(self, filename, data):
+        """Upload a PDF for OCR; returns its file ID"""
+        boundary = uuid.uuid4().hex
+        body = b"".join([
+            f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\nocr\r\n'.encode(),
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'.encode(),
+            data,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ])
+        response = await self.request("POST", "/v1/files", body, f"multipart/form-data; boundary={boundary}")
+        return response["id"]
+
+    async def signed_url(self, file_id):
+        response = await self.request("GET", f"/v1/files/{file_id}/url?expiry=24")
+        return response["url"]
+
+    async def ocr(self, document_url, pages=None, model=MODEL, include_images=False):
+        """OCR the given page indices of a document (all of it if pages is None); returns the response JSON"""
+        payload = {
+            "model": model,
+            "document": {"type": "document_url", "document_url": document_url},
+            "include_image_base64": include_images,
+        }
+        if pages is not None:
+            payload["pages"] = list(pages)
+        return await self.request("POST", "/v1/ocr", json.dumps(payload).encode(), "application/json")
+
+    async def delete(self, file_id):
+        await self.request("DELETE", f"/v1/files/{file_id}")
+
+    async def request(self, method, path, body=None, content_type=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.send, method, path, body, content_type)
+
+    def send(self, method, path, body=None, content_type=None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        request.add_header("Authorization", f"Bearer {self.api_key}")
+        request.add_header("Accept", "application/json")
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            detail = e.read(500).decode("utf-8", "replace")
+            raise TransportError(f"HTTP {e.code} from {path}: {detail}", e.code,
+                                 parse_retry_after(e.headers.get("Retry-After"))) from None
+        except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError) as e:
+            raise TransportError(f"{method} {path} failed: {e}") from None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Lets at most `rate` requests start per second, shared by everything in flight"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_start = 0.0
+
+    async def wait(self):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        start = max(now, self.next_start)
+        self.next_start = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def hold(self, seconds):
+        # The server asked us to back off - nobody starts another request until then
+        self.next_start = max(self.next_start, time.monotonic() + seconds)
+
+
+def backoff(attempt, retry_after=None):
+    # "Full jitter": anywhere up to the exponential delay, so ranges that failed together don't retry together
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+async def with_retries(call, limiter, what, attempts=MAX_ATTEMPTS):
+    for attempt in range(attempts):
+        await limiter.wait()
+        try:
+            return await call()
+        except TransportError as e:
+            if not e.retryable or attempt == attempts - 1:
+                raise
+            if e.retry_after:
+                limiter.hold(e.retry_after)
+            delay = backoff(attempt, e.retry_after)
+            print(f"{what} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def count_pages(data):
+    """Pages in a PDF according to its page tree, or None if it can't be found"""
+    # Followed from the last trailer, because a PDF that's been edited and saved again
+    # (an incremental update) can still hold old page trees with other counts
+    roots = ROOT_REF.findall(data)
+    catalog = pdf_object(data, int(roots[-1])) if roots else None
+    tree = PAGES_REF.search(catalog) if catalog else None
+    pages = pdf_object(data, int(tree.group(1))) if tree else None
+    count = PAGE_COUNT.search(pages) if pages else None
+    return int(count.group(1)) if count else None
+
+
+def pdf_object(data, number):
+    """The dictionary of object `number` (its last definition wins), or None if it can't be found"""
+    definitions = re.findall(rb"(?<![0-9])%d\s+\d+\s+obj\b(.*?)(?:endobj|stream)" % number, data, re.DOTALL)
+    if definitions:
+        return definitions[-1]
+    # PDF 1.5+ can keep objects inside compressed object streams: "number offset" pairs, then the objects
+    found = None
+    view = memoryview(data)
+    for match in OBJECT_STREAM.finditer(data):
+        first = re.search(rb"/First\s+(\d+)", match.group(1))
+        if not first:
+            continue
+        first = int(first.group(1))
+        inflated = inflate(view[match.end():])
+        pairs = inflated[:first].split()
+        try:
+            offsets = sorted((int(offset), int(n)) for n, offset in zip(pairs[::2], pairs[1::2]))
+        except ValueError:
+            continue
+        for i, (offset, n) in enumerate(offsets):
+            if n == number:
+                end = first + offsets[i + 1][0] if i + 1 < len(offsets) else len(inflated)
+                found = inflated[first + offset:end]
+    return found
+
+
+def inflate(view, chunk_size=64 * 1024):
+    # Decompress one deflate stream from the start of view, reading no further than its end
+    decompressor = zlib.decompressobj()
+    parts = []
+    try:
+        for start in range(0, len(view), chunk_size):
+            parts.append(decompressor.decompress(view[start:start + chunk_size]))
+            if decompressor.eof:
+                break
+    except zlib.error:
+        pass
+    return b"".join(parts)
+
+
+def page_ranges(pages, pages_per_chunk=PAGES_PER_CHUNK):
+    """Split sorted page indices into runs of consecutive pages, at most pages_per_chunk long"""
+    ranges = []
+    for index in pages:
+        if ranges and ranges[-1].stop == index and len(ranges[-1]) < pages_per_chunk:
+            ranges[-1] = range(ranges[-1].start, index + 1)
+        else:
+            ranges.append(range(index, index + 1))
+    return ranges
+
+
+def describe(pages):
+    return "all pages" if pages is None else f"pages {pages.start + 1}-{pages.stop}"
+
+
+def in_order(pages):
+    return sorted(pages, key=lambda page: page["index"])
+
+
+def page_markdown(page):
+    return f"## Page {page['index'] + 1}\n\n{page['markdown']}\n\n"
+
+
+async def ocr_pdf(data, filename, transport, model=MODEL, pages_per_chunk=PAGES_PER_CHUNK,
+                  concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND, include_images=False, cache=None,
+                  sink=None, limiter=None, semaphore=None):
+    """OCR a PDF (its bytes) range by range; returns the pages from the OCR responses, in order.
+
+    If the page count can't be read from the PDF, it's sent as a single request.
+    With a cache (an OCRCache), pages already OCR'd come from there and new
+    ones are saved to it as each range finishes, so nothing is OCR'd twice.
+    With a sink (a MarkdownSink), pages are handed to it as they arrive -
+    it writes them out and swaps images for files, which are cached too.
+    Several PDFs OCR'd at once can share one RateLimiter and semaphore, in
+    place of `rate` and `concurrency`.
+    """
+    cached = {}
+    if cache is not None:
+        document = document_key(data)
+        cached = cache.pages(document, model, include_images)
+        if sink is not None:
+            # Images missing from the sink's folder (deleted, or a different output) are copied
+            # out of the cache; only pages with images in neither place are OCR'd again
+            cached = {index: page for index, page in cached.items()
+                      if sink.restore_images(page, cache.restore_image)}
+        if cached and cache.complete(document, model, include_images) == len(cached):
+            print(f"{filename}: all {len(cached)} pages found in the cache")
+            if sink is not None:
+                sink.add(cached.values())
+            return in_order(cached.values())
+
+    page_count = count_pages(data)
+    if page_count:
+        ranges = page_ranges([index for index in range(page_count) if index not in cached], pages_per_chunk)
+        if cached:
+            print(f"{filename}: {len(cached)} of {page_count} pages found in the cache, picking up from there")
+    else:
+        # Without a page count there's no asking for just the missing pages
+        cached = {}
+        ranges = [None]
+    if sink is not None:
+        sink.add(cached.values())
+
+    def save(pages):
+        if sink is not None:
+            sink.add(pages)
+        if cache is not None:
+            cache.store(document, model, include_images, pages)
+            if sink is not None:
+                cache.store_images(sink.image_files(pages))
+
+    results = []
+    if ranges:
+        results = await ocr_ranges(data, filename, transport, ranges, model, concurrency, rate,
+                                   include_images, on_range=save, limiter=limiter, semaphore=semaphore)
+    pages = in_order([*cached.values(), *(page for result in results for page in result)])
+    if cache is not None:
+        cache.finish(document, model, include_images, len(pages), filename)
+    return pages
+
+
+async def ocr_ranges(data, filename, transport, ranges, model=MODEL, concurrency=CONCURRENCY,
+                     rate=REQUESTS_PER_SECOND, include_images=False, on_range=None, limiter=None, semaphore=None):
+    """Upload a PDF and OCR the given page ranges concurrently; returns each range's pages.
+
+    on_range(pages) is called as each range finishes, in whatever order they finish.
+    """
+    limiter = limiter or RateLimiter(rate)
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+    async with semaphore:
+        file_id = await with_retries(lambda: transport.upload(filename, data), limiter, f"Upload of {filename}")
+    try:
+        url = await with_retries(lambda: transport.signed_url(file_id), limiter, "Getting the signed URL")
+        done = 0
+
+        async def ocr_range(pages):
+            response = await transport.ocr(url, pages, model, include_images)
+            result = response["pages"]
+            if pages is not None:
+                if pages.start and all(page["index"] < len(pages) for page in result):
+                    # Numbered from the start of the range rather than the document
+                    for page in result:
+                        page["index"] += pages.start
+                if sorted(page["index"] for page in result) != list(pages):
+                    raise TransportError(f"OCR of {describe(pages)} came back with {len(result)} pages")
+            return result
+
+        async def run(pages):
+            nonlocal done
+            async with semaphore:
+                result = await with_retries(lambda: ocr_range(pages), limiter, f"OCR of {filename} {describe(pages)}")
+            if on_range is not None:
+                on_range(result)
+            done += 1
+            print(f"{filename}: OCR'd {describe(pages)} ({done}/{len(ranges)})")
+            return result
+
+        tasks = [asyncio.ensure_future(run(pages)) for pages in ranges]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # One range failing for good stops the rest
+            for task in tasks:
+                task.cancel()
+    finally:
+        try:
+            await transport.delete(file_id)
+        except TransportError:
+            pass
@@ -0,0 +1,111 @@
+"""Local cache of OCR results, so a PDF is only ever OCR'd once.
+
+Pages are stored in SQLite as each range of pages comes back, keyed by a hash
+of the PDF's bytes, the model and the page index. Running the same PDF again
+(even renamed or moved) reads it straight from here without uploading it,
+and a run that was interrupted only asks the API for the pages it hadn't
+got yet. The images a MarkdownSink saved for those pages are kept too, by
+the same content-hash names, so they can be put back in any output folder
+without OCR'ing the pages again.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS pages (
+        document TEXT NOT NULL,
+        model TEXT NOT NULL,
+        page_index INTEGER NOT NULL,
+        with_images INTEGER NOT NULL,
+        page TEXT NOT NULL,
+        PRIMARY KEY (document, model, page_index)
+    )
+    """,
+    # A document is here once all its pages are
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        document TEXT NOT NULL,
+        model TEXT NOT NULL,
+        with_images INTEGER NOT NULL,
+        page_count INTEGER NOT NULL,
+        filename TEXT,
+        completed_at REAL,
+        PRIMARY KEY (document, model)
+    )
+    """,
+    # Named by a hash of their contents, so an image on many pages or in many PDFs is here once
+    """
+    CREATE TABLE IF NOT EXISTS images (
+        name TEXT PRIMARY KEY,
+        data BLOB NOT NULL
+    )
+    """,
+]
+
+
+def document_key(data):
+    """Hash of a PDF's bytes"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class OCRCache:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+    def pages(self, document, model, with_images=False):
+        """The cached pages of a document, by index. Pages OCR'd without images don't count if images are wanted."""
+        rows = self.conn.execute(
+            "SELECT page_index, page FROM pages WHERE document = ? AND model = ? AND with_images >= ?",
+            (document, model, int(with_images)))
+        return {index: json.loads(page) for index, page in rows}
+
+    def complete(self, document, model, with_images=False):
+        """Page count if every page of the document is cached, otherwise None"""
+        row = self.conn.execute(
+            "SELECT page_count FROM documents WHERE document = ? AND model = ? AND with_images >= ?",
+            (document, model, int(with_images))).fetchone()
+        return row[0] if row else None
+
+    def store(self, document, model, with_images, pages):
+        """Save one range's pages as soon as it comes back"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pages (document, model, page_index, with_images, page) VALUES (?, ?, ?, ?, ?)",
+                [(document, model, page["index"], int(with_images), json.dumps(page)) for page in pages])
+
+    def finish(self, document, model, with_images, page_count, filename=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (document, model, with_images, page_count, filename, completed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (document, model, int(with_images), page_count, filename, time.time()))
+
+    def store_images(self, files):
+        """Keep a copy of each (name, path) image file that isn't already here"""
+        with self.conn:
+            for name, path in files:
+                if self.conn.execute("SELECT 1 FROM images WHERE name = ?", (name,)).fetchone() is None:
+                    with open(path, "rb") as image_file:
+                        self.conn.execute("INSERT INTO images (name, data) VALUES (?, ?)", (name, image_file.read()))
+
+    def restore_image(self, name, path):
+        """Write a cached image to path; False if it isn't in the cache"""
+        row = self.conn.execute("SELECT data FROM images WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return False
+        with open(path + ".tmp", "wb") as image_file:
+            image_file.write(row[0])
+        os.replace(path + ".tmp", path)
+        return True
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,155 @@
+"""Durable job queue for batch OCR (Batch_PDF_OCR.py).
+
+Each PDF found is a row in SQLite that goes pending -> running -> done or
+failed, so a batch that crashes or is stopped carries on where it left off:
+anything still marked running belonged to the run that died and is put back
+to pending. A PDF that changes (size or modification time) after it was
+done is queued again. Every run records how much it got through and when it
+last finished something, for the throughput figures.
+"""
+import os
+import sqlite3
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        path TEXT PRIMARY KEY,
+        output TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        pages INTEGER,
+        started_at REAL,
+        finished_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_state_size ON jobs (state, size)",
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        documents INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        pages INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+
+class JobQueue:
+    def __init__(self, path):
+        self.path = path
+        self.lock_file = None
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+        self.run_id = None
+
+    def add(self, path, output, size, mtime):
+        """Queue a PDF unless it's already queued, or done with its markdown still there; returns True if queued"""
+        row = self.conn.execute("SELECT size, mtime, state, output FROM jobs WHERE path = ?", (path,)).fetchone()
+        if row and (row[0], row[1], row[3]) == (size, mtime, output):
+            if row[2] != DONE or os.path.exists(output):
+                return False
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs (path, output, size, mtime, state) VALUES (?, ?, ?, ?, ?)",
+                (path, output, size, mtime, PENDING))
+        return True
+
+    def lock(self):
+        """Claim the queue for this process; returns False if another batch is already using it"""
+        # Held until the process exits, however it exits
+        self.lock_file = open(self.path + ".lock", "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def recover(self):
+        """Put back jobs left running by a run that didn't finish; returns how many"""
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, RUNNING)).rowcount
+
+    def retry_failed(self):
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET state = ?, error = NULL WHERE state = ?",
+                                     (PENDING, FAILED)).rowcount
+
+    def claim(self, max_size=None):
+        """Mark the largest pending job (no bigger than max_size) running and return (path, output, size)"""
+        sql = "SELECT path, output, size FROM jobs WHERE state = ?"
+        params = [PENDING]
+        if max_size is not None:
+            sql += " AND size <= ?"
+            params.append(max_size)
+        row = self.conn.execute(sql + " ORDER BY size DESC LIMIT 1", params).fetchone()
+        if row:
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, started_at = ? WHERE path = ?",
+                                  (RUNNING, time.time(), row[0]))
+        return row
+
+    def smallest_pending(self):
+        row = self.conn.execute("SELECT MIN(size) FROM jobs WHERE state = ?", (PENDING,)).fetchone()
+        return row[0]
+
+    def finish(self, path, pages, size):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, pages = ?, error = NULL, finished_at = ? WHERE path = ?",
+                              (DONE, pages, time.time(), path))
+            self.conn.execute("UPDATE runs SET documents = documents + 1, pages = pages + ?, bytes = bytes + ?, "
+                              "finished_at = ? WHERE id = ?", (pages, size, time.time(), self.run_id))
+
+    def fail(self, path, error):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE path = ?",
+                              (FAILED, str(error), time.time(), path))
+            self.conn.execute("UPDATE runs SET failed = failed + 1, finished_at = ? WHERE id = ?",
+                              (time.time(), self.run_id))
+
+    def start_run(self):
+        with self.conn:
+            self.run_id = self.conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),)).lastrowid
+
+    def end_run(self):
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), self.run_id))
+
+    def counts(self):
+        """Number of jobs in each state"""
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return counts
+
+    def failures(self):
+        return self.conn.execute("SELECT path, error FROM jobs WHERE state = ? ORDER BY path", (FAILED,)).fetchall()
+
+    def runs(self, limit=5):
+        """The latest runs as (started_at, finished_at, documents, failed, pages, bytes), newest first"""
+        return self.conn.execute("SELECT started_at, finished_at, documents, failed, pages, bytes FROM runs "
+                                 "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+    def close(self):
+        self.conn.close()
+        if self.lock_file:
+            self.lock_file.close()
@@ -0,0 +1,136 @@
+"""Writes OCR'd pages to a markdown file as they arrive, and their images to a folder beside it.
+
+Ranges of pages finish in any order, so a page is held back only until the
+ones before it have been written. Images come base64-encoded inside the OCR
+response; each is decoded a chunk at a time straight to disk and named by a
+hash of its contents, so an image that turns up on many pages (a logo, a
+running header) is stored once. The markdown links to the saved files, which
+is how the ePub step finds them.
+"""
+import base64
+import hashlib
+import os
+
+from mistral_ocr import page_markdown
+
+IMAGES_FOLDER = "images"
+
+# Characters of base64 decoded at a time (a multiple of 4)
+DECODE_CHUNK = 256 * 1024
+
+
+class MarkdownSink:
+    """Use as a context manager: the markdown goes to a temporary file that
+    only replaces `path` once every page is in, so a failed run leaves any
+    earlier output alone."""
+
+    def __init__(self, path, images_dir=None, echo=False):
+        self.path = path
+        self.images_dir = images_dir
+        self.echo = echo
+        self.temp_path = path + ".tmp"
+        self.waiting = {}
+        self.next_index = 0
+        self.pages_written = 0
+        self.images_saved = 0
+        self.images_reused = 0
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self.images_dir:
+            os.makedirs(self.images_dir, exist_ok=True)
+        self.file = open(self.temp_path, "w", encoding="utf-8")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush(everything=True)
+            self.file.close()
+            os.replace(self.temp_path, self.path)
+        else:
+            self.file.close()
+            os.remove(self.temp_path)
+
+    def add(self, pages):
+        """Take pages in any order; they're written out as soon as they're next in line"""
+        for page in pages:
+            if self.images_dir:
+                for image in page.get("images") or []:
+                    if image.get("image_base64"):
+                        image["file"] = self.save_image(image)
+                        # Only the file name is kept (the cache stores pages like this too)
+                        del image["image_base64"]
+            self.waiting[page["index"]] = page
+        self.flush()
+
+    def restore_images(self, page, restore):
+        """Whether every image a cached page links to is in the images folder, once
+        restore(name, path) has put back any that weren't (e.g. from an OCRCache)"""
+        if not self.images_dir:
+            return True
+        for image in page.get("images") or []:
+            if not image.get("file"):
+                return False
+            target = os.path.join(self.images_dir, image["file"])
+            if not os.path.exists(target):
+                if not restore(image["file"], target):
+                    return False
+                self.images_saved += 1
+        return True
+
+    def image_files(self, pages):
+        """(name, path) of each image saved for these pages"""
+        for page in pages:
+            for image in page.get("images") or []:
+                if self.images_dir and image.get("file"):
+                    yield image["file"], os.path.join(self.images_dir, image["file"])
+
+    def flush(self, everything=False):
+        # Pages missing from the OCR response would hold up the rest, so the end writes whatever's left
+        while self.next_index in self.waiting or (everything and self.waiting):
+            index = self.next_index if self.next_index in self.waiting else min(self.waiting)
+            self.write(self.waiting.pop(index))
+            self.next_index = index + 1
+        self.file.flush()
+
+    def write(self, page):
+        markdown = page["markdown"]
+        if self.images_dir:
+            folder = os.path.relpath(self.images_dir, os.path.dirname(os.path.abspath(self.path))).replace(os.sep, "/")
+            for image in page.get("images") or []:
+                if image.get("file"):
+                    markdown = markdown.replace(f"]({image['id']})", f"]({folder}/{image['file']})")
+        text = page_markdown({"index": page["index"], "markdown": markdown})
+        self.file.write(text)
+        self.pages_written += 1
+        if self.echo:
+            print(text)
+
+    def save_image(self, image):
+        """Decode a base64 image into the images folder, unless it's already there; returns its file name"""
+        # "data:image/jpeg;base64,/9j/4AAQ..." (or just the base64)
+        header, _, payload = image["image_base64"].rpartition(",")
+        extension = os.path.splitext(image.get("id", ""))[1]
+        if not extension and header.startswith("data:image/"):
+            extension = "." + header[len("data:image/"):].split(";")[0]
+        # Hashed first, so an image that's already saved is never written again
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in decode_chunks(payload):
+            digest.update(chunk)
+        name = digest.hexdigest() + extension.lower()
+        target = os.path.join(self.images_dir, name)
+        if os.path.exists(target):
+            self.images_reused += 1
+            return name
+        with open(target + ".tmp", "wb") as image_file:
+            for chunk in decode_chunks(payload):
+                image_file.write(chunk)
+        os.replace(target + ".tmp", target)
+        self.images_saved += 1
+        return name
+
+
+def decode_chunks(payload):
+    for start in range(0, len(payload), DECODE_CHUNK):
+        yield base64.b64decode(payload[start:start + DECODE_CHUNK])
@@ -0,0 +1,170 @@
+"""A local stand-in for the Mistral files and OCR endpoints, for trying the OCR script without an API key.
+
+    python ocr_stub_server.py --port 8000 --fail-rate 0.2 --latency 0.05
+
+then set BASE_URL = "http://127.0.0.1:8000" in 01_Mistral_PDF_OCR.py. Uploaded
+PDFs are kept in memory; OCR returns made-up markdown for each requested page,
+with two small images: one the same on every page, and one unique to it.
+--fail-rate makes that share of requests fail with a 429 or a 5xx, to exercise
+the retries.
+"""
+import argparse
+import base64
+import email.parser
+import email.policy
+import json
+import random
+import re
+import struct
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from mistral_ocr import count_pages
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    files = {}
+    fail_rate = 0.0
+    latency = 0.0
+    relative_index = False
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        path = urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path == "/v1/files":
+            self.upload(body)
+        elif path == "/v1/ocr":
+            if not self.maybe_fail():
+                self.ocr(json.loads(body))
+        else:
+            self.reply(404, {"detail": "Not found"})
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        match = re.fullmatch(r"/v1/files/([\w-]+)/url", urlsplit(self.path).path)
+        if match and match.group(1) in self.files:
+            host, port = self.server.server_address[:2]
+            self.reply(200, {"url": f"http://{host}:{port}/signed/{match.group(1)}?signature={uuid.uuid4().hex}"})
+        else:
+            self.reply(404, {"detail": "File not found"})
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        match = re.fullmatch(r"/v1/files/([\w-]+)", urlsplit(self.path).path)
+        if match and self.files.pop(match.group(1), None) is not None:
+            self.reply(200, {"id": match.group(1), "object": "file", "deleted": True})
+        else:
+            self.reply(404, {"detail": "File not found"})
+
+    def upload(self, body):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        if "file" not in fields:
+            self.reply(422, {"detail": "No file"})
+            return
+        file_id = str(uuid.uuid4())
+        data = fields["file"].get_payload(decode=True)
+        self.files[file_id] = (fields["file"].get_filename(), data)
+        self.reply(200, {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                         "filename": fields["file"].get_filename(), "purpose": "ocr"})
+
+    def ocr(self, request):
+        url = request.get("document", {}).get("document_url", "")
+        match = re.search(r"/signed/([\w-]+)", url)
+        if not match or match.group(1) not in self.files:
+            self.reply(422, {"detail": "Could not fetch document"})
+            return
+        filename, data = self.files[match.group(1)]
+        page_count = count_pages(data) or 1
+        pages = request.get("pages")
+        if pages is None:
+            pages = range(page_count)
+        if any(not 0 <= index < page_count for index in pages):
+            self.reply(422, {"detail": f"Pages out of range (document has {page_count})"})
+            return
+        time.sleep(self.latency * len(pages))
+        with_images = request.get("include_image_base64")
+        self.reply(200, {
+            "pages": [{
+                "index": i - pages[0] if self.relative_index else i,
+                "markdown": f"# {filename}\n\n![img-{2 * i}.png](img-{2 * i}.png)\n\n"
+                            f"Stub text for page {i + 1} of {page_count}.\n\n![img-{2 * i + 1}.png](img-{2 * i + 1}.png)",
+                "images": [stub_image(f"img-{2 * i}.png", 0, with_images),
+                           stub_image(f"img-{2 * i + 1}.png", i + 1, with_images)],
+                "dimensions": {"dpi": 200, "height": 2200, "width": 1700},
+            } for i in pages],
+            "model": request.get("model"),
+            "usage_info": {"pages_processed": len(pages), "doc_size_bytes": len(data)},
+        })
+
+    def authorized(self):
+        if self.headers.get("Authorization", "").startswith("Bearer "):
+            return True
+        self.reply(401, {"detail": "Unauthorized"})
+        return False
+
+    def maybe_fail(self):
+        if random.random() >= self.fail_rate:
+            return False
+        if random.random() < 0.5:
+            self.reply(429, {"detail": "Requests rate limit exceeded"}, {"Retry-After": "1"})
+        else:
+            self.reply(random.choice([500, 502, 503]), {"detail": "Service unavailable"})
+        return True
+
+    def reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_image(image_id, seed, with_base64):
+    image = {"id": image_id, "top_left_x": 100, "top_left_y": 100, "bottom_right_x": 300, "bottom_right_y": 200}
+    if with_base64:
+        image["image_base64"] = "data:image/png;base64," + base64.b64encode(tiny_png(seed)).decode()
+    return image
+
+
+def tiny_png(seed):
+    # A 1x1 PNG in a colour picked by seed
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    pixel = bytes([0, seed * 97 % 256, seed * 57 % 256, seed * 31 % 256])
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(pixel)) + chunk(b"IEND", b""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imitation of the Mistral files and OCR endpoints")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of OCR requests that fail (0-1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of 'OCR' per page")
+    parser.add_argument("--relative-index", action="store_true",
+                        help="Number pages from the start of the requested range, not the document")
+    args = parser.parse_args()
+
+    StubHandler.fail_rate = args.fail_rate
+    StubHandler.latency = args.latency
+    StubHandler.relative_index = args.relative_index
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    print(f"Stub OCR server on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
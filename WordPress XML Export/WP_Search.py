@@ -0,0 +1,64 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+# Made by WP_XML_Export.py --sqlite
+DATABASE_NAME = "output_posts.sqlite"
+
+
+def search(conn, query, post_type=None, status=None, limit=20):
+    # Best matches first (FTS5's bm25 rank), each with a snippet of the text around the hit
+    sql = """
+        SELECT posts.post_id, posts.title, posts.date, posts.post_type, posts.status,
+               snippet(posts_fts, -1, '[', ']', '...', 16)
+        FROM posts_fts
+        JOIN posts ON posts.rowid = posts_fts.rowid
+        WHERE posts_fts MATCH ?
+    """
+    params = [query]
+    if post_type:
+        sql += " AND posts.post_type = ?"
+        params.append(post_type)
+    if status:
+        sql += " AND posts.status = ?"
+        params.append(status)
+    sql += " ORDER BY posts_fts.rank LIMIT ?"
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def count_comments(conn, post_ids):
+    placeholders = ", ".join("?" * len(post_ids))
+    rows = conn.execute(f"SELECT post_id, COUNT(*) FROM comments WHERE post_id IN ({placeholders}) GROUP BY post_id",
+                        post_ids)
+    return dict(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-text search over posts loaded with WP_XML_Export.py --sqlite")
+    parser.add_argument("query", help='FTS5 query, e.g. garden, "rose garden", garden NOT tomato, title:holiday, gard*')
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), DATABASE_NAME),
+                        help=f"Database to search (default: {DATABASE_NAME} next to this script)")
+    parser.add_argument("--type", help="Only posts of this type (post, page, attachment, ...)")
+    parser.add_argument("--status", help="Only posts with this status (publish, draft, private, ...)")
+    parser.add_argument("--limit", type=int, default=20, help="Most results to show (default: 20)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"No database at {args.db} - run WP_XML_Export.py --sqlite first.")
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    started = time.perf_counter()
+    try:
+        results = search(conn, args.query, args.type, args.status, args.limit)
+    except sqlite3.OperationalError as e:
+        sys.exit(f"Bad query: {e}")
+    elapsed = (time.perf_counter() - started) * 1000
+    comments = count_comments(conn, [row[0] for row in results]) if results else {}
+
+    for post_id, title, date, post_type, status, snippet in results:
+        print(f"{date}  {title}  ({post_type}, {status}, {comments.get(post_id, 0)} comments)")
+        print(f"    {' '.join(snippet.split())}")
+    print(f"{len(results)} result{'s' if len(results) != 1 else ''} in {elapsed:.1f} ms")
@@ -1,7 +1,77 @@
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
 from html import unescape
+from html.parser import HTMLParser
+import argparse
+import hashlib
 import os
 import re
+import sqlite3
+import threading
+import time
+
+# Print progress every this many posts
+PROGRESS_EVERY = 1000
+
+# Posts sent to a worker process at a time, and batches in flight per worker
+BATCH_SIZE = 64
+BATCHES_PER_WORKER = 4
+
+# Threads writing files, and writes each may have queued
+DEFAULT_WRITERS = 4
+WRITES_PER_WRITER = 16
+
+# Longest file name (without extension) - most filesystems allow 255 bytes
+MAX_NAME_LENGTH = 150
+
+CONTENT_TAG = "{http://purl.org/rss/1.0/modules/content/}encoded"
+WP = "{http://wordpress.org/export/1.2/}"
+POST_DATE_TAG = WP + "post_date"
+POST_ID_TAG = WP + "post_id"
+MODIFIED_TAG = WP + "post_modified_gmt"
+
+# What the last run wrote, kept in the output folder so the next run only writes what changed
+MANIFEST_NAME = ".export_manifest.sqlite"
+
+# Searchable database written by --sqlite (query it with WP_Search.py), and posts per transaction
+DATABASE_NAME = "output_posts.sqlite"
+DATABASE_BATCH = 5000
+
+DATABASE_SCHEMA = [
+    """
+    CREATE TABLE posts (
+        post_id TEXT PRIMARY KEY,
+        title TEXT,
+        date TEXT,
+        modified TEXT,
+        post_type TEXT,
+        status TEXT,
+        link TEXT,
+        categories TEXT,
+        tags TEXT,
+        html TEXT,
+        text TEXT
+    )
+    """,
+    """
+    CREATE TABLE comments (
+        comment_id TEXT,
+        post_id TEXT,
+        author TEXT,
+        date TEXT,
+        approved TEXT,
+        content TEXT
+    )
+    """,
+    # Full-text index over the posts table (it stores no copy of the text itself)
+    """
+    CREATE VIRTUAL TABLE posts_fts USING fts5(
+        title, text, categories, tags, content='posts', content_rowid='rowid'
+    )
+    """,
+]
+
 
 def find_xml_file():
     # Find the first XML file in the current directory (not subdirectories)
@@ -17,41 +87,438 @@ def sanitize_filename(title):
     return re.sub(r'[\\/:*?"<>|]', '_', title)
 
 
-def extract_posts(xml_file):
+def unique_filename(name, extension, used):
+    # Posts that share a title get _2, _3, ... in the order they appear in the
+    # export, instead of overwriting each other. Compared case-insensitively,
+    # as Windows and macOS filesystems do.
+    candidate = name + extension
+    number = 1
+    while candidate.lower() in used:
+        number += 1
+        candidate = f"{name}_{number}{extension}"
+    used.add(candidate.lower())
+    return candidate
+
+
+def iter_items(xml_file):
+    # Stream the export instead of loading it whole, so memory stays flat however
+    # big it is. Each <item> is handed over as soon as it's parsed, then cleared
+    # and dropped from its parent (the <channel>) once the caller is done with it.
+    parents = []
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == "item":
+            yield elem
+            elem.clear()
+            if parents:
+                del parents[-1][:]
+
+
+def iter_posts(xml_file):
+    # (post ID, modified date, title, content, post date) for each item, as plain strings
+    for item in iter_items(xml_file):
+        title = item.find("title").text or "Untitled"
+        content = item.find(CONTENT_TAG).text or ""
+        post_date = item.find(POST_DATE_TAG).text or "Unknown Date"
+        post_id = item.findtext(POST_ID_TAG) or item.findtext("guid") or title
+        modified = item.findtext(MODIFIED_TAG) or ""
+        yield post_id, modified, title, content, post_date
+
+
+def post_hash(title, content, post_date, markdown):
+    # Everything the output file is made from, so an unchanged hash means an unchanged file
+    data = "\0".join((title, content, post_date, "md" if markdown else "txt"))
+    return hashlib.blake2b(data.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class Manifest:
+    # Post ID -> (filename, name before any _2 suffix, content hash, modified date)
+    # for every file the last run wrote. Updated once all of a run's writes are done,
+    # so an interrupted run just redoes its posts next time.
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS posts (post_id TEXT PRIMARY KEY, filename TEXT, "
+            "name TEXT, content_hash TEXT, modified TEXT)"
+        )
+        self.posts = {row[0]: row[1:] for row in self.conn.execute(
+            "SELECT post_id, filename, name, content_hash, modified FROM posts")}
+
+    def save(self, updates, removed):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?)", updates)
+            self.conn.executemany("DELETE FROM posts WHERE post_id = ?", [(post_id,) for post_id in removed])
+
+    def close(self):
+        self.conn.close()
+
+
+class MarkdownConverter(HTMLParser):
+    # Turns the HTML WordPress stores for a post into Markdown. Line breaks in
+    # the text are kept as they are, since WordPress uses them for paragraphs.
+
+    BLOCKS = {"p", "div", "figure", "figcaption", "table", "tr", "section", "article"}
+    SKIP = {"script", "style"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.stack = []     # buffers for blockquotes, which get "> " prefixes when closed
+        self.lists = []     # "ul" or a counter for each open list
+        self.links = []
+        self.pre = 0
+        self.skip = 0
+
+    def convert(self, html):
+        self.feed(html)
+        self.close()
+        text = "".join(self.out)
+        return re.sub(r"\n{3,}", "\n\n", text).strip() + "\n"
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in self.SKIP:
+            self.skip += 1
+        elif tag in self.BLOCKS:
+            self.out.append("\n\n")
+        elif len(tag) == 2 and tag[0] == "h" and tag[1] in "123456":
+            self.out.append("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag == "br":
+            self.out.append("  \n")
+        elif tag == "hr":
+            self.out.append("\n\n---\n\n")
+        elif tag in ("strong", "b"):
+            self.out.append("**")
+        elif tag in ("em", "i"):
+            self.out.append("*")
+        elif tag == "code" and not self.pre:
+            self.out.append("`")
+        elif tag == "pre":
+            self.pre += 1
+            self.out.append("\n\n```\n")
+        elif tag == "a":
+            self.links.append(attrs.get("href"))
+            self.out.append("[")
+        elif tag == "img":
+            self.out.append(f"![{attrs.get('alt') or ''}]({attrs.get('src') or ''})")
+        elif tag in ("ul", "ol"):
+            self.lists.append("ul" if tag == "ul" else 0)
+            self.out.append("\n")
+        elif tag == "li":
+            indent = "  " * (len(self.lists) - 1)
+            if self.lists and self.lists[-1] != "ul":
+                self.lists[-1] += 1
+                self.out.append(f"\n{indent}{self.lists[-1]}. ")
+            else:
+                self.out.append(f"\n{indent}- ")
+        elif tag == "blockquote":
+            self.stack.append(self.out)
+            self.out = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip = max(0, self.skip - 1)
+        elif tag in self.BLOCKS or (len(tag) == 2 and tag[0] == "h" and tag[1] in "123456"):
+            self.out.append("\n\n")
+        elif tag in ("strong", "b"):
+            self.out.append("**")
+        elif tag in ("em", "i"):
+            self.out.append("*")
+        elif tag == "code" and not self.pre:
+            self.out.append("`")
+        elif tag == "pre" and self.pre:
+            self.pre -= 1
+            self.out.append("\n```\n\n")
+        elif tag == "a" and self.links:
+            href = self.links.pop()
+            self.out.append(f"]({href})" if href else "]")
+        elif tag in ("ul", "ol") and self.lists:
+            self.lists.pop()
+            self.out.append("\n\n")
+        elif tag == "blockquote" and self.stack:
+            quoted = "".join(self.out).strip()
+            self.out = self.stack.pop()
+            self.out.append("\n\n" + "\n".join("> " + line if line else ">" for line in quoted.split("\n")) + "\n\n")
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.out.append(data)
+
+
+def html_to_markdown(html):
+    return MarkdownConverter().convert(html)
+
+
+def convert_post(title, content, post_date, markdown=False):
+    # The CPU-heavy part of one post, run in a worker process: returns the
+    # sanitized file name (without extension or collision suffix) and the text
+    sanitized_title = sanitize_filename(title)
+    name = sanitized_title.replace(' ', '_')[:MAX_NAME_LENGTH]
+    body = html_to_markdown(content) if markdown else unescape(content)
+    return name, f"Title: {title}\nDate: {post_date}\n\n{body}"
+
+
+def convert_batch(batch, markdown):
+    return [convert_post(title, content, post_date, markdown) for title, content, post_date in batch]
+
+
+def batched(iterable, size):
+    batch = []
+    for value in iterable:
+        batch.append(value)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def convert_posts(posts, workers, markdown=False):
+    # Run convert_post over the posts on a process pool, yielding the results in
+    # the same order as the posts. Only a few batches per worker are in flight,
+    # so the parser never runs far ahead of the conversion.
+    if workers <= 1:
+        for title, content, post_date in posts:
+            yield convert_post(title, content, post_date, markdown)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch in batched(posts, BATCH_SIZE):
+            in_flight.append(executor.submit(convert_batch, batch, markdown))
+            if len(in_flight) >= workers * BATCHES_PER_WORKER:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def write_file(filepath, text):
+    # Written to a temporary file and moved into place, so a file is never left half-written
+    directory, filename = os.path.split(filepath)
+    temp_path = os.path.join(directory, f".{filename}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, filepath)
+
+
+def remove_file(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
+class PostWriter:
+    # Writes files on a small thread pool. write() blocks once enough writes are
+    # queued, so a slow disk holds up the pipeline rather than filling memory.
+
+    def __init__(self, writers=DEFAULT_WRITERS):
+        self.executor = ThreadPoolExecutor(max_workers=writers, thread_name_prefix="writer")
+        self.slots = threading.BoundedSemaphore(writers * WRITES_PER_WRITER)
+        self.errors = []
+
+    def write(self, filepath, text):
+        self.slots.acquire()
+        self.executor.submit(write_file, filepath, text).add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def html_to_text(html):
+    # Plain text for the full-text index: tags dropped, entities decoded
+    return unescape(re.sub(r"<[^>]+>", " ", html))
+
+
+def post_record(item):
+    # One item as (posts row, comments rows) for the database
+    post_id = item.findtext(POST_ID_TAG) or item.findtext("guid") or ""
+    html = item.findtext(CONTENT_TAG) or ""
+    categories = [c.text or "" for c in item.findall("category") if c.get("domain") == "category"]
+    tags = [c.text or "" for c in item.findall("category") if c.get("domain") == "post_tag"]
+    post = (
+        post_id,
+        item.findtext("title") or "Untitled",
+        item.findtext(POST_DATE_TAG) or "",
+        item.findtext(WP + "post_modified") or "",
+        item.findtext(WP + "post_type") or "",
+        item.findtext(WP + "status") or "",
+        item.findtext("link") or "",
+        ", ".join(categories),
+        ", ".join(tags),
+        html,
+        html_to_text(html),
+    )
+    comments = [
+        (comment.findtext(WP + "comment_id"), post_id, comment.findtext(WP + "comment_author"),
+         comment.findtext(WP + "comment_date"), comment.findtext(WP + "comment_approved"),
+         comment.findtext(WP + "comment_content"))
+        for comment in item.findall(WP + "comment")
+    ]
+    return post, comments
+
+
+def load_database(xml_file, db_path, batch_size=DATABASE_BATCH):
+    # Stream every item into a fresh SQLite database, batch_size posts per transaction,
+    # then build the full-text index in one go. It's built under a temporary name and
+    # swapped in at the end, so searches keep working on the old one meanwhile.
+    temp_path = db_path + ".tmp"
+    remove_file(temp_path)
+    conn = sqlite3.connect(temp_path)
+    # Nothing to protect until the file is swapped in
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    for statement in DATABASE_SCHEMA:
+        conn.execute(statement)
+
+    started = time.perf_counter()
+    count = 0
+    posts = []
+    # {post_id: comment rows} - a post that turns up twice keeps only its last comments
+    comments = {}
+    loaded = set()
+
+    def insert():
+        # Post ids seen in an earlier batch are replaced, comments and all
+        repeated = [(post_id,) for post_id in comments if post_id in loaded]
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", posts)
+            conn.executemany("DELETE FROM comments WHERE post_id = ?", repeated)
+            conn.executemany("INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?)",
+                             [row for rows in comments.values() for row in rows])
+        loaded.update(comments)
+        posts.clear()
+        comments.clear()
+
+    for item in iter_items(xml_file):
+        post, post_comments = post_record(item)
+        posts.append(post)
+        comments[post[0]] = post_comments
+        count += 1
+        if len(posts) >= batch_size:
+            insert()
+        if count % PROGRESS_EVERY == 0:
+            elapsed = time.perf_counter() - started
+            print(f"{count:,} posts loaded ({count / elapsed:,.0f} items/sec)")
+    insert()
+
+    with conn:
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        conn.execute("CREATE INDEX idx_comments_post_id ON comments (post_id)")
+        conn.execute("CREATE INDEX idx_posts_date ON posts (date)")
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+    conn.close()
+    os.replace(temp_path, db_path)
+
+    elapsed = time.perf_counter() - started
+    print(f"Posts loaded into: {db_path}")
+    print(f"{count:,} posts in {elapsed:.1f}s ({count / max(elapsed, 1e-9):,.0f} items/sec)")
+
+
+def extract_posts(xml_file, workers=1, writers=DEFAULT_WRITERS, markdown=False, full=False):
     output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output_posts")
 
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    
-    # Define the WordPress namespace (common in exports)
-    ns = {'wp': 'http://wordpress.org/export/1.2/'}
-    
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
 
-    for item in root.findall(".//item"):
-        title = item.find("title").text or "Untitled"
-        content = item.find("{http://purl.org/rss/1.0/modules/content/}encoded").text or ""
-        post_date = item.find("{http://wordpress.org/export/1.2/}post_date").text or "Unknown Date"
-        
-        # Clean and sanitize title for filename
-        sanitized_title = sanitize_filename(title)
-        filename = f"{sanitized_title.replace(' ', '_')}.txt"
-        filepath = os.path.join(output_dir, filename)
-        
-        # Write post content to file
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(f"Title: {title}\n")
-            f.write(f"Date: {post_date}\n\n")
-            f.write(unescape(content))
+    extension = ".md" if markdown else ".txt"
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+    known = manifest.posts
+    # Names the last run handed out stay taken, so existing posts keep their files
+    used = {row[0].lower() for row in known.values()}
+    # One listing up front, so a post whose file was deleted since is written again
+    existing = set(os.listdir(output_dir))
+    seen = set()
+    pending = deque()
+    updates = []
+    stale = []
+    started = time.perf_counter()
+    count = 0
 
+    def changed_posts():
+        # Posts whose file needs (re)writing; unchanged ones are skipped before any conversion
+        nonlocal count
+        for post_id, modified, title, content, post_date in iter_posts(xml_file):
+            seen.add(post_id)
+            content_hash = post_hash(title, content, post_date, markdown)
+            last = known.get(post_id)
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{count:,} posts read ({count / elapsed:,.0f} items/sec)")
+            if (not full and last is not None and last[2] == content_hash and last[3] == modified
+                    and last[0] in existing):
+                continue
+            pending.append((post_id, content_hash, modified))
+            yield title, content, post_date
+
+    with PostWriter(writers) as writer:
+        # Parsing happens here, conversion in the worker processes and writing on the
+        # writer threads. Names are handed out here, in export order, so the output is
+        # the same whatever the number of workers.
+        for name, text in convert_posts(changed_posts(), workers, markdown):
+            post_id, content_hash, modified = pending.popleft()
+            last = known.get(post_id)
+            if last is not None and last[1] == name and last[0].endswith(extension):
+                filename = last[0]
+            else:
+                filename = unique_filename(name, extension, used)
+                if last is not None:
+                    # Renamed - the old file goes once the new one is written
+                    stale.append(last[0])
+            writer.write(os.path.join(output_dir, filename), text)
+            updates.append((post_id, filename, name, content_hash, modified))
+
+    # Posts no longer in the export
+    removed = [post_id for post_id in known if post_id not in seen]
+    stale.extend(known[post_id][0] for post_id in removed)
+    for filename in stale:
+        remove_file(os.path.join(output_dir, filename))
+    manifest.save(updates, removed)
+    manifest.close()
+
+    elapsed = time.perf_counter() - started
     print(f"Posts extracted to: {output_dir}")
+    print(f"{count:,} posts in {elapsed:.1f}s ({count / max(elapsed, 1e-9):,.0f} items/sec): "
+          f"{len(updates):,} written, {count - len(updates):,} unchanged, {len(removed):,} removed")
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export each post in a WordPress XML export to its own file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes converting posts (default: one per CPU; 1 = no worker processes)")
+    parser.add_argument("--writers", type=int, default=DEFAULT_WRITERS, help="Threads writing files")
+    parser.add_argument("--markdown", action="store_true", help="Convert each post's HTML to Markdown (.md files)")
+    parser.add_argument("--full", action="store_true", help="Rewrite every post, not just the ones that changed")
+    parser.add_argument("--sqlite", nargs="?", const=DATABASE_NAME, metavar="DB",
+                        help=f"Load the posts into a searchable SQLite database instead of writing files "
+                             f"(default: {DATABASE_NAME}); search it with WP_Search.py")
+    args = parser.parse_args()
 
-# Automatically find and run extraction on the first XML file found
-xml_file = find_xml_file()
-if xml_file:
-    print(f"Found XML file: {xml_file}")
-    extract_posts(xml_file)
-else:
-    print("No XML file found in the current directory.")
+    # Automatically find and run extraction on the first XML file found
+    xml_file = find_xml_file()
+    if xml_file:
+        print(f"Found XML file: {xml_file}")
+        if args.sqlite:
+            load_database(xml_file, os.path.join(os.path.dirname(os.path.abspath(__file__)), args.sqlite))
+        else:
+            extract_posts(xml_file, args.workers, args.writers, args.markdown, args.full)
+    else:
+        print("No XML file found in the current directory.")